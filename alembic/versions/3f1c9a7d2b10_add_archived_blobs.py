@@ -0,0 +1,39 @@
+"""Add archived_blobs pack index
+
+Revision ID: 3f1c9a7d2b10
+Revises: 165620071656
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b10'
+down_revision: Union[str, None] = '165620071656'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'archived_blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('pack_name', sa.String(length=64), nullable=False),
+        sa.Column('offset', sa.BigInteger(), nullable=False),
+        sa.Column('length', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_archived_blobs_id'), 'archived_blobs', ['id'], unique=False)
+    op.create_index(op.f('ix_archived_blobs_hash'), 'archived_blobs', ['hash'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_archived_blobs_hash'), table_name='archived_blobs')
+    op.drop_index(op.f('ix_archived_blobs_id'), table_name='archived_blobs')
+    op.drop_table('archived_blobs')
@@ -0,0 +1,36 @@
+"""Add image metadata columns to drawings
+
+Revision ID: a4d8e61f0c27
+Revises: 7b2e4d9c1a55
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d8e61f0c27'
+down_revision: Union[str, None] = '7b2e4d9c1a55'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('drawings', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('drawings', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('drawings', sa.Column('dpi', sa.Integer(), nullable=True))
+    op.add_column('drawings', sa.Column('color_mode', sa.String(length=10), nullable=True))
+    op.add_column('drawings', sa.Column('page_count', sa.Integer(), nullable=True))
+    op.add_column('drawings', sa.Column('orientation', sa.String(length=10), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('drawings', 'orientation')
+    op.drop_column('drawings', 'page_count')
+    op.drop_column('drawings', 'color_mode')
+    op.drop_column('drawings', 'dpi')
+    op.drop_column('drawings', 'height')
+    op.drop_column('drawings', 'width')
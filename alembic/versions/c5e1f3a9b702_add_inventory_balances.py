@@ -0,0 +1,53 @@
+"""Add inventory balance rollup tables
+
+Revision ID: c5e1f3a9b702
+Revises: a4d8e61f0c27
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e1f3a9b702'
+down_revision: Union[str, None] = 'a4d8e61f0c27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_part_balances',
+        sa.Column('part_number', sa.String(), nullable=False),
+        sa.Column('quantity', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('part_number')
+    )
+    op.create_table(
+        'inventory_batch_balances',
+        sa.Column('part_number', sa.String(), nullable=False),
+        sa.Column('batch_number', sa.String(), nullable=False),
+        sa.Column('quantity', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('part_number', 'batch_number')
+    )
+
+    # Начальные остатки из накопленной истории сканов
+    op.execute(
+        "INSERT INTO inventory_part_balances (part_number, quantity) "
+        "SELECT COALESCE(part_number, ''), COALESCE(SUM(quantity), 0) "
+        "FROM inventory GROUP BY COALESCE(part_number, '')"
+    )
+    op.execute(
+        "INSERT INTO inventory_batch_balances (part_number, batch_number, quantity) "
+        "SELECT COALESCE(part_number, ''), COALESCE(batch_number, ''), COALESCE(SUM(quantity), 0) "
+        "FROM inventory GROUP BY COALESCE(part_number, ''), COALESCE(batch_number, '')"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_batch_balances')
+    op.drop_table('inventory_part_balances')
@@ -0,0 +1,31 @@
+"""Add composite index on production order date window
+
+Revision ID: d2a7b8c4e916
+Revises: c5e1f3a9b702
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a7b8c4e916'
+down_revision: Union[str, None] = 'c5e1f3a9b702'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_production_orders_date_window',
+        'production_orders',
+        ['desired_production_date_start', 'desired_production_date_end'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_production_orders_date_window', table_name='production_orders')
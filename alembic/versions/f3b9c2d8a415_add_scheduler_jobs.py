@@ -0,0 +1,38 @@
+"""Add scheduler_jobs table for periodic job bookkeeping
+
+Revision ID: f3b9c2d8a415
+Revises: d2a7b8c4e916
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b9c2d8a415'
+down_revision: Union[str, None] = 'd2a7b8c4e916'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'scheduler_jobs',
+        sa.Column('job_id', sa.String(length=100), nullable=False),
+        sa.Column('leader', sa.String(length=100), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('last_started_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('last_finished_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('last_duration_ms', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('heartbeat_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('next_run_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('job_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('scheduler_jobs')
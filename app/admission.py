@@ -0,0 +1,228 @@
+"""
+Управление допуском для тяжелых запросов.
+
+Маршруты разбиты на классы (interactive, render, bulk, export). У каждого класса
+есть приоритет, собственный лимит одновременных запросов и ограниченная
+очередь ожидания; все классы делят общий пул слотов. Освободившийся слот
+получает самый приоритетный ожидающий, поэтому просмотр чертежа у станка
+не стоит в очереди за пакетной загрузкой. Если очередь класса заполнена или
+ожидание слишком долгое, запрос сразу получает 503 с Retry-After.
+
+Параметры задаются переменными окружения:
+    ADMISSION_CAPACITY, ADMISSION_<КЛАСС>_CONCURRENCY,
+    ADMISSION_<КЛАСС>_QUEUE, ADMISSION_<КЛАСС>_TIMEOUT
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_number(name: str, default, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+class RouteClass:
+    def __init__(self, name: str, priority: int, concurrency: int, queue: int, timeout: float,
+                 hold_body: bool = True):
+        prefix = f"ADMISSION_{name.upper()}"
+        self.name = name
+        # False — слот освобождается после отправки заголовков ответа, а не
+        # после всего тела: передача готового файла медленному клиенту не
+        # должна занимать общий пул
+        self.hold_body = hold_body
+        self.priority = priority
+        self.concurrency = _env_number(f"{prefix}_CONCURRENCY", concurrency)
+        self.max_queue = _env_number(f"{prefix}_QUEUE", queue)
+        self.timeout = _env_number(f"{prefix}_TIMEOUT", timeout, float)
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class Rejected(Exception):
+    def __init__(self, route_class: RouteClass, reason: str):
+        super().__init__(reason)
+        self.route_class = route_class
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(self, capacity: int, classes: List[RouteClass]):
+        self.capacity = capacity
+        self.active = 0
+        self.classes: Dict[str, RouteClass] = {c.name: c for c in classes}
+        # Меньшее число — более высокий приоритет
+        self._by_priority = sorted(classes, key=lambda c: c.priority)
+
+    def _can_start(self, route_class: RouteClass) -> bool:
+        return self.active < self.capacity and route_class.active < route_class.concurrency
+
+    def _has_priority_waiters(self, route_class: RouteClass) -> bool:
+        return any(c.waiters for c in self._by_priority if c.priority <= route_class.priority)
+
+    def _start(self, route_class: RouteClass) -> None:
+        self.active += 1
+        route_class.active += 1
+
+    async def acquire(self, name: str) -> RouteClass:
+        route_class = self.classes[name]
+        if self._can_start(route_class) and not self._has_priority_waiters(route_class):
+            self._start(route_class)
+            return route_class
+
+        if len(route_class.waiters) >= route_class.max_queue:
+            raise Rejected(route_class, "очередь заполнена")
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), route_class.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот выдан в момент истечения таймаута — возвращаем его
+                self.release(route_class)
+            raise Rejected(route_class, "превышено время ожидания")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class)
+            raise
+        finally:
+            if waiter in route_class.waiters:
+                route_class.waiters.remove(waiter)
+            if not waiter.done():
+                waiter.cancel()
+        return route_class
+
+    def release(self, route_class: RouteClass) -> None:
+        self.active -= 1
+        route_class.active -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        for route_class in self._by_priority:
+            while route_class.waiters and self._can_start(route_class):
+                waiter = route_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._start(route_class)
+                waiter.set_result(None)
+
+    def retry_after(self, route_class: RouteClass) -> int:
+        return max(1, int(route_class.timeout))
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "classes": {
+                c.name: {"active": c.active, "queued": len(c.waiters), "concurrency": c.concurrency}
+                for c in self._by_priority
+            },
+        }
+
+
+# (метод или None для любого, регулярное выражение пути, класс)
+ROUTE_RULES: List[Tuple[Optional[str], "re.Pattern", str]] = [
+    ("GET", re.compile(r"^/view_drawing/\d+$"), "interactive"),
+    ("GET", re.compile(r"^/drawing_files/"), "interactive"),
+    ("GET", re.compile(r"^/combine_drawing_with_qr/\d+/\d+$"), "render"),
+    ("POST", re.compile(r"^/create_order$"), "bulk"),
+    ("POST", re.compile(r"^/upload_drawing$"), "bulk"),
+    ("POST", re.compile(r"^/edit_production_order/\d+$"), "bulk"),
+    ("PUT", re.compile(r"^/update_order/\d+$"), "bulk"),
+    ("PATCH", re.compile(r"^/uploads/[0-9a-f]+$"), "bulk"),
+    ("POST", re.compile(r"^/import_orders$"), "bulk"),
+    ("GET", re.compile(r"^/export/"), "export"),
+]
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    for rule_method, pattern, name in ROUTE_RULES:
+        if (rule_method is None or rule_method == method) and pattern.match(path):
+            return name
+    return None
+
+
+def default_controller() -> AdmissionController:
+    capacity = _env_number("ADMISSION_CAPACITY", 16)
+    return AdmissionController(
+        capacity=capacity,
+        classes=[
+            # Четверть пула всегда остается тяжелым классам
+            RouteClass("interactive", priority=0, concurrency=max(1, capacity * 3 // 4), queue=100, timeout=10.0,
+                       hold_body=False),
+            RouteClass("render", priority=1, concurrency=4, queue=20, timeout=15.0),
+            RouteClass("bulk", priority=2, concurrency=2, queue=10, timeout=30.0),
+            # Выгрузка держит слот все время передачи файла
+            RouteClass("export", priority=3, concurrency=2, queue=5, timeout=30.0),
+        ],
+    )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI-middleware: слот занимается до полной отправки ответа или, для
+    классов с hold_body=False, до отправки заголовков.
+    """
+
+    def __init__(self, app, controller: AdmissionController = None):
+        self.app = app
+        self.controller = controller or default_controller()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name = classify(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            route_class = await self.controller.acquire(name)
+        except Rejected as e:
+            logger.warning("Запрос %s %s отклонен (%s): %s", scope['method'], scope['path'], e.route_class.name, e.reason)
+            metrics.admission_rejections.inc(route_class=e.route_class.name)
+            await self._reject(send, self.controller.retry_after(e.route_class))
+            return
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(route_class)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and not route_class.hold_body:
+                release()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
+
+    @staticmethod
+    async def _reject(send, retry_after: int):
+        body = json.dumps({"detail": "Сервер перегружен, повторите запрос позже"}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
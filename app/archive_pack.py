@@ -0,0 +1,307 @@
+"""
+Холодное хранилище архивных чертежей.
+
+Архивные чертежи (Drawing.archived_at) переносятся из отдельных файлов в
+append-only pack-файлы static/archived_drawings/packs/pack-NNNNNN.pack.
+Таблица archived_blobs хранит для каждого хеша имя pack-файла, смещение и
+длину, так что чтение — это один pread без распаковки. Бэкапы и обходы
+каталогов видят несколько больших файлов вместо сотен тысяч мелких.
+
+Чертежи, привязанные к нескольким заказам, не упаковываются. Если
+архивный чертеж снова привязывают к заказу, unarchive_drawing снимает
+архивный статус и возвращает файл из pack-файла.
+
+Каждая запись в pack-файле снабжена заголовком (магия, хеш, длина), поэтому
+индекс можно восстановить из самих pack-файлов: rebuild_index().
+
+    python -m app.archive_pack --min-age-days 30
+"""
+import argparse
+import binascii
+import fcntl
+import logging
+import os
+import re
+import struct
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional, Tuple
+
+from sqlalchemy import exists, func, select
+
+from app import models
+from app.database import SessionLocal
+from app.drawing_delivery import resolve_static_path
+from app.utils import drawing_store
+
+logger = logging.getLogger(__name__)
+
+PACK_DIR = os.path.join("static", "archived_drawings", "packs")
+PACK_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MIN_AGE = timedelta(days=30)
+DEFAULT_BATCH_SIZE = 200
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Заголовок записи: магия, SHA-256 (32 байта), длина данных
+RECORD_MAGIC = b"DPK1"
+RECORD_HEADER = struct.Struct(">4s32sQ")
+_PACK_NAME_RE = re.compile(r"^pack-(\d{6})\.pack$")
+
+
+def pack_path(pack_name: str) -> str:
+    return os.path.join(PACK_DIR, pack_name)
+
+
+@contextmanager
+def _pack_lock():
+    """
+    Межпроцессная блокировка: дописывать в pack-файлы может только один процесс.
+    """
+    os.makedirs(PACK_DIR, exist_ok=True)
+    with open(os.path.join(PACK_DIR, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _current_pack_name(incoming_size: int) -> str:
+    numbers = sorted(
+        int(m.group(1)) for m in (_PACK_NAME_RE.match(name) for name in os.listdir(PACK_DIR)) if m
+    )
+    if numbers:
+        name = f"pack-{numbers[-1]:06d}.pack"
+        size = os.path.getsize(pack_path(name))
+        if size == 0 or size + RECORD_HEADER.size + incoming_size <= PACK_MAX_BYTES:
+            return name
+        return f"pack-{numbers[-1] + 1:06d}.pack"
+    return "pack-000001.pack"
+
+
+def append_file(file_hash: str, source_path: str) -> Tuple[str, int, int]:
+    """
+    Дописывает файл в текущий pack-файл и возвращает (pack_name, offset, length).
+    Данные синхронизируются на диск до возврата.
+    """
+    length = os.path.getsize(source_path)
+    with _pack_lock():
+        name = _current_pack_name(length)
+        with open(pack_path(name), "ab") as pack, open(source_path, "rb") as source:
+            pack.seek(0, os.SEEK_END)
+            pack.write(RECORD_HEADER.pack(RECORD_MAGIC, binascii.unhexlify(file_hash), length))
+            offset = pack.tell()
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                pack.write(chunk)
+            pack.flush()
+            os.fsync(pack.fileno())
+    return name, offset, length
+
+
+def read_range(blob: models.ArchivedBlob, start: int = 0, length: Optional[int] = None) -> bytes:
+    """
+    Читает диапазон архивного чертежа прямо из pack-файла.
+    """
+    if length is None:
+        length = blob.length - start
+    fd = os.open(pack_path(blob.pack_name), os.O_RDONLY)
+    try:
+        return os.pread(fd, length, blob.offset + start)
+    finally:
+        os.close(fd)
+
+
+def iter_range(blob: models.ArchivedBlob, start: int, length: int, chunk_size: int = 256 * 1024) -> Iterator[bytes]:
+    fd = os.open(pack_path(blob.pack_name), os.O_RDONLY)
+    try:
+        position = blob.offset + start
+        remaining = length
+        while remaining > 0:
+            chunk = os.pread(fd, min(chunk_size, remaining), position)
+            if not chunk:
+                break
+            position += len(chunk)
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+
+def get_blob(db, file_hash: str) -> Optional[models.ArchivedBlob]:
+    return db.query(models.ArchivedBlob).filter(models.ArchivedBlob.hash == file_hash).first()
+
+
+def read_drawing_bytes(db, drawing: models.Drawing) -> Optional[bytes]:
+    """
+    Содержимое чертежа из обычного хранилища или, если его там нет, из pack-файла.
+    """
+    path = resolve_static_path(drawing.file_path)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    blob = get_blob(db, drawing.hash)
+    if blob:
+        return read_range(blob)
+    return None
+
+
+def restore_drawing(db, drawing: models.Drawing) -> bool:
+    """
+    Возвращает архивный чертеж в обычное хранилище.
+    Запись в pack-файле остается: он append-only.
+    """
+    path = resolve_static_path(drawing.file_path)
+    if os.path.exists(path):
+        return True
+    blob = get_blob(db, drawing.hash)
+    if not blob:
+        return False
+    drawing_store.write_atomic(path, read_range(blob))
+    logger.info("Чертеж %s восстановлен из %s", drawing.hash, blob.pack_name)
+    return True
+
+
+def unarchive_drawing(db, drawing: models.Drawing) -> bool:
+    """
+    Снимает архивный статус с чертежа, который снова привязывают к заказу,
+    и возвращает его файл из pack-файла. Коммит — за вызывающим.
+    Блокирующая: из обработчиков вызывать через asyncio.to_thread.
+    """
+    if drawing.archived_at is None:
+        return True
+    if not restore_drawing(db, drawing):
+        logger.error("Не удалось восстановить архивный чертеж %s: нет ни файла, ни записи в pack-файле", drawing.hash)
+        return False
+    drawing.archived_at = None
+    return True
+
+
+def pack_archived_drawings(
+    db,
+    min_age: timedelta = DEFAULT_MIN_AGE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+) -> int:
+    """
+    Переносит в pack-файлы чертежи, архивированные раньше min_age.
+    Порядок: запись и fsync pack-файла, коммит индекса, затем удаление
+    исходного файла — сбой на любом шаге не теряет данные.
+    """
+    cutoff = datetime.now(timezone.utc) - min_age
+    already_packed = exists().where(models.ArchivedBlob.hash == models.Drawing.hash)
+    # archived_at общий для чертежа: чертеж, привязанный к нескольким заказам,
+    # мог быть убран только из одного из них и нужен остальным
+    order_count = (
+        select(func.count(func.distinct(models.OrderDrawing.order_id)))
+        .where(models.OrderDrawing.drawing_id == models.Drawing.id)
+        .scalar_subquery()
+    )
+    packed = 0
+    last_id = 0
+    while True:
+        drawings = db.execute(
+            select(models.Drawing)
+            .where(
+                models.Drawing.id > last_id,
+                models.Drawing.archived_at != None,
+                models.Drawing.archived_at < cutoff,
+                ~already_packed,
+                order_count <= 1,
+            )
+            .order_by(models.Drawing.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not drawings:
+            break
+        last_id = drawings[-1].id
+
+        for drawing in drawings:
+            source_path = resolve_static_path(drawing.file_path)
+            if not os.path.exists(source_path):
+                logger.warning("Файл архивного чертежа не найден: %s", source_path)
+                continue
+            if dry_run:
+                logger.info("Будет упакован: %s", source_path)
+                packed += 1
+                continue
+
+            pack_name, offset, length = append_file(drawing.hash, source_path)
+            db.add(models.ArchivedBlob(hash=drawing.hash, pack_name=pack_name, offset=offset, length=length))
+            db.commit()
+            # Производные файлы (<хеш>.<суффикс>) остаются рядом с исходным путем
+            os.remove(source_path)
+            packed += 1
+
+        logger.info("Упаковано архивных чертежей: %s", packed)
+    return packed
+
+
+def iter_pack_records(name: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Последовательно читает записи pack-файла: (hash, offset, length).
+    """
+    with open(pack_path(name), "rb") as pack:
+        while True:
+            header = pack.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            magic, raw_hash, length = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC:
+                raise ValueError(f"Поврежденная запись в {name} на смещении {pack.tell() - RECORD_HEADER.size}")
+            offset = pack.tell()
+            yield binascii.hexlify(raw_hash).decode(), offset, length
+            pack.seek(length, os.SEEK_CUR)
+
+
+def rebuild_index(db) -> int:
+    """
+    Восстанавливает archived_blobs по содержимому pack-файлов.
+    """
+    restored = 0
+    if not os.path.isdir(PACK_DIR):
+        return restored
+    for name in sorted(os.listdir(PACK_DIR)):
+        if not _PACK_NAME_RE.match(name):
+            continue
+        for file_hash, offset, length in iter_pack_records(name):
+            if get_blob(db, file_hash):
+                continue
+            db.add(models.ArchivedBlob(hash=file_hash, pack_name=name, offset=offset, length=length))
+            restored += 1
+        db.commit()
+    return restored
+
+
+def run_packing(**kwargs) -> int:
+    db = SessionLocal()
+    try:
+        return pack_archived_drawings(db, **kwargs)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Упаковка архивных чертежей в pack-файлы")
+    parser.add_argument("--min-age-days", type=float, default=DEFAULT_MIN_AGE.days)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--rebuild-index", action="store_true", help="Восстановить индекс по pack-файлам")
+    args = parser.parse_args()
+
+    if args.rebuild_index:
+        db = SessionLocal()
+        try:
+            logger.info("Восстановлено записей индекса: %s", rebuild_index(db))
+        finally:
+            db.close()
+        return
+
+    run_packing(min_age=timedelta(days=args.min_age_days), batch_size=args.batch_size, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
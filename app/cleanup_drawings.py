@@ -1,47 +1,192 @@
-import os
-from pathlib import Path
+"""
+Сборщик мусора для файлов чертежей.
+
+За один проход по БД собирается множество живых путей (чертежи из drawings,
+привязанные через order_drawings, и QR-коды заказов), затем один раз
+обходятся каталоги с файлами и удаляется все, на что никто не ссылается.
+Удаление идет порциями с ограничением скорости, поэтому большой объем мусора
+разбирается за несколько запусков, не нагружая диск.
+
+    python -m app.cleanup_drawings --dry-run
+    python -m app.cleanup_drawings --max-deletes 5000 --rate 100
+"""
+import argparse
 import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Set
+
+from sqlalchemy import delete, exists, or_, select
+
+from app import models
+from app.database import SessionLocal
 
 logger = logging.getLogger(__name__)
 
-def cleanup_original_drawings(order_number: str):
-    modified_drawings_dir = Path("static/modified_drawings")
-    original_drawings_dir = Path("static/drawings")
-
-    if not modified_drawings_dir.exists() or not original_drawings_dir.exists():
-        logger.warning("Одна из директорий не существует. Очистка невозможна.")
-        return
-
-    # Ищем все файлы, начинающиеся с номера заказа в папке с оригинальными чертежами
-    original_drawings = list(original_drawings_dir.glob(f"{order_number}*"))
-
-    if original_drawings:
-        for original_drawing in original_drawings:
-            # Проверяем, существует ли модифицированная версия
-            modified_drawing = list(modified_drawings_dir.glob(f"{order_number}*"))
-            if modified_drawing:
-                try:
-                    original_drawing.unlink()
-                    logger.info(f"Удален оригинальный чертеж: {original_drawing}")
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении файла {original_drawing}: {str(e)}")
-            else:
-                logger.warning(f"Модифицированный чертеж для {original_drawing.name} не найден. Пропускаем удаление.")
-    else:
-        logger.warning(f"Оригинальные чертежи для заказа {order_number} не найдены.")
-
-    # Удаляем стандартизированные версии, если они есть
-    standardized_drawings = list(original_drawings_dir.glob(f"{order_number}*_standardized.png"))
-    for std_drawing in standardized_drawings:
+STATIC_DIR = "static"
+GC_ROOTS = [
+    os.path.join(STATIC_DIR, "drawings"),
+    os.path.join(STATIC_DIR, "modified_drawings"),
+    os.path.join(STATIC_DIR, "qr_codes"),
+]
+
+# Файлы моложе этого возраста не трогаем: запрос мог записать файл,
+# но еще не закоммитить ссылку на него
+DEFAULT_MIN_AGE = timedelta(hours=24)
+DEFAULT_MAX_DELETES = 1000
+DEFAULT_DELETES_PER_SECOND = 50
+
+
+def _normalize(path: str) -> str:
+    if not path.startswith(STATIC_DIR + "/"):
+        path = os.path.join(STATIC_DIR, path.lstrip("/"))
+    return os.path.normpath(path)
+
+
+def _owner_path(path: str) -> str:
+    """
+    Производные файлы (QR-коды, превью) лежат рядом с оригиналом и называются
+    <хеш>.<суффикс>, поэтому принадлежат тому же объекту, что и <хеш>.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, name.split(".", 1)[0])
+
+
+def collect_live_paths(db, unlinked_grace: timedelta = None) -> Set[str]:
+    """
+    Собирает множество путей, на которые есть ссылки в БД.
+
+    Если задан unlinked_grace, чертежи без единой связи в order_drawings,
+    не использовавшиеся дольше этого срока, считаются мертвыми.
+    """
+    live = set()
+
+    drawings = select(models.Drawing.file_path)
+    if unlinked_grace is not None:
+        cutoff = datetime.now(timezone.utc) - unlinked_grace
+        linked = exists().where(models.OrderDrawing.drawing_id == models.Drawing.id)
+        drawings = drawings.where(or_(linked, models.Drawing.last_used_at >= cutoff))
+    for (file_path,) in db.execute(drawings.execution_options(yield_per=5000)):
+        live.add(_normalize(file_path))
+
+    qr_codes = select(models.ProductionOrder.qr_code_path).where(models.ProductionOrder.qr_code_path != None)
+    for (qr_code_path,) in db.execute(qr_codes.execution_options(yield_per=5000)):
+        live.add(_normalize(qr_code_path))
+
+    return live
+
+
+def prune_unlinked_drawings(db, unlinked_grace: timedelta) -> int:
+    """
+    Удаляет записи чертежей без связей с заказами (их файлы затем уберет обход).
+    """
+    cutoff = datetime.now(timezone.utc) - unlinked_grace
+    linked = exists().where(models.OrderDrawing.drawing_id == models.Drawing.id)
+    result = db.execute(
+        delete(models.Drawing)
+        .where(~linked, models.Drawing.last_used_at < cutoff)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def iter_candidate_files(roots: Iterable[str]):
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for directory, _, files in os.walk(root):
+            for name in files:
+                yield os.path.normpath(os.path.join(directory, name))
+
+
+def collect_garbage(
+    db,
+    min_age: timedelta = DEFAULT_MIN_AGE,
+    max_deletes: int = DEFAULT_MAX_DELETES,
+    deletes_per_second: float = DEFAULT_DELETES_PER_SECOND,
+    unlinked_grace: timedelta = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Удаляет файлы, на которые нет ссылок в БД. Возвращает статистику прохода.
+    """
+    if unlinked_grace is not None and not dry_run:
+        pruned = prune_unlinked_drawings(db, unlinked_grace)
+        logger.info("Удалено записей чертежей без связей: %s", pruned)
+
+    live = collect_live_paths(db, unlinked_grace)
+    logger.info("Живых ссылок на файлы: %s", len(live))
+
+    cutoff = time.time() - min_age.total_seconds()
+    delay = 1.0 / deletes_per_second if deletes_per_second > 0 else 0
+    stats = {"scanned": 0, "deleted": 0, "freed_bytes": 0, "skipped_young": 0, "errors": 0}
+
+    for path in iter_candidate_files(GC_ROOTS):
+        stats["scanned"] += 1
+        if path in live or _owner_path(path) in live:
+            continue
         try:
-            std_drawing.unlink()
-            logger.info(f"Удален стандартизированный чертеж: {std_drawing}")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении стандартизированного файла {std_drawing}: {str(e)}")
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime > cutoff:
+            stats["skipped_young"] += 1
+            continue
+
+        if dry_run:
+            logger.info("Будет удален: %s", path)
+        else:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error("Ошибка при удалении файла %s: %s", path, e)
+                stats["errors"] += 1
+                continue
+            if delay:
+                time.sleep(delay)
+        stats["deleted"] += 1
+        stats["freed_bytes"] += stat.st_size
+
+        if stats["deleted"] >= max_deletes:
+            logger.info("Достигнут лимит удалений за проход, остаток будет удален в следующий раз")
+            break
+
+    logger.info("Сборка мусора завершена: %s", stats)
+    return stats
+
+
+def run_garbage_collection(**kwargs) -> dict:
+    """
+    Точка входа для планировщика: открывает собственную сессию БД.
+    """
+    db = SessionLocal()
+    try:
+        return collect_garbage(db, **kwargs)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Удаление файлов чертежей, на которые нет ссылок в БД")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--min-age-hours", type=float, default=DEFAULT_MIN_AGE.total_seconds() / 3600)
+    parser.add_argument("--max-deletes", type=int, default=DEFAULT_MAX_DELETES)
+    parser.add_argument("--rate", type=float, default=DEFAULT_DELETES_PER_SECOND, help="Удалений в секунду")
+    parser.add_argument("--prune-unlinked-days", type=float, default=None,
+                        help="Удалять чертежи без связей с заказами, не использовавшиеся N дней")
+    args = parser.parse_args()
+
+    run_garbage_collection(
+        min_age=timedelta(hours=args.min_age_hours),
+        max_deletes=args.max_deletes,
+        deletes_per_second=args.rate,
+        unlinked_grace=timedelta(days=args.prune_unlinked_days) if args.prune_unlinked_days is not None else None,
+        dry_run=args.dry_run,
+    )
 
-    logger.info(f"Очистка оригинальных чертежей для заказа {order_number} завершена.")
 
-# Пример использования:
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    cleanup_original_drawings()
+    main()
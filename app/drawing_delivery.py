@@ -0,0 +1,150 @@
+import os
+import re
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+# Содержимое по хешу никогда не меняется, поэтому браузер может хранить его год
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+DRAWING_FILES_PREFIX = "/drawing_files"
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_valid_hash(file_hash: str) -> bool:
+    """
+    Проверяет, что строка похожа на SHA-256 в шестнадцатеричном виде.
+    """
+    return bool(_HASH_RE.match(file_hash))
+
+
+def drawing_url(file_hash: str) -> str:
+    """
+    Возвращает неизменяемый URL чертежа, построенный по его хешу.
+    """
+    return f"{DRAWING_FILES_PREFIX}/{file_hash}"
+
+
+def drawing_etag(file_hash: str) -> str:
+    """
+    Сильный ETag: хеш содержимого однозначно определяет ответ.
+    """
+    return f'"{file_hash}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Проверяет заголовок If-None-Match (список ETag через запятую или "*").
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Для If-None-Match используется слабое сравнение, поэтому W/ отбрасываем
+    candidates = [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+    return "*" in candidates or etag in candidates
+
+
+def resolve_static_path(file_path: str) -> str:
+    """
+    Приводит путь из БД (с префиксом static/ или без него) к пути на диске.
+    """
+    if file_path.startswith("static/"):
+        return file_path
+    return os.path.join("static", file_path.lstrip("/"))
+
+
+def immutable_headers(file_hash: str) -> dict:
+    return {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "ETag": drawing_etag(file_hash),
+    }
+
+
+def not_modified_response(file_hash: str) -> Response:
+    return Response(status_code=304, headers=immutable_headers(file_hash))
+
+
+def immutable_file_response(path: str, file_hash: str, media_type: str, file_name: str) -> FileResponse:
+    """
+    Отдает файл с долгим кешированием.
+
+    FileResponse сам обрабатывает Range/If-Range (206 Partial Content) и,
+    если ASGI-сервер поддерживает расширение http.response.pathsend,
+    передает файл без копирования в пространство пользователя.
+    """
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers=immutable_headers(file_hash),
+        filename=file_name,
+        content_disposition_type="inline",
+    )
+
+
+def inline_content_disposition(file_name: str) -> str:
+    # Так же, как FileResponse: не-ASCII имена передаются через filename*
+    quoted = quote(file_name)
+    if quoted != file_name:
+        return f"inline; filename*=utf-8''{quoted}"
+    return f'inline; filename="{file_name}"'
+
+
+def parse_single_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает заголовок Range с одним диапазоном и возвращает (start, end) включительно.
+    None — заголовка нет или он не поддерживается (тогда отдается весь файл).
+    ValueError — диапазон за пределами файла (416).
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # Суффикс: последние N байт
+            suffix = int(end_text)
+            if suffix == 0:
+                raise ValueError
+            return max(size - suffix, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError("Некорректный диапазон")
+    if start >= size or end < start:
+        raise ValueError("Диапазон вне файла")
+    return start, min(end, size - 1)
+
+
+def packed_blob_response(blob, file_hash: str, media_type: str, file_name: str,
+                         range_header: Optional[str], if_range: Optional[str]) -> Response:
+    """
+    Отдает архивный чертеж прямо из pack-файла с поддержкой одного диапазона Range.
+    """
+    from app import archive_pack
+
+    headers = immutable_headers(file_hash)
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Disposition"] = inline_content_disposition(file_name)
+
+    if if_range and if_range != drawing_etag(file_hash):
+        range_header = None
+    try:
+        byte_range = parse_single_range(range_header, blob.length)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{blob.length}"
+        return Response(status_code=416, headers=headers)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(blob.length)
+        return StreamingResponse(archive_pack.iter_range(blob, 0, blob.length), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{blob.length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        archive_pack.iter_range(blob, start, end - start + 1),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
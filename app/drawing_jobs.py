@@ -0,0 +1,113 @@
+"""
+Обработчики фоновых задач для чертежей.
+"""
+import io
+import logging
+import os
+from datetime import date
+
+from sqlalchemy.sql import func
+
+from app import archive_pack, drawing_metadata, image_processing, models, qr_codes, renditions
+from app.drawing_delivery import resolve_static_path
+from app.job_queue import PermanentJobError, enqueue_many, job_handler
+from app.utils import drawing_store
+
+logger = logging.getLogger(__name__)
+
+
+def standardize_drawing(db, drawing: models.Drawing) -> None:
+    path = resolve_static_path(drawing.file_path)
+    if not os.path.exists(path):
+        raise PermanentJobError(f"Файл чертежа не найден: {path}")
+    if drawing.page_count is None:
+        # Стандартизированный файл одностраничный — число страниц берется из исходного
+        drawing.page_count = drawing_metadata.extract_metadata(path)["page_count"]
+    original_size, new_size = image_processing.standardize_file(path)
+    drawing.file_size = os.path.getsize(path)
+    # После стандартизации меняются размеры и DPI
+    drawing_metadata.apply_metadata(
+        drawing, drawing_metadata.extract_metadata(path), drawing_metadata.REFRESH_FIELDS
+    )
+    drawing.processed_at = func.now()
+    db.commit()
+    logger.info("Чертеж %s стандартизирован: %s -> %s", drawing.id, original_size, new_size)
+
+
+def prerender_composite(db, order: models.ProductionOrder, drawing: models.Drawing) -> str:
+    """
+    Заранее рисует чертеж с QR-кодом на сегодняшнюю дату, чтобы сканирование
+    наклейки отдавало готовый файл.
+    """
+    cache_path = image_processing.composite_cache_path(order.id, drawing.id, date.today())
+    if os.path.exists(cache_path):
+        return cache_path
+
+    qr_code_path = resolve_static_path(order.qr_code_path)
+    drawing_source = resolve_static_path(drawing.file_path)
+    if not os.path.exists(drawing_source):
+        content = archive_pack.read_drawing_bytes(db, drawing)
+        if content is None:
+            raise PermanentJobError(f"Файл чертежа не найден: {drawing_source}")
+        drawing_source = io.BytesIO(content)
+
+    png = image_processing.render_composite(drawing_source, qr_code_path, date.today().strftime('%d.%m.%Y'))
+    drawing_store.write_atomic(cache_path, png)
+    return cache_path
+
+
+@job_handler("process_drawing")
+def handle_process_drawing(db, payload: dict) -> dict:
+    drawing = db.query(models.Drawing).filter(models.Drawing.id == payload["drawing_id"]).first()
+    if drawing is None:
+        raise PermanentJobError(f"Чертеж не найден: {payload['drawing_id']}")
+
+    if drawing.processed_at is None:
+        standardize_drawing(db, drawing)
+
+    result = {"drawing_id": drawing.id, "hash": drawing.hash}
+
+    # Миниатюра и превью для списков создаются один раз на хеш
+    path = resolve_static_path(drawing.file_path)
+    if os.path.exists(path):
+        renditions.generate_renditions(path, drawing.hash)
+
+    order_id = payload.get("order_id")
+    if order_id is not None:
+        order = db.query(models.ProductionOrder).filter(models.ProductionOrder.id == order_id).first()
+        if order is None:
+            raise PermanentJobError(f"Заказ не найден: {order_id}")
+        result["order_id"] = order.id
+        if order.qr_code_path:
+            result["composite_path"] = prerender_composite(db, order, drawing)
+
+    return result
+
+
+@job_handler("prepare_imported_order")
+def handle_prepare_imported_order(db, payload: dict) -> dict:
+    """
+    Доводит заказ из массового импорта: QR-код, привязка чертежей по хешам
+    и задачи их обработки. Повторный запуск ничего не дублирует.
+    """
+    order = db.query(models.ProductionOrder).filter(models.ProductionOrder.id == payload["order_id"]).first()
+    if order is None:
+        raise PermanentJobError(f"Заказ не найден: {payload['order_id']}")
+
+    if not order.qr_code_path or not os.path.exists(resolve_static_path(order.qr_code_path)):
+        order.qr_code_path = qr_codes.save_order_qr(order.id, order.order_number)
+
+    hashes = payload.get("drawing_hashes") or []
+    drawings = db.query(models.Drawing).filter(models.Drawing.hash.in_(hashes)).all() if hashes else []
+    linked = {od.drawing_id for od in order.drawings}
+    new_drawings = [drawing for drawing in drawings if drawing.id not in linked]
+    for drawing in new_drawings:
+        db.add(models.OrderDrawing(order_id=order.id, drawing_id=drawing.id))
+    if drawings and not order.drawing_link:
+        order.drawing_link = ','.join(drawing.file_path for drawing in drawings)
+    db.commit()
+
+    enqueue_many(db, "process_drawing", [
+        {"drawing_id": drawing.id, "order_id": order.id} for drawing in new_drawings
+    ])
+    return {"order_id": order.id, "qr_code_path": order.qr_code_path, "attached": len(new_drawings)}
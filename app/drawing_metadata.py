@@ -0,0 +1,141 @@
+"""
+Метаданные изображений чертежей: размеры в пикселях, DPI, цветовой режим,
+число страниц и ориентация. Записываются в Drawing при загрузке, чтобы
+решения о раскладке, списки и планирование печати не открывали файлы.
+
+Заполнение для уже загруженных чертежей:
+    python -m app.drawing_metadata --backfill
+"""
+import argparse
+import io
+import logging
+import os
+
+from PIL import Image
+from sqlalchemy import select, update
+
+from app import archive_pack, models
+from app.database import SessionLocal
+from app.drawing_delivery import resolve_static_path
+
+logger = logging.getLogger(__name__)
+
+LANDSCAPE = "landscape"
+PORTRAIT = "portrait"
+SQUARE = "square"
+
+# Значения EXIF Orientation, при которых изображение повернуто на 90°
+_EXIF_ORIENTATION_TAG = 274
+_ROTATED_EXIF_ORIENTATIONS = {5, 6, 7, 8}
+
+METADATA_FIELDS = ("width", "height", "dpi", "color_mode", "page_count", "orientation")
+# Стандартизация сохраняет только первую страницу, поэтому после нее число
+# страниц не перечитывается: оно известно лишь по исходному файлу
+REFRESH_FIELDS = tuple(field for field in METADATA_FIELDS if field != "page_count")
+
+
+def orientation_for(width: int, height: int) -> str:
+    if width > height:
+        return LANDSCAPE
+    if height > width:
+        return PORTRAIT
+    return SQUARE
+
+
+def extract_metadata(source) -> dict:
+    """
+    Читает только заголовок изображения (Image.open не декодирует пиксели).
+    source — путь, файловый объект или bytes.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        width, height = img.size
+        try:
+            exif_orientation = img.getexif().get(_EXIF_ORIENTATION_TAG)
+        except Exception:
+            exif_orientation = None
+        if exif_orientation in _ROTATED_EXIF_ORIENTATIONS:
+            # Для ориентации важно, как лист выглядит после поворота по EXIF
+            display_width, display_height = height, width
+        else:
+            display_width, display_height = width, height
+
+        dpi = img.info.get("dpi")
+        return {
+            "width": width,
+            "height": height,
+            "dpi": int(round(dpi[0])) if dpi else None,
+            "color_mode": img.mode,
+            "page_count": getattr(img, "n_frames", 1),
+            "orientation": orientation_for(display_width, display_height),
+        }
+
+
+def apply_metadata(drawing: models.Drawing, metadata: dict, fields=METADATA_FIELDS) -> None:
+    for field in fields:
+        setattr(drawing, field, metadata.get(field))
+
+
+def backfill(db, batch_size: int = 200) -> int:
+    filled = 0
+    last_id = 0
+    while True:
+        drawings = db.execute(
+            select(models.Drawing)
+            .where(models.Drawing.id > last_id, models.Drawing.width == None)
+            .order_by(models.Drawing.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not drawings:
+            break
+        last_id = drawings[-1].id
+
+        updates = []
+        for drawing in drawings:
+            path = resolve_static_path(drawing.file_path)
+            try:
+                if os.path.exists(path):
+                    metadata = extract_metadata(path)
+                else:
+                    content = archive_pack.read_drawing_bytes(db, drawing)
+                    if content is None:
+                        logger.warning("Файл чертежа не найден: %s", path)
+                        continue
+                    metadata = extract_metadata(content)
+            except Exception as e:
+                logger.error("Не удалось прочитать метаданные чертежа %s: %s", drawing.id, e)
+                continue
+            if drawing.processed_at is not None:
+                # Файл уже стандартизирован: исходное число страниц по нему не узнать
+                metadata["page_count"] = drawing.page_count
+            updates.append({"id": drawing.id, **metadata})
+
+        if updates:
+            db.execute(update(models.Drawing), updates)
+        db.commit()
+        filled += len(updates)
+        logger.info("Метаданные заполнены для %s чертежей", filled)
+    return filled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Метаданные изображений чертежей")
+    parser.add_argument("--backfill", action="store_true", help="Заполнить метаданные для существующих чертежей")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+        return
+
+    db = SessionLocal()
+    try:
+        backfill(db, args.batch_size)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,277 @@
+"""
+Потоковая выгрузка заказов и склада в CSV и XLSX.
+
+Строки читаются серверным курсором (yield_per/stream_results) порциями по
+EXPORT_BATCH_SIZE и сразу кодируются в выходной поток, поэтому память не
+зависит от размера таблицы, а первые байты уходят клиенту немедленно.
+
+CSV пишется в UTF-8 с BOM и разделителем ";" — так его без настройки
+открывает Excel с русской локалью. XLSX собирается вручную: лист пишется
+строками inlineStr в потоковый zip, без общей таблицы строк в памяти.
+"""
+import csv
+import io
+import os
+import re
+import zipfile
+from datetime import date
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from sqlalchemy import and_, func, select
+
+from app import models
+from app.database import SessionLocal
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+CSV_DELIMITER = ";"
+
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+ORDER_COLUMNS = [
+    "ID",
+    "Номер заказа",
+    "Дата публикации",
+    "Обозначение чертежа",
+    "Количество",
+    "Желательная дата изготовления (с)",
+    "Желательная дата изготовления (по)",
+    "Необходимый материал",
+    "Срок поставки металла",
+    "Примечания",
+    "Чертежей",
+]
+
+INVENTORY_COLUMNS = ["ID", "Номер партии", "Номер детали", "Количество"]
+
+
+def _format_value(value):
+    if isinstance(value, date):
+        return value.strftime("%d.%m.%Y")
+    return value
+
+
+def order_rows(db, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Tuple]:
+    """
+    Заказы с числом активных чертежей. Количество считается коррелированным
+    подзапросом, а не загрузкой связей, чтобы строки шли прямо из курсора.
+    """
+    drawing_count = (
+        select(func.count(models.OrderDrawing.id))
+        .join(models.Drawing, models.Drawing.id == models.OrderDrawing.drawing_id)
+        .where(and_(
+            models.OrderDrawing.order_id == models.ProductionOrder.id,
+            models.Drawing.archived_at.is_(None),
+        ))
+        .correlate(models.ProductionOrder)
+        .scalar_subquery()
+    )
+    order = models.ProductionOrder
+    stmt = (
+        select(
+            order.id,
+            order.order_number,
+            order.publication_date,
+            order.drawing_designation,
+            order.quantity,
+            order.desired_production_date_start,
+            order.desired_production_date_end,
+            order.required_material,
+            order.metal_delivery_date,
+            order.notes,
+            drawing_count,
+        )
+        .order_by(order.id)
+        .execution_options(yield_per=batch_size, stream_results=True)
+    )
+    for row in db.execute(stmt):
+        yield tuple(_format_value(value) for value in row)
+
+
+def inventory_rows(db, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Tuple]:
+    item = models.Inventory
+    stmt = (
+        select(item.id, item.batch_number, item.part_number, item.quantity)
+        .order_by(item.id)
+        .execution_options(yield_per=batch_size, stream_results=True)
+    )
+    for row in db.execute(stmt):
+        yield tuple(row)
+
+
+def _batched(rows: Iterable[Sequence], size: int) -> Iterator[List[Sequence]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv(columns: Sequence[str], rows: Iterable[Sequence], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=CSV_DELIMITER)
+    writer.writerow(columns)
+    # BOM нужен только в начале файла
+    yield buffer.getvalue().encode("utf-8-sig")
+    for batch in _batched(rows, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """
+    Несекционируемый поток для zipfile: накопленные байты забираются drain().
+    Без tell()/seek() zipfile пишет размеры в data descriptor после данных.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Символы, недопустимые в XML 1.0
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_cell(ref: str, value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(number: int, values: Sequence) -> str:
+    cells = "".join(_xlsx_cell(f"{_column_letter(i)}{number}", v) for i, v in enumerate(values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _workbook(sheet_name: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def iter_xlsx(sheet_name: str, columns: Sequence[str], rows: Iterable[Sequence],
+              batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _ROOT_RELS)
+        archive.writestr("xl/workbook.xml", _workbook(sheet_name))
+        archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        yield sink.drain()
+
+        # force_zip64: итоговый размер листа заранее неизвестен
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>' + _xlsx_row(1, columns)
+            ).encode("utf-8"))
+            number = 1
+            for batch in _batched(rows, batch_size):
+                parts = []
+                for values in batch:
+                    number += 1
+                    parts.append(_xlsx_row(number, values))
+                sheet.write("".join(parts).encode("utf-8"))
+                yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+EXPORTS = {
+    "orders": ("Заказы", ORDER_COLUMNS, order_rows),
+    "inventory": ("Склад", INVENTORY_COLUMNS, inventory_rows),
+}
+
+FORMATS = {
+    "csv": CSV_MEDIA_TYPE,
+    "xlsx": XLSX_MEDIA_TYPE,
+}
+
+
+def stream_export(kind: str, fmt: str, session_factory: Callable = SessionLocal) -> Iterator[bytes]:
+    """
+    Генератор для StreamingResponse. Открывает собственную сессию: сессия
+    запроса закрывается раньше, чем ответ будет отправлен.
+    """
+    sheet_name, columns, row_source = EXPORTS[kind]
+    db = session_factory()
+    try:
+        rows = row_source(db)
+        if fmt == "xlsx":
+            yield from iter_xlsx(sheet_name, columns, rows)
+        else:
+            yield from iter_csv(columns, rows)
+    finally:
+        db.close()
+
+
+def export_filename(kind: str, fmt: str) -> str:
+    return f"{kind}_{date.today().strftime('%Y%m%d')}.{fmt}"
@@ -1,83 +1,300 @@
-import re
-import requests
-from bs4 import BeautifulSoup
+"""
+Поиск ссылок на чертежи на страницах заказов внутреннего портала.
 
-def find_drawing_link(order_url, drawing_number, session):
+Асинхронный обходчик на httpx.AsyncClient: одно соединение с пулом на весь
+прогон, ограниченное число одновременных запросов, повторы с
+экспоненциальной задержкой при сетевых ошибках и ответах 5xx/429.
+HTML разбирается через lxml (XPath), если он установлен, иначе через
+BeautifulSoup с html.parser.
+
+Адрес портала и учетные данные берутся из окружения, при импорте модуля
+сетевых запросов нет:
+    INTRANET_URL, INTRANET_USERNAME, INTRANET_PASSWORD
+
+    python -m app.extraction "http://192.168.0.26/?q=omts/2024/zakaz-komplektuyushchih-k-zn-1312"
+    python -m app.extraction --file orders.txt --concurrency 16
+
+С кешем страниц (app/page_cache.py) повторный обход отправляет условные
+запросы и разбирает заново только изменившиеся страницы.
+
+Для тестов вместо портала можно передать transport (например,
+httpx.MockTransport или httpx.ASGITransport локальной заглушки).
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from app.page_cache import DEFAULT_CACHE_PATH, PageCache
+
+try:
+    import lxml.html
+except ImportError:  # без lxml — медленнее, но работает
+    lxml = None
+    from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+INTRANET_URL = os.getenv("INTRANET_URL", "http://192.168.0.26")
+LOGIN_PATH = "/user/login"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+DRAWING_LINKS_CLASS = "field-name-field-nodelinks"
+LOGGED_IN_MARKER = "Выйти"
+
+DEFAULT_CONCURRENCY = int(os.getenv("INTRANET_CONCURRENCY", "8"))
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 15.0
+RETRY_BASE_DELAY = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Меняется вместе с логикой parse_drawing_links, чтобы не брать из кеша старый разбор
+PARSER_VERSION = "1"
+
+
+class ExtractionError(Exception):
+    """Ошибка обращения к порталу."""
+
+
+class AuthenticationError(ExtractionError):
+    """Не удалось войти на портал."""
+
+
+def parse_form_build_id(html: str) -> Optional[str]:
+    if lxml is not None:
+        values = lxml.html.fromstring(html).xpath("//input[@name='form_build_id']/@value")
+        return values[0] if values else None
+    element = BeautifulSoup(html, "html.parser").find("input", {"name": "form_build_id"})
+    return element["value"] if element else None
+
+
+def parse_drawing_links(html: str, base_url: str = "") -> List[dict]:
+    """
+    Ссылки из блока чертежей (div.field-name-field-nodelinks): [{"href", "text"}].
     """
-    Находит ссылку на чертеж по его номеру в заказе.
+    if lxml is not None:
+        document = lxml.html.fromstring(html)
+        anchors = document.xpath(
+            f"//div[contains(concat(' ', normalize-space(@class), ' '), ' {DRAWING_LINKS_CLASS} ')]//a[@href]"
+        )
+        links = [(a.get("href"), a.text_content()) for a in anchors]
+    else:
+        block = BeautifulSoup(html, "html.parser").find("div", class_=DRAWING_LINKS_CLASS)
+        links = [(a["href"], a.get_text()) for a in block.find_all("a", href=True)] if block else []
+    return [{"href": urljoin(base_url, href), "text": " ".join(text.split())} for href, text in links]
 
-    Args:
-        order_url: URL страницы с заказом.
-        drawing_number: Номер чертежа (например, "КИ 124.01.02").
-        session: Объект сессии requests для поддержания авторизации.
 
-    Returns:
-        Ссылка на чертеж или None, если ссылка не найдена.
+def select_drawing_link(links: List[dict], drawing_number: Optional[str] = None) -> Optional[str]:
     """
-    try:
-        response = session.get(order_url)
-        response.raise_for_status()  # Проверяем на ошибки HTTP
-        order_html = response.text
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при получении страницы заказа: {e}")
+    Ссылка, в тексте которой есть номер чертежа, иначе первая в блоке.
+    """
+    if not links:
         return None
+    if drawing_number:
+        wanted = " ".join(drawing_number.split()).lower()
+        for link in links:
+            if wanted in link["text"].lower():
+                return link["href"]
+    return links[0]["href"]
 
-    # Находим блок с ссылкой на оконцеватель, используя BeautifulSoup
-    soup = BeautifulSoup(order_html, 'html.parser')
-    link_element = soup.find('div', class_='field-name-field-nodelinks').find('a')
-    if link_element:
-        drawing_link = link_element['href']
-        return drawing_link
-    else:
-        return None
 
-# URL страницы с заказом
-order_url = "http://192.168.0.26/?q=omts/2024/zakaz-komplektuyushchih-k-zn-1312" 
+class IntranetCrawler:
+    def __init__(
+        self,
+        base_url: str = None,
+        username: str = None,
+        password: str = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        retries: int = DEFAULT_RETRIES,
+        timeout: float = DEFAULT_TIMEOUT,
+        transport: httpx.AsyncBaseTransport = None,
+        cache: Optional[PageCache] = None,
+    ):
+        self.base_url = (base_url or INTRANET_URL).rstrip("/")
+        self.username = username if username is not None else os.getenv("INTRANET_USERNAME")
+        self.password = password if password is not None else os.getenv("INTRANET_PASSWORD")
+        self.retries = retries
+        self.cache = cache
+        # 304 — не изменилась, unchanged — 200 с тем же телом, parsed — разобрана заново
+        self.stats = {"not_modified": 0, "unchanged": 0, "parsed": 0}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._login_lock = asyncio.Lock()
+        # Номер входа: параллельные запросы с истекшей сессией входят повторно один раз
+        self._login_generation = 0
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"User-Agent": USER_AGENT},
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            transport=transport,
+        )
 
-# Данные для входа (замените на ваши)
-username = "Романов"
-password = "nbvjirF9291"
+    async def __aenter__(self):
+        return self
 
-# URL страницы входа
-login_url = "http://192.168.0.26/user/login"  # Проверьте URL для входа
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
-# Создаем сессию requests
-session = requests.Session()
+    async def close(self) -> None:
+        await self._client.aclose()
 
-# Авторизуемся на сайте
-try:
-    response = session.get(login_url)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    form_build_id = soup.find('input', {'name': 'form_build_id'})['value']
-    login_data = {
-        'name': username,
-        'pass': password,
-        'form_build_id': form_build_id,
-        'form_id': 'user_login_block',
-        'op': 'Войти'
-    }
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
-    
-    response = session.post(login_url, data=login_data, headers=headers, allow_redirects=True)
-    response.raise_for_status()
-
-    # Проверяем, что авторизация прошла успешно
-    if "Выйти" in response.text:
-        print("Авторизация прошла успешно.")
-        
-        # Используем find_drawing_link для получения ссылки на чертеж
-        drawing_number = "КИ 124.01.02"  # Укажите нужный номер чертежа
-        drawing_link = find_drawing_link(order_url, drawing_number, session)
-        if drawing_link:
-            print(f"Ссылка на чертеж: {drawing_link}")
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self._semaphore:
+                    response = await self._client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt > self.retries:
+                    return response
+                reason = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                if attempt > self.retries:
+                    raise ExtractionError(f"{method} {url}: {e}") from e
+                reason = str(e) or type(e).__name__
+            delay = RETRY_BASE_DELAY * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning("%s %s: %s, повтор %s/%s через %.1f с", method, url, reason, attempt, self.retries, delay)
+            await asyncio.sleep(delay)
+
+    async def login(self) -> None:
+        if not self.username or not self.password:
+            raise AuthenticationError("Не заданы INTRANET_USERNAME/INTRANET_PASSWORD")
+        response = await self._request("GET", LOGIN_PATH)
+        response.raise_for_status()
+        form_build_id = parse_form_build_id(response.text)
+        if not form_build_id:
+            raise AuthenticationError("На странице входа нет form_build_id")
+        response = await self._request("POST", LOGIN_PATH, data={
+            "name": self.username,
+            "pass": self.password,
+            "form_build_id": form_build_id,
+            "form_id": "user_login_block",
+            "op": "Войти",
+        })
+        response.raise_for_status()
+        if LOGGED_IN_MARKER not in response.text:
+            raise AuthenticationError("Портал отклонил учетные данные")
+        self._login_generation += 1
+        logger.info("Авторизация на портале прошла успешно")
+
+    async def _ensure_login(self, expired_generation: Optional[int] = None) -> None:
+        async with self._login_lock:
+            if self._login_generation == 0 or self._login_generation == expired_generation:
+                await self.login()
+
+    @staticmethod
+    def _is_login_page(response: httpx.Response) -> bool:
+        return urlparse(str(response.url)).path.rstrip("/") == LOGIN_PATH
+
+    async def get_page(self, url: str, headers: dict = None) -> httpx.Response:
+        """
+        GET страницы с авторизацией; при истекшей сессии входит повторно один раз.
+        Ответ 304 на условный запрос возвращается как есть.
+        """
+        await self._ensure_login()
+        generation = self._login_generation
+        response = await self._request("GET", url, headers=headers)
+        if self._is_login_page(response):
+            logger.info("Сессия портала истекла, повторный вход")
+            await self._ensure_login(expired_generation=generation)
+            response = await self._request("GET", url, headers=headers)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    async def get_drawing_links(self, order_url: str) -> List[dict]:
+        """
+        Разобранные ссылки страницы заказа с учетом кеша.
+        """
+        entry = self.cache.get(order_url) if self.cache else None
+        response = await self.get_page(order_url, headers=PageCache.conditional_headers(entry))
+        if response.status_code == 304:
+            if entry is not None:
+                self.stats["not_modified"] += 1
+                self.cache.touch(order_url, response.headers.get("etag"), response.headers.get("last-modified"))
+                return entry.parsed
+            # 304 без записи в кеше: запрашиваем страницу целиком
+            response = await self.get_page(order_url)
+
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        if entry is not None and entry.body_hash == body_hash:
+            self.stats["unchanged"] += 1
+            links = entry.parsed
         else:
-            print("Ссылка на чертеж не найдена.")
-    else:
-        print("Ошибка авторизации.")
-        print(response.text)  # Выводим ответ сервера для отладки
-except requests.exceptions.RequestException as e:
-    print(f"Ошибка при авторизации: {e}")
+            self.stats["parsed"] += 1
+            links = parse_drawing_links(response.text, str(response.url))
+        if self.cache:
+            self.cache.store(order_url, response.headers.get("etag"), response.headers.get("last-modified"), body_hash, links)
+        return links
+
+    async def find_drawing_link(self, order_url: str, drawing_number: Optional[str] = None) -> Optional[str]:
+        """
+        Находит ссылку на чертеж на странице заказа. None, если ссылки нет
+        или страницу не удалось получить.
+        """
+        try:
+            links = await self.get_drawing_links(order_url)
+        except (httpx.HTTPError, ExtractionError) as e:
+            logger.error("Ошибка при получении страницы заказа %s: %s", order_url, e)
+            return None
+        return select_drawing_link(links, drawing_number)
+
+    async def find_drawing_links(self, order_urls: Iterable[str], drawing_number: Optional[str] = None) -> Dict[str, Optional[str]]:
+        """
+        Ссылки для многих заказов за один прогон: {url заказа: ссылка или None}.
+        """
+        urls = list(dict.fromkeys(order_urls))
+        # Вход выполняется один раз до параллельных запросов
+        await self._ensure_login()
+        links = await asyncio.gather(*(self.find_drawing_link(url, drawing_number) for url in urls))
+        # Копия: запись форматируется позже, в потоке журнала
+        logger.info("Обход портала: %s страниц, %s", len(urls), dict(self.stats))
+        return dict(zip(urls, links))
+
+
+async def run(order_urls: List[str], drawing_number: Optional[str], concurrency: int,
+              cache_path: Optional[str] = DEFAULT_CACHE_PATH) -> Dict[str, Optional[str]]:
+    cache = PageCache(cache_path, parser_version=PARSER_VERSION) if cache_path else None
+    try:
+        async with IntranetCrawler(concurrency=concurrency, cache=cache) as crawler:
+            return await crawler.find_drawing_links(order_urls, drawing_number)
+    finally:
+        if cache:
+            cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск ссылок на чертежи на страницах заказов портала")
+    parser.add_argument("urls", nargs="*", help="URL страниц заказов")
+    parser.add_argument("--file", help="Файл со списком URL, по одному в строке")
+    parser.add_argument("--drawing-number", help="Номер чертежа (например, \"КИ 124.01.02\")")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Файл кеша страниц")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кеш страниц")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    urls = list(args.urls)
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            urls.extend(line.strip() for line in f if line.strip())
+    if not urls:
+        parser.error("не указаны URL заказов")
+
+    try:
+        links = asyncio.run(run(urls, args.drawing_number, args.concurrency, None if args.no_cache else args.cache))
+    except AuthenticationError as e:
+        logger.error("Ошибка авторизации: %s", e)
+        sys.exit(1)
+    print(json.dumps(links, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Обработка изображений чертежей без привязки к веб-приложению.
+
+Функции синхронные и не зависят от FastAPI: их вызывают и обработчики
+запросов (через asyncio.to_thread), и фоновые воркеры очереди задач.
+"""
+import io
+import os
+from datetime import date
+
+from PIL import Image, ImageDraw, ImageFont, ImageFile
+
+from app import metrics
+from app.utils import drawing_store
+
+# Увеличиваем лимит для больших файлов
+Image.MAX_IMAGE_PIXELS = None
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+MODIFIED_DRAWINGS_DIR = os.path.join("static", "modified_drawings")
+FONT_PATH = os.path.join("static", "fonts", "CommitMonoNerdFont-Bold.otf")
+
+
+def standardize_bytes(content: bytes, target_dpi=300, max_size=(5000, 5000)):
+    """
+    Приводит изображение к целевому DPI с ограничением размера.
+    Возвращает (png_bytes, original_size, new_size).
+    """
+    with metrics.stage("decode"):
+        img = Image.open(io.BytesIO(content))
+        img.load()
+
+    dpi = img.info.get('dpi', (96, 96))
+    dpi = max(dpi[0], 96)
+
+    original_size = img.size
+
+    scale_factor = target_dpi / dpi
+    new_width = int(img.width * scale_factor)
+    new_height = int(img.height * scale_factor)
+
+    if new_width > max_size[0] or new_height > max_size[1]:
+        scale = min(max_size[0] / new_width, max_size[1] / new_height)
+        new_width = int(new_width * scale)
+        new_height = int(new_height * scale)
+
+    new_size = (new_width, new_height)
+
+    with metrics.stage("resize"):
+        img_resized = img.resize(new_size, Image.LANCZOS)
+    img_resized.info['dpi'] = (target_dpi, target_dpi)
+
+    buffer = io.BytesIO()
+    with metrics.stage("encode"):
+        img_resized.save(buffer, format="PNG", dpi=(target_dpi, target_dpi))
+    return buffer.getvalue(), original_size, new_size
+
+
+def standardize_file(image_path: str, target_dpi=300, max_size=(5000, 5000)):
+    """
+    Стандартизирует файл на месте (атомарной заменой). Возвращает (original_size, new_size).
+    """
+    with open(image_path, "rb") as f:
+        content = f.read()
+    png_bytes, original_size, new_size = standardize_bytes(content, target_dpi, max_size)
+    drawing_store.write_atomic(image_path, png_bytes)
+    return original_size, new_size
+
+
+def composite_layout(width: int, height: int) -> dict:
+    """
+    Размер и положение QR-кода и даты на листе. Зависит только от размеров,
+    поэтому может вычисляться по метаданным Drawing без открытия файла.
+    """
+    qr_size_ratio = 0.25 if width > height else 0.2
+    qr_size = int(min(width, height) * qr_size_ratio)
+    offset_ratio = 0.015
+    offset = int(min(width, height) * offset_ratio)
+    font_size = int(min(width, height) * 0.03)
+    return {
+        "qr_size": qr_size,
+        "qr_position": (width - qr_size - offset, height - qr_size - offset),
+        "font_size": font_size,
+        "date_position": (offset, height - offset - font_size),
+    }
+
+
+def render_composite(drawing_source, qr_code_path: str, date_text: str) -> bytes:
+    """
+    Накладывает QR-код заказа и дату на чертеж и возвращает PNG.
+    drawing_source — путь к файлу или файловый объект.
+    """
+    with metrics.stage("decode"):
+        img = Image.open(drawing_source).convert('RGBA')
+        qr_code = Image.open(qr_code_path).convert('RGBA')
+    with img, qr_code:
+        with metrics.stage("composite"):
+            # Определяем размеры и позицию для QR-кода
+            layout = composite_layout(img.width, img.height)
+            qr_size = layout["qr_size"]
+            qr_code = qr_code.resize((qr_size, qr_size), Image.LANCZOS)
+
+            # Создаем новое изображение с белым фоном для QR-кода
+            qr_background = Image.new('RGBA', (qr_size, qr_size), (255, 255, 255, 255))
+            qr_background.paste(qr_code, (0, 0), qr_code)
+
+            # Вставляем QR-код на чертеж
+            img.alpha_composite(qr_background, layout["qr_position"])
+
+            # Добавляем дату
+            draw = ImageDraw.Draw(img)
+            font = ImageFont.truetype(FONT_PATH, layout["font_size"])
+            draw.text(layout["date_position"], date_text, font=font, fill=(0, 0, 0))
+
+        # Сохраняем результат в буфер
+        buffer = io.BytesIO()
+        with metrics.stage("encode"):
+            img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+def composite_cache_path(order_id: int, drawing_id: int, day: date) -> str:
+    """
+    Путь к заранее отрисованному чертежу с QR-кодом. Дата входит в имя, так как
+    она печатается на листе; устаревшие файлы удаляет сборщик мусора.
+    """
+    return os.path.join(MODIFIED_DRAWINGS_DIR, f"composite_{order_id}_{drawing_id}_{day.strftime('%Y%m%d')}.png")
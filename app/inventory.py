@@ -0,0 +1,89 @@
+"""
+Приемка складских сканов пачками.
+
+Терминал на приемке отправляет весь сеанс одним запросом: массив сканов
+(batch_number, part_number, quantity). Повторы одного скана (одинаковый
+scan_id) отбрасываются, сканы одной партии и детали складываются в одну
+строку, и все строки вставляются одним многострочным INSERT.
+"""
+import logging
+import os
+from typing import Any, Dict, List, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app import repository, schemas
+
+logger = logging.getLogger(__name__)
+
+MAX_SCANS_PER_REQUEST = int(os.getenv("INVENTORY_BATCH_MAX", "5000"))
+
+ACCEPTED = "accepted"
+MERGED = "merged"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+
+
+def _format_errors(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()]
+
+
+def ingest_scans(db: Session, items: List[Any]) -> dict:
+    """
+    Возвращает сводку и результат по каждому элементу в исходном порядке:
+    accepted — создана строка, merged — скан добавлен к строке другого
+    элемента (merged_into), duplicate — повтор scan_id, invalid — ошибки.
+    """
+    results: List[dict] = [None] * len(items)
+    groups: Dict[Tuple[str, str], dict] = {}
+    seen_scans: Dict[str, int] = {}
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": INVALID, "errors": ["ожидается объект"]}
+            continue
+        try:
+            scan = schemas.InventoryScan(**item)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": INVALID, "errors": _format_errors(e)}
+            continue
+
+        if scan.scan_id is not None:
+            if scan.scan_id in seen_scans:
+                results[index] = {"index": index, "status": DUPLICATE, "duplicate_of": seen_scans[scan.scan_id]}
+                continue
+            seen_scans[scan.scan_id] = index
+
+        key = (scan.batch_number, scan.part_number)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {"first": index, "quantity": scan.quantity, "members": [index]}
+        else:
+            group["quantity"] += scan.quantity
+            group["members"].append(index)
+
+    ordered = list(groups.items())
+    ids = repository.create_inventory_batch(db, [
+        {"batch_number": batch_number, "part_number": part_number, "quantity": group["quantity"]}
+        for (batch_number, part_number), group in ordered
+    ])
+
+    for ((batch_number, part_number), group), inventory_id in zip(ordered, ids):
+        first = group["first"]
+        results[first] = {
+            "index": first,
+            "status": ACCEPTED,
+            "inventory_id": inventory_id,
+            "batch_number": batch_number,
+            "part_number": part_number,
+            "quantity": group["quantity"],
+        }
+        for member in group["members"][1:]:
+            results[member] = {"index": member, "status": MERGED, "merged_into": first, "inventory_id": inventory_id}
+
+    summary = {status: 0 for status in (ACCEPTED, MERGED, DUPLICATE, INVALID)}
+    for result in results:
+        summary[result["status"]] += 1
+    logger.info("Приемка сканов: %s", summary)
+    return {"summary": summary, "results": results}
@@ -0,0 +1,201 @@
+"""
+Очередь фоновых задач в БД.
+
+Задачи хранятся в таблице jobs. Воркер забирает задачу через
+SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL) и условный UPDATE по статусу,
+поэтому несколько воркеров не возьмут одну задачу; на SQLite работает
+только условный UPDATE, чего достаточно для локального запуска.
+Неудачные задачи повторяются с экспоненциальной задержкой.
+
+Воркеры запускаются отдельно от веб-приложения (см. app/job_worker.py):
+    python -m app.job_worker --processes 2
+"""
+import logging
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app import models, tracing
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+POLL_INTERVAL = 1.0
+RETRY_BASE_DELAY = 5
+# Задача, которая "выполняется" дольше этого срока, считается брошенной (воркер упал)
+STALE_AFTER = timedelta(minutes=15)
+
+HANDLERS: Dict[str, Callable] = {}
+
+
+class PermanentJobError(Exception):
+    """Ошибка, при которой повторять задачу бессмысленно."""
+
+
+def job_handler(kind: str):
+    """
+    Регистрирует обработчик задач вида kind: handler(db, payload) -> result.
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(db: Session, kind: str, payload: dict, max_attempts: int = 3, commit: bool = True) -> models.Job:
+    # traceparent в payload связывает выполнение задачи с трассой запроса
+    job = models.Job(kind=kind, payload=tracing.inject(payload), status=QUEUED, attempts=0, max_attempts=max_attempts, run_after=_now())
+    db.add(job)
+    if commit:
+        db.commit()
+        db.refresh(job)
+    else:
+        db.flush()
+    return job
+
+
+def enqueue_many(db: Session, kind: str, payloads: List[dict], max_attempts: int = 3, commit: bool = True) -> List[models.Job]:
+    """
+    Ставит пачку задач одним flush (многострочный INSERT).
+    """
+    now = _now()
+    jobs = [
+        models.Job(kind=kind, payload=tracing.inject(payload), status=QUEUED, attempts=0, max_attempts=max_attempts, run_after=now)
+        for payload in payloads
+    ]
+    db.add_all(jobs)
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+    return jobs
+
+
+def get_job(db: Session, job_id: int) -> Optional[models.Job]:
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def fetch_finished_since(db: Session, since: datetime, limit: int = 100):
+    return db.query(models.Job).filter(
+        models.Job.finished_at > since
+    ).order_by(models.Job.finished_at).limit(limit).all()
+
+
+def claim_next(db: Session, worker_id: str) -> Optional[models.Job]:
+    candidate = db.execute(
+        select(models.Job.id)
+        .where(models.Job.status == QUEUED, models.Job.run_after <= _now())
+        .order_by(models.Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    if candidate is None:
+        db.commit()
+        return None
+
+    claimed = db.execute(
+        update(models.Job)
+        .where(models.Job.id == candidate, models.Job.status == QUEUED)
+        .values(status=RUNNING, locked_by=worker_id, locked_at=_now(), attempts=models.Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if not claimed:
+        return None
+    return get_job(db, candidate)
+
+
+def complete(db: Session, job: models.Job, result) -> None:
+    job.status = DONE
+    job.result = result
+    job.last_error = None
+    job.finished_at = _now()
+    db.commit()
+
+
+def fail(db: Session, job: models.Job, error: str, permanent: bool = False) -> None:
+    job.last_error = error
+    if permanent or job.attempts >= job.max_attempts:
+        job.status = FAILED
+        job.finished_at = _now()
+    else:
+        job.status = QUEUED
+        job.run_after = _now() + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+    job.locked_by = None
+    db.commit()
+
+
+def requeue_stale(db: Session) -> int:
+    requeued = db.execute(
+        update(models.Job)
+        .where(models.Job.status == RUNNING, models.Job.locked_at < _now() - STALE_AFTER)
+        .values(status=QUEUED, locked_by=None, run_after=_now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if requeued:
+        logger.warning("Возвращено в очередь зависших задач: %s", requeued)
+    return requeued
+
+
+def run_job(db: Session, job: models.Job) -> None:
+    handler = HANDLERS.get(job.kind)
+    if handler is None:
+        fail(db, job, f"Неизвестный тип задачи: {job.kind}", permanent=True)
+        return
+    try:
+        with tracing.span(f"job {job.kind}", "consumer", tracing.extract(job.payload),
+                          **{"job.id": job.id, "job.attempt": job.attempts}):
+            result = handler(db, job.payload)
+    except PermanentJobError as e:
+        db.rollback()
+        logger.error("Задача %s (%s) завершилась ошибкой: %s", job.id, job.kind, e)
+        fail(db, job, str(e), permanent=True)
+    except Exception as e:
+        db.rollback()
+        logger.error("Задача %s (%s), попытка %s: %s", job.id, job.kind, job.attempts, e)
+        fail(db, job, traceback.format_exc())
+    else:
+        complete(db, job, result)
+        logger.info("Задача %s (%s) выполнена", job.id, job.kind)
+
+
+def run_worker(worker_id: str, poll_interval: float = POLL_INTERVAL, once: bool = False) -> None:
+    # Обработчики регистрируются при импорте модуля
+    from app import drawing_jobs  # noqa: F401
+
+    logger.info("Воркер %s запущен", worker_id)
+    last_stale_check = 0.0
+    while True:
+        db = SessionLocal()
+        try:
+            if time.monotonic() - last_stale_check > 60:
+                requeue_stale(db)
+                last_stale_check = time.monotonic()
+            job = claim_next(db, worker_id)
+            if job is not None:
+                run_job(db, job)
+        except Exception as e:
+            logger.error("Ошибка воркера %s: %s", worker_id, e, exc_info=True)
+            db.rollback()
+            job = None
+        finally:
+            db.close()
+
+        if once:
+            return
+        if job is None:
+            time.sleep(poll_interval)
@@ -0,0 +1,39 @@
+"""
+Запуск воркеров очереди фоновых задач:
+    python -m app.job_worker --processes 2
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+
+from app import job_queue, logging_setup
+
+
+def _worker_process(index: int, poll_interval: float) -> None:
+    logging_setup.configure_logging()
+    job_queue.run_worker(f"{socket.gethostname()}:{os.getpid()}:{index}", poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры фоновой обработки чертежей")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--poll-interval", type=float, default=job_queue.POLL_INTERVAL)
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        _worker_process(0, args.poll_interval)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(i, args.poll_interval), daemon=True)
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Настройка журнала: запись в отдельном потоке, JSON и выборка частых сообщений.
+
+Обработчики логгеров только кладут запись в очередь (QueueHandler), а
+форматирование и запись в поток вывода выполняет фоновый QueueListener,
+поэтому ввод-вывод журнала не задерживает цикл событий. Сообщение
+собирается из msg % args уже в фоновом потоке: в горячих путях передавайте
+аргументы отдельно (logger.info("Чертеж %s", path)), а не f-строкой.
+Аргументы должны быть значениями (id, путь), а не ORM-объектами: str()
+от них вызывается позже и в другом потоке.
+
+Параметры окружения:
+    LOG_LEVEL        — уровень корневого логгера (INFO)
+    LOG_FORMAT       — json или text (json)
+    LOG_QUEUE_SIZE   — размер очереди; при переполнении записи отбрасываются
+    LOG_SAMPLE       — доля сохраняемых записей ниже WARNING по логгерам,
+                       например "app.main=0.1,app.websocket_manager=0.05"
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from app import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Логгеры uvicorn настраиваются до импорта приложения и пишут в поток
+# напрямую; их обработчики тоже заменяются очередью
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Атрибуты LogRecord, которые не относятся к переданным через extra полям
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+log_records_dropped = metrics.REGISTRY.counter(
+    "log_records_dropped_total", "Записи журнала, отброшенные при переполнении очереди"
+)
+
+_listener: Optional[QueueListener] = None
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # Поля, переданные через extra={...}
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю rate записей ниже WARNING для логгера и его потомков
+    (используется самое длинное совпадающее имя). Предупреждения и ошибки
+    проходят всегда.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь без форматирования; при переполненной очереди
+    запись отбрасывается вместо ожидания.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare форматирует сообщение в вызывающем потоке
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """
+    Заменяет обработчики корневого логгера и логгеров uvicorn очередью.
+    Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE)))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers = [queue_handler]
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Дописывает оставшиеся в очереди записи и останавливает фоновый поток.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
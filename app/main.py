@@ -1,25 +1,26 @@
-from fastapi import FastAPI, WebSocket, Depends, HTTPException, Request, Form, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, WebSocket, Depends, HTTPException, Request, Form, UploadFile, File, BackgroundTasks, Body
 from app.utils import file_utils
 import asyncio
 import io
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.websockets import WebSocketDisconnect
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, joinedload, selectinload
 from app import models, repository, schemas
 from app.database import SessionLocal, engine
-from app.cleanup_drawings import cleanup_original_drawings
+from app.cleanup_drawings import run_garbage_collection
+from app.temp_reaper import reap_temp_dir
 from app.websocket_manager import manager
 from app.schemas import ProductionOrderCreate
-from datetime import date, datetime
+from datetime import date, datetime, timezone
 from pydantic import BaseModel
 from pathlib import Path
 from sqlalchemy.sql import func
 from sqlalchemy.orm import Session
-from PIL import Image, ImageDraw, ImageFont, ImageFile
-from typing import List, Optional
-import qrcode, os, math, time, shutil, io, base64, re, random, string, logging, json, traceback
+from PIL import Image, ImageDraw, ImageFont
+from typing import Any, List, Optional
+import os, math, time, shutil, io, base64, logging, json, traceback
 import aiofiles
 from pydantic import ValidationError
 import os
@@ -28,13 +29,16 @@ import logging
 import hashlib
 import mimetypes
 from app.utils.file_utils import get_file_path
+from app.qr_codes import generate_qr_code_with_text
+from app.utils import drawing_store
+from app import drawing_delivery, archive_pack, image_processing, job_queue, drawing_metadata, renditions, singleflight, admission, resumable_upload, export, qr_codes, order_import, inventory, planning, metrics, profiler, logging_setup, slow_queries, tracing, scheduler_leader
 import shutil
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 
 
-# Настройка логгирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логгирования: запись в фоновом потоке через очередь (app/logging_setup.py)
+logging_setup.configure_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -74,9 +78,24 @@ class Order(BaseModel):
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
+# Ограничение одновременных тяжелых запросов с приоритетом для просмотра чертежей
+admission_controller = admission.default_controller()
+# Профилирование по X-Profile — внутри допуска, чтобы не учитывать ожидание слота
+app.add_middleware(profiler.ProfilerMiddleware)
+app.add_middleware(admission.AdmissionMiddleware, controller=admission_controller)
+# Метрики и трассировка — снаружи: время запроса включает ожидание допуска
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+metrics.instrument_engine(engine)
+tracing.instrument_engine(engine)
+slow_query_log = slow_queries.install(engine)
+metrics.instrument_admission(admission_controller)
+metrics.instrument_websockets(manager)
+metrics.instrument_disk(STATIC_DIR)
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["rendition_url"] = renditions.rendition_url
 
 
 def get_db():
@@ -86,28 +105,67 @@ def get_db():
     finally:
         db.close()
 
+@app.get("/api/admission")
+async def admission_stats():
+    return admission_controller.stats()
+
+def require_profiler_token(request: Request):
+    token = request.headers.get("x-profile") or request.query_params.get(profiler.PROFILE_QUERY)
+    if not profiler.is_authorized(token):
+        raise HTTPException(status_code=403, detail="Доступ к профилям запрещен")
+
+@app.get("/api/profiles", dependencies=[Depends(require_profiler_token)])
+async def list_request_profiles():
+    return await asyncio.to_thread(profiler.list_profiles)
+
+@app.get("/api/profiles/{name}", dependencies=[Depends(require_profiler_token)])
+async def get_request_profile(name: str):
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="application/json", filename=name)
+
+def require_slow_query_token(request: Request):
+    if not slow_queries.is_authorized(request.headers.get(slow_queries.TOKEN_HEADER)):
+        raise HTTPException(status_code=403, detail="Доступ к журналу запросов запрещен")
+
+@app.get("/api/debug/slow_queries", dependencies=[Depends(require_slow_query_token)])
+async def get_slow_queries():
+    return slow_query_log.report()
+
+@app.delete("/api/debug/slow_queries", dependencies=[Depends(require_slow_query_token)])
+async def reset_slow_queries():
+    slow_query_log.reset()
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def get_metrics():
+    # Сбор может обходить static/, поэтому выполняется в потоке
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return Response(content=body, media_type=metrics.CONTENT_TYPE)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
-    logger.info(f"WebSocket соединение установлено: {websocket.client}")
+    logger.info("WebSocket соединение установлено: %s", websocket.client)
     try:
         while True:
             data = await websocket.receive_text()
             if data == 'pong':
                 continue  # Игнорируем pong-сообщения
             elif data != 'ping':
-                logger.info(f"Получено сообщение: {data}")
+                logger.debug("Получено сообщение: %s байт", len(data))
                 await manager.broadcast(f"Message text was: {data}")
     except WebSocketDisconnect:
         manager.disconnect(websocket)
-        logger.info(f"WebSocket соединение закрыто: {websocket.client}")
+        logger.info("WebSocket соединение закрыто: %s", websocket.client)
     except Exception as e:
-        logger.error(f"Ошибка WebSocket: {e}")
+        logger.error("Ошибка WebSocket: %s", e)
         manager.disconnect(websocket)
 
 def calculate_file_hash(file_path):
     sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
+    with metrics.stage("hash"), open(file_path, "rb") as f:
         # Читаем и обновляем хэш блоками по 4K
         for byte_block in iter(lambda: f.read(4096), b""):
             sha256_hash.update(byte_block)
@@ -119,17 +177,80 @@ async def read_root(request: Request):
 
 
 scheduler = AsyncIOScheduler()
+# Задачи выполняет только процесс, удерживающий блокировку лидера
+scheduler_coordinator = scheduler_leader.SchedulerCoordinator(scheduler, engine)
 
-@scheduler.scheduled_job("cron", hour=3)  # Запускать каждый день в 3 часа ночи
+@scheduler.scheduled_job("interval", minutes=10, id="clean_temp_folder")  # Небольшими порциями вместо ночного rmtree
+@scheduler_coordinator.job("clean_temp_folder")
 async def clean_temp_folder():
+    # Удаление файлов выполняется в потоке, цикл событий не блокируется
+    await asyncio.to_thread(reap_temp_dir, TEMP_DIR)
+
+@scheduler.scheduled_job("interval", minutes=30, id="reap_resumable_uploads")  # Брошенные возобновляемые загрузки
+@scheduler_coordinator.job("reap_resumable_uploads")
+async def reap_resumable_uploads():
+    await asyncio.to_thread(resumable_upload.reap_sessions)
+
+@scheduler.scheduled_job("cron", hour=4, id="collect_drawing_garbage")  # Сборка мусора в файлах чертежей
+@scheduler_coordinator.job("collect_drawing_garbage")
+async def collect_drawing_garbage():
+    # Обход диска выполняется в потоке, чтобы не блокировать цикл событий
+    await asyncio.to_thread(run_garbage_collection)
+
+@scheduler.scheduled_job("cron", hour=5, id="pack_archived_drawings")  # Упаковка давно архивированных чертежей
+@scheduler_coordinator.job("pack_archived_drawings")
+async def pack_archived_drawings():
+    await asyncio.to_thread(archive_pack.run_packing)
+
+@app.on_event("startup")
+async def start_scheduler():
+    # Планировщик стартует на паузе и снимается с нее, когда процесс становится лидером
+    scheduler_coordinator.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler_coordinator.shutdown()
+
+@app.get("/api/scheduler")
+async def get_scheduler_status():
+    return await scheduler_coordinator.status()
+
+
+# Опрос таблицы jobs: после найденных задач — каждые JOB_NOTIFY_INTERVAL секунд,
+# пока ничего не завершается, интервал удваивается до JOB_NOTIFY_MAX_INTERVAL
+JOB_NOTIFY_INTERVAL = float(os.getenv("JOB_NOTIFY_INTERVAL", "1"))
+JOB_NOTIFY_MAX_INTERVAL = max(JOB_NOTIFY_INTERVAL, float(os.getenv("JOB_NOTIFY_MAX_INTERVAL", "5")))
+
+def fetch_finished_jobs(since):
+    db = SessionLocal()
     try:
-        shutil.rmtree(TEMP_DIR)
-        os.makedirs(TEMP_DIR)
-        logger.info("Временная папка успешно очищена")
-    except Exception as e:
-        logger.error(f"Ошибка при очистке временной папки: {str(e)}")
+        return [job.to_dict() for job in job_queue.fetch_finished_since(db, since)]
+    finally:
+        db.close()
 
-scheduler.start()
+async def notify_finished_jobs():
+    # Воркеры работают в отдельных процессах, поэтому каждый веб-процесс сам
+    # следит за завершенными задачами и оповещает своих WebSocket-клиентов
+    watermark = datetime.now(timezone.utc)
+    interval = JOB_NOTIFY_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not manager.active_connections:
+                watermark = datetime.now(timezone.utc)
+                interval = JOB_NOTIFY_MAX_INTERVAL
+                continue
+            jobs = await asyncio.to_thread(fetch_finished_jobs, watermark)
+            for job in jobs:
+                await manager.broadcast(json.dumps({"action": "job_finished", "job": job}))
+                watermark = datetime.fromisoformat(job["finished_at"])
+            interval = JOB_NOTIFY_INTERVAL if jobs else min(interval * 2, JOB_NOTIFY_MAX_INTERVAL)
+        except Exception as e:
+            logger.error("Ошибка при рассылке статуса задач: %s", e)
+
+@app.on_event("startup")
+async def start_job_notifications():
+    asyncio.create_task(notify_finished_jobs())
 
 
 @app.post("/submit")
@@ -137,6 +258,29 @@ async def submit_data(batch_number: str = Form(...), part_number: str = Form(...
     inventory_item = repository.create_inventory(db, batch_number, part_number, quantity)
     return {"Успех": "Данные добавлены"}
 
+@app.post("/api/inventory/scans")
+async def submit_scans(items: List[Any] = Body(...), db: Session = Depends(get_db)):
+    # Весь сеанс приемки — один запрос вместо запроса на каждый скан
+    if len(items) > inventory.MAX_SCANS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"Не более {inventory.MAX_SCANS_PER_REQUEST} сканов за запрос")
+    return inventory.ingest_scans(db, items)
+
+@app.get("/api/inventory/balance/{part_number}")
+async def get_inventory_balance(part_number: str, db: Session = Depends(get_db)):
+    # Остатки поддерживаются при вставке, поэтому это поиск по первичному ключу
+    balance = repository.get_part_balance(db, part_number)
+    if not balance:
+        raise HTTPException(status_code=404, detail="Деталь не найдена на складе")
+    return {
+        "part_number": balance.part_number,
+        "quantity": balance.quantity,
+        "updated_at": balance.updated_at.isoformat() if balance.updated_at else None,
+        "batches": [
+            {"batch_number": b.batch_number, "quantity": b.quantity}
+            for b in repository.get_batch_balances(db, part_number)
+        ],
+    }
+
 @app.get("/data", response_class=HTMLResponse)
 async def show_data(request: Request, db: Session = Depends(get_db)):
     inventory = repository.get_inventory(db)
@@ -167,25 +311,6 @@ async def show_data(request: Request, db: Session = Depends(get_db)):
 #     })
 
 
-def generate_qr_code_with_text(data, text):
-    BASE_DIR = Path(__file__).resolve().parent
-    FONT_PATH = BASE_DIR / "static" / "fonts" / "CommitMonoNerdFont-Bold.otf"
-
-    qr = qrcode.QRCode(version=1, box_size=10, border=3, error_correction=qrcode.constants.ERROR_CORRECT_H)
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-    draw = ImageDraw.Draw(img)
-    font = ImageFont.truetype(str(FONT_PATH), 100)  # Выберите шрифт и размер
-    text_width, text_height = draw.textbbox((0, 0), text, font=font)[2:]  # Используем textbbox
-    text_x = (img.width - text_width) // 2
-    text_y = (img.height - text_height) // 2 - 10  # Сдвигаем текст вверх
-    draw.text((text_x + 1, text_y + 1), text, font=font, fill="black")  # Черная тень
-    draw.text((text_x, text_y), text, font=font, fill="white")  # Белый текст
-
-    return img
-
 def save_qr_code(order, drawing):
     qr_data = f"Order: {order.order_number}, Drawing: {drawing.file_name}"
     qr_image = generate_qr_code_with_text(qr_data, order.order_number)
@@ -224,10 +349,27 @@ async def print_order(request: Request, order_id: int, db: Session = Depends(get
 
     return templates.TemplateResponse("order_blank.html", {"request": request, "order": order, "qr_code_img": qr_code_img})
 
+@app.get("/api/planning/load")
+async def get_planning_load(start: Optional[date] = None, days: int = planning.DEFAULT_DAYS, material: Optional[str] = None, db: Session = Depends(get_db)):
+    calendar = planning.get_load_calendar(db, start, days)
+    if material is not None:
+        # Кешированный результат не изменяем: фильтруем в копии
+        calendar = dict(calendar, materials=[m for m in calendar["materials"] if m["material"] == material])
+    return calendar
+
+@app.get("/planning", response_class=HTMLResponse)
+async def show_planning(request: Request, start: Optional[date] = None, days: int = planning.DEFAULT_DAYS, db: Session = Depends(get_db)):
+    calendar = planning.get_load_calendar(db, start, days)
+    max_load = max((w["load"] for m in calendar["materials"] for w in m["weekly"]), default=0)
+    return templates.TemplateResponse("planning.html", {"request": request, "calendar": calendar, "max_load": max_load})
+
 @app.get("/production_orders", response_class=HTMLResponse)
 async def show_production_orders(request: Request, db: Session = Depends(get_db)):
-    orders = db.query(models.ProductionOrder).order_by(models.ProductionOrder.publication_date.desc()).all()
-    logger.info(f"Получено {len(orders)} заказов из базы данных")
+    # Чертежи подгружаются двумя дополнительными запросами на всю страницу, а не на каждый заказ
+    orders = db.query(models.ProductionOrder).options(
+        selectinload(models.ProductionOrder.drawings).joinedload(models.OrderDrawing.drawing)
+    ).order_by(models.ProductionOrder.publication_date.desc()).all()
+    logger.info("Получено %s заказов из базы данных", len(orders))
     return templates.TemplateResponse("production_orders.html", {"request": request, "orders": orders})
 
 
@@ -259,26 +401,8 @@ async def save_upload_file(upload_file: UploadFile, destination: str) -> str:
         raise HTTPException(status_code=500, detail="Could not save file")
 
 def generate_order_number(drawing_designation, db):
-    # Извлекаем первые две цифры из drawing_designation
-    match = re.search(r'\d{2}', drawing_designation)
-    if match:
-        prefix = match.group()
-    else:
-        prefix = '00'  # Если цифры не найдены, используем '00'
-
-    def generate_unique_code():
-        # Генерируем 4-значный код из цифр и заглавных букв
-        chars = string.ascii_uppercase + string.digits
-        return ''.join(random.choice(chars) for _ in range(4))
-
-    while True:
-        unique_code = generate_unique_code()
-        order_number = f'{prefix}{unique_code}'
-
-        # Проверяем, существует ли уже такой order_number
-        existing_order = db.query(models.ProductionOrder).filter_by(order_number=order_number).first()
-        if not existing_order:
-            return order_number
+    # Первые две цифры обозначения + 4 случайных символа, с проверкой уникальности
+    return repository.allocate_order_numbers(db, [drawing_designation])[0]
 
 
 @app.post("/create_order")
@@ -293,12 +417,12 @@ async def create_order(
     drawing_files: List[UploadFile] = File(...),
     db: Session = Depends(get_db)
 ):
+    # Форма разобрана FastAPI до вызова обработчика: отмечаем это время задним числом
+    tracing.record_span("request.parse_multipart", tracing.current_span().start_ns, files=len(drawing_files))
     try:
-        logger.info(f"Received order data: drawing_designation={drawing_designation}, "
-                    f"quantity={quantity}, desired_production_date_start={desired_production_date_start}, "
-                    f"desired_production_date_end={desired_production_date_end}, "
-                    f"required_material={required_material}, metal_delivery_date={metal_delivery_date}, "
-                    f"notes={notes}, number of files: {len(drawing_files)}")
+        # Примечания и остальные поля формы в журнал не пишутся
+        logger.info("Received order: drawing_designation=%s, quantity=%s, files=%s",
+                    drawing_designation, quantity, len(drawing_files))
 
         start_date = datetime.strptime(desired_production_date_start, "%d.%m.%Y").date()
         end_date = datetime.strptime(desired_production_date_end, "%d.%m.%Y").date()
@@ -319,17 +443,14 @@ async def create_order(
             drawing_files=[]  # Пустой список, который мы заполним позже
         )
 
-        new_order = repository.create_production_order(db, order_data)
-        logger.info(f"Order created with ID: {new_order.id} and number: {new_order.order_number}")
+        with tracing.span("order.insert"):
+            new_order = repository.create_production_order(db, order_data)
+        logger.info("Order created with ID: %s and number: %s", new_order.id, new_order.order_number)
 
         # Генерируем один QR-код для всего заказа
-        qr_data = f"https://192.168.0.96:8343/view_drawing/{new_order.id}"
-        qr_image = generate_qr_code_with_text(qr_data, new_order.order_number)
-
-        # Сохраняем QR-код
-        qr_filename = f"qr_code_order_{new_order.id}.png"
-        qr_path = get_file_path(hashlib.sha256(qr_filename.encode()).hexdigest(), ".png")
-        qr_image.save(qr_path, format="PNG")
+        with tracing.span("qr.generate", order_id=new_order.id):
+            qr_path = qr_codes.order_qr_path(new_order.id)
+            await drawing_store.write_atomic_async(qr_path, qr_codes.render_order_qr(new_order.id, new_order.order_number))
 
         # Сохраняем путь к QR-коду в заказе
         new_order.qr_code_path = os.path.relpath(qr_path, 'static')
@@ -339,7 +460,8 @@ async def create_order(
             if not file_utils.is_allowed_file(drawing_file.filename):
                 raise HTTPException(status_code=400, detail=f"Invalid file type: {drawing_file.filename}")
 
-            processed_file = await process_uploaded_file(drawing_file, db)
+            with tracing.span("drawing.upload", file_name=drawing_file.filename):
+                processed_file = await process_uploaded_file(drawing_file)
             processed_files.append(processed_file)
 
             drawing = repository.get_or_create_drawing(
@@ -350,10 +472,17 @@ async def create_order(
                 processed_file['file_size'],
                 processed_file['mime_type']
             )
+            # Чертеж мог быть архивным и уже упакованным в pack-файл
+            await asyncio.to_thread(archive_pack.unarchive_drawing, db, drawing)
             repository.create_order_drawing(db, new_order.id, drawing.id)
 
+            # Стандартизация и подготовка чертежа с QR-кодом — в фоновом воркере
+            job = job_queue.enqueue(db, "process_drawing", {"drawing_id": drawing.id, "order_id": new_order.id})
+            processed_file['job_id'] = job.id
+
         new_order.drawing_link = ','.join([file['file_path'] for file in processed_files])
-        db.commit()
+        with tracing.span("db.commit"):
+            db.commit()
 
         # Отправляем уведомление о новом заказе
         await manager.broadcast(json.dumps({"action": "new_order", "order": new_order.to_dict()}))
@@ -366,12 +495,12 @@ async def create_order(
         }, status_code=201)
 
     except ValidationError as e:
-        logger.error(f"Validation error: {e.json()}")
+        logger.error("Validation error: %s", e.json())
         raise HTTPException(status_code=422, detail=f"Validation error: {e.errors()}")
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Error creating order: {str(e)}", exc_info=True)
+        logger.error("Error creating order: %s", e, exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -391,7 +520,7 @@ async def update_production_order(
     db: Session = Depends(get_db)
 ):
     try:
-        logger.info(f"Начало обновления заказа {order_id}")
+        logger.info("Начало обновления заказа %s", order_id)
 
         order = db.query(models.ProductionOrder).filter(models.ProductionOrder.id == order_id).first()
         if not order:
@@ -419,14 +548,14 @@ async def update_production_order(
                     if drawing:
                         drawing.archived_at = func.now()
                         db.add(drawing)
-                        logger.info(f"Drawing {drawing_id} archived for order {order_id}")
+                        logger.info("Drawing %s archived for order %s", drawing_id, order_id)
 
         # Обработка новых чертежей
         new_file_paths = []
         if drawing_files:
             for drawing_file in drawing_files:
                 if drawing_file.filename:
-                    processed_file = await process_uploaded_file(drawing_file, db)
+                    processed_file = await process_uploaded_file(drawing_file)
                     new_file_paths.append(processed_file['file_path'])
 
                     drawing = repository.get_or_create_drawing(
@@ -438,6 +567,9 @@ async def update_production_order(
                         processed_file['mime_type']
                     )
 
+                    # Повторно добавленный архивный чертеж снова становится активным
+                    await asyncio.to_thread(archive_pack.unarchive_drawing, db, drawing)
+
                     existing_order_drawing = db.query(models.OrderDrawing).filter(
                         models.OrderDrawing.order_id == order.id,
                         models.OrderDrawing.drawing_id == drawing.id
@@ -445,8 +577,9 @@ async def update_production_order(
 
                     if not existing_order_drawing:
                         repository.create_order_drawing(db, order.id, drawing.id)
+                        job_queue.enqueue(db, "process_drawing", {"drawing_id": drawing.id, "order_id": order.id})
 
-                    logger.info(f"Drawing {drawing.file_name} added/updated for order {order_id}")
+                    logger.info("Drawing %s added/updated for order %s", drawing.file_name, order_id)
 
         # Обновляем список активных чертежей
         active_drawings = db.query(models.OrderDrawing).filter(
@@ -460,10 +593,10 @@ async def update_production_order(
         order.drawing_link = ','.join(set(all_file_paths))  # Используем set для удаления дубликатов
 
         db.commit()
-        logger.info(f"Заказ успешно обновлен: {order.id}")
+        logger.info("Заказ успешно обновлен: %s", order.id)
 
         update_message = json.dumps({"action": "update_order", "order": order.to_dict()})
-        logger.info(f"Отправка уведомления об обновлении: {update_message}")
+        logger.info("Отправка уведомления об обновлении заказа %s", order.id)
         await manager.broadcast(update_message)
 
         return JSONResponse(content={
@@ -473,28 +606,28 @@ async def update_production_order(
         }, status_code=200)
 
     except Exception as e:
-        logger.error(f"Ошибка при обновлении заказа: {str(e)}")
+        logger.error("Ошибка при обновлении заказа: %s", e)
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении заказа: {str(e)}")
 
 
 @app.get("/combine_drawing_with_qr/{order_id}/{drawing_id}")
 async def combine_drawing_with_qr(order_id: int, drawing_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Запрос на объединение чертежа с QR-кодом: order_id={order_id}, drawing_id={drawing_id}")
+    logger.info("Запрос на объединение чертежа с QR-кодом: order_id=%s, drawing_id=%s", order_id, drawing_id)
 
     try:
         order = db.query(models.ProductionOrder).filter(models.ProductionOrder.id == order_id).first()
         if not order:
-            logger.error(f"Заказ не найден: order_id={order_id}")
+            logger.error("Заказ не найден: order_id=%s", order_id)
             raise HTTPException(status_code=404, detail="Заказ не найден")
 
         drawing = db.query(models.Drawing).filter(models.Drawing.id == drawing_id).first()
         if not drawing:
-            logger.error(f"Чертеж не найден: drawing_id={drawing_id}")
+            logger.error("Чертеж не найден: drawing_id=%s", drawing_id)
             raise HTTPException(status_code=404, detail="Чертеж не найден")
 
         if not order.qr_code_path:
-            logger.error(f"QR-код не найден для заказа: order_id={order_id}")
+            logger.error("QR-код не найден для заказа: order_id=%s", order_id)
             raise HTTPException(status_code=404, detail="QR-код не найден")
 
         # Удаляем проверку qr_code_path для OrderDrawing
@@ -503,11 +636,17 @@ async def combine_drawing_with_qr(order_id: int, drawing_id: int, db: Session =
             models.OrderDrawing.drawing_id == drawing_id
         ).first()
         if not order_drawing:
-            logger.error(f"Связь заказа и чертежа не найдена: order_id={order_id}, drawing_id={drawing_id}")
+            logger.error("Связь заказа и чертежа не найдена: order_id=%s, drawing_id=%s", order_id, drawing_id)
             raise HTTPException(status_code=404, detail="Связь заказа и чертежа не найдена")
 
+        # Готовый чертеж с QR-кодом мог быть отрисован фоновой задачей
+        cache_path = image_processing.composite_cache_path(order_id, drawing_id, date.today())
+        if os.path.exists(cache_path):
+            logger.info("Отдаем заранее подготовленный чертеж: %s", cache_path)
+            return FileResponse(cache_path, media_type="image/png")
+
         # Логируем исходный путь к файлу чертежа
-        logger.info(f"Исходный путь к чертежу: {drawing.file_path}")
+        logger.debug("Исходный путь к чертежу: %s", drawing.file_path)
 
         # Корректируем пути к файлам
         drawing_path = drawing.file_path
@@ -523,63 +662,46 @@ async def combine_drawing_with_qr(order_id: int, drawing_id: int, db: Session =
             qr_code_path = qr_code_path[7:]
         qr_code_path = os.path.join('static', qr_code_path)
 
-        logger.info(f"Скорректированный путь к чертежу: {drawing_path}")
-        logger.info(f"Путь к QR-коду: {qr_code_path}")
+        logger.debug("Скорректированный путь к чертежу: %s", drawing_path)
+        logger.debug("Путь к QR-коду: %s", qr_code_path)
 
         # Проверяем существование файлов
+        drawing_source = drawing_path
         if not os.path.exists(drawing_path):
-            logger.error(f"Файл чертежа не найден: {drawing_path}")
+            logger.error("Файл чертежа не найден: %s", drawing_path)
             # Попробуем найти файл в корневой директории static
             alternative_path = os.path.join('static', os.path.basename(drawing_path))
+            blob = archive_pack.get_blob(db, drawing.hash)
             if os.path.exists(alternative_path):
-                logger.info(f"Найден альтернативный путь к чертежу: {alternative_path}")
-                drawing_path = alternative_path
+                logger.info("Найден альтернативный путь к чертежу: %s", alternative_path)
+                drawing_source = alternative_path
+            elif blob:
+                # Архивный чертеж читается прямо из pack-файла
+                logger.info("Чертеж читается из архива: %s", blob.pack_name)
+                drawing_source = io.BytesIO(archive_pack.read_range(blob))
             else:
                 raise HTTPException(status_code=404, detail=f"Файл чертежа не найден: {drawing_path}")
 
         if not os.path.exists(qr_code_path):
-            logger.error(f"Файл QR-кода не найден: {qr_code_path}")
+            logger.error("Файл QR-кода не найден: %s", qr_code_path)
             raise HTTPException(status_code=404, detail=f"Файл QR-кода не найден: {qr_code_path}")
 
-        # Открываем чертеж
-        with Image.open(drawing_path).convert('RGBA') as img:
-            # Открываем QR-код
-            with Image.open(qr_code_path).convert('RGBA') as qr_code:
-                # Определяем размеры и позицию для QR-кода
-                qr_size_ratio = 0.25 if img.width > img.height else 0.2
-                qr_size = int(min(img.width, img.height) * qr_size_ratio)
-                qr_code = qr_code.resize((qr_size, qr_size), Image.LANCZOS)
-
-                offset_ratio = 0.015
-                offset = int(min(img.width, img.height) * offset_ratio)
-                position = (img.width - qr_size - offset, img.height - qr_size - offset)
-
-                # Создаем новое изображение с белым фоном для QR-кода
-                qr_background = Image.new('RGBA', (qr_size, qr_size), (255, 255, 255, 255))
-                qr_background.paste(qr_code, (0, 0), qr_code)
-
-                # Вставляем QR-код на чертеж
-                img.alpha_composite(qr_background, position)
-
-                # Добавляем дату
-                draw = ImageDraw.Draw(img)
-                upload_date = datetime.now().strftime('%d.%m.%Y')
-                font_size = int(min(img.width, img.height) * 0.03)
-                font_path = os.path.join('static', 'fonts', 'CommitMonoNerdFont-Bold.otf')
-                font = ImageFont.truetype(font_path, font_size)
-                date_position = (offset, img.height - offset - font_size)
-                draw.text(date_position, upload_date, font=font, fill=(0, 0, 0))
-
-                # Сохраняем результат в буфер
-                buffer = io.BytesIO()
-                img.save(buffer, format='PNG')
-                buffer.seek(0)
-
-        logger.info(f"Чертеж успешно объединен с QR-кодом: order_id={order_id}, drawing_id={drawing_id}")
-        return StreamingResponse(buffer, media_type="image/png")
+        # Отрисовка выполняется в потоке и сохраняется на сегодняшнюю дату
+        upload_date = datetime.now().strftime('%d.%m.%Y')
+
+        async def render_and_store():
+            png = await asyncio.to_thread(image_processing.render_composite, drawing_source, qr_code_path, upload_date)
+            await drawing_store.write_atomic_async(cache_path, png)
+            return png
+
+        # Одновременные сканирования одной наклейки отрисовывают чертеж один раз
+        png = await singleflight.composites.do((order_id, drawing_id, date.today()), render_and_store)
+
+        logger.info("Чертеж успешно объединен с QR-кодом: order_id=%s, drawing_id=%s", order_id, drawing_id)
+        return StreamingResponse(io.BytesIO(png), media_type="image/png")
 
     except Exception as e:
-        logger.error(f"Неожиданная ошибка в combine_drawing_with_qr: {str(e)}", exc_info=True)
+        logger.error("Неожиданная ошибка в combine_drawing_with_qr: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Неожиданная ошибка: {str(e)}")
 
 
@@ -589,11 +711,11 @@ async def debug_combine(order_id: int, drawing_id: int):
 
 def archive_drawing(drawing_path: str, order_number: str) -> str:
     try:
-        logger.info(f"Попытка архивации чертежа: {drawing_path}")
+        logger.info("Попытка архивации чертежа: %s", drawing_path)
 
         source_path = os.path.join(STATIC_DIR, drawing_path)
         if not os.path.exists(source_path):
-            logger.error(f"Исходный файл не найден: {source_path}")
+            logger.error("Исходный файл не найден: %s", source_path)
             return None
 
         # Создаем имя для архивного файла
@@ -602,11 +724,11 @@ def archive_drawing(drawing_path: str, order_number: str) -> str:
 
         # Перемещаем файл в архивную директорию
         shutil.move(source_path, archive_path)
-        logger.info(f"Чертеж успешно перемещен в архив: {archive_path}")
+        logger.info("Чертеж успешно перемещен в архив: %s", archive_path)
 
         return os.path.join('archived_drawings', archive_filename)
     except Exception as e:
-        logger.error(f"Ошибка при архивации чертежа: {str(e)}")
+        logger.error("Ошибка при архивации чертежа: %s", e)
         return None
 
 @app.put("/update_order/{order_id}")
@@ -648,14 +770,14 @@ async def production_order_form(request: Request):
 
 def process_drawing(drawing_path: str, order: models.ProductionOrder) -> str:
     try:
-        logger.info(f"Начало обработки чертежа: {drawing_path}")
+        logger.info("Начало обработки чертежа: %s", drawing_path)
 
         if not os.path.exists(drawing_path):
-            logger.error(f"Файл не найден: {drawing_path}")
+            logger.error("Файл не найден: %s", drawing_path)
             return None
 
         with Image.open(drawing_path).convert('RGBA') as img:
-            logger.info(f"Изображение открыто успешно. Размер: {img.size}")
+            logger.debug("Изображение открыто успешно. Размер: %s", img.size)
 
             qr_code_data = f"Заказ-наряд №: {order.order_number}\n" \
                            f"Дата публикации: {order.publication_date.strftime('%d.%m.%Y')}\n" \
@@ -665,18 +787,18 @@ def process_drawing(drawing_path: str, order: models.ProductionOrder) -> str:
                            f"Необходимый материал: {order.required_material}\n" \
                            f"Срок поставки металла: {order.metal_delivery_date}\n" \
                            f"Примечания: {order.notes}"
-            logger.info("QR-код данные подготовлены")
+            logger.debug("QR-код данные подготовлены")
 
             qr_code_img = generate_qr_code_with_text(qr_code_data, order.order_number)
-            logger.info("QR-код сгенерирован")
+            logger.debug("QR-код сгенерирован")
 
             # Предполагаем, что qr_code_img уже является объектом изображения
             qr_code = qr_code_img.convert('RGBA')
-            logger.info("QR-код изображение создано")
+            logger.debug("QR-код изображение создано")
 
             # Определяем ориентацию чертежа
             is_landscape = img.width > img.height
-            logger.info(f"Ориентация чертежа: {'альбомная' if is_landscape else 'портретная'}")
+            logger.debug("Ориентация чертежа: %s", 'альбомная' if is_landscape else 'портретная')
 
             # Вычисляем размер QR-кода
             if is_landscape:
@@ -685,26 +807,26 @@ def process_drawing(drawing_path: str, order: models.ProductionOrder) -> str:
             else:
                 qr_size_ratio = 0.2  # 20% от ширины изображения для портретной ориентации
                 qr_size_px = int(img.width * qr_size_ratio)
-            logger.info(f"Размер QR-кода: {qr_size_px}x{qr_size_px} пикселей")
+            logger.debug("Размер QR-кода: %sx%s пикселей", qr_size_px, qr_size_px)
 
             # Создаем новое изображение с белым фоном для QR-кода
             qr_background = Image.new('RGBA', (qr_size_px, qr_size_px), (255, 255, 255, 255))
             qr_code = qr_code.resize((qr_size_px, qr_size_px), Image.LANCZOS)
-            logger.info("QR-код подготовлен для вставки")
+            logger.debug("QR-код подготовлен для вставки")
 
             # Наложение QR-кода на белый фон
             qr_background.alpha_composite(qr_code)
-            logger.info("QR-код наложен на белый фон")
+            logger.debug("QR-код наложен на белый фон")
 
             # Вычисляем позицию для QR-кода (правый нижний угол с отступом)
             offset_ratio = 0.015  # 1.5% от размера изображения
             offset_px = int(img.width * offset_ratio)
             qr_position = (img.width - qr_size_px - offset_px, img.height - qr_size_px - offset_px)
-            logger.info(f"Позиция QR-кода: {qr_position}")
+            logger.debug("Позиция QR-кода: %s", qr_position)
 
             # Вставляем QR-код
             img.alpha_composite(qr_background, qr_position)
-            logger.info("QR-код вставлен в изображение")
+            logger.debug("QR-код вставлен в изображение")
 
             # Добавляем дату загрузки
             draw = ImageDraw.Draw(img)
@@ -714,28 +836,28 @@ def process_drawing(drawing_path: str, order: models.ProductionOrder) -> str:
             FONT_PATH = BASE_DIR / "static" / "fonts" / "CommitMonoNerdFont-Bold.otf"
             font_size = 56
             font = ImageFont.truetype(str(FONT_PATH), font_size)
-            logger.info(f"Шрифт загружен: {FONT_PATH}")
+            logger.debug("Шрифт загружен: %s", FONT_PATH)
 
             # Вычисляем позицию для даты (левый нижний угол с отступом)
             date_position = (offset_px, img.height - offset_px - font_size)
-            logger.info(f"Позиция даты: {date_position}")
+            logger.debug("Позиция даты: %s", date_position)
 
             # Рисуем текст с тенью для лучшей читаемости
             shadow_color = (200, 200, 200)  # Светло-серый цвет для тени
             draw.text((date_position[0]+1, date_position[1]+1), f"{upload_date}", font=font, fill=shadow_color)
             draw.text(date_position, f"{upload_date}", font=font, fill=(0, 0, 0))
-            logger.info("Дата добавлена на изображение")
+            logger.debug("Дата добавлена на изображение")
 
             # Сохранение обработанного чертежа
             processed_filename = f"{order.order_number}_{int(time.time())}.png"
             processed_filepath = os.path.join(MODIFIED_DRAWINGS_DIR, processed_filename)
             img.save(processed_filepath, format='PNG')
-            logger.info(f"Обработанный чертеж сохранен: {processed_filepath}")
+            logger.info("Обработанный чертеж сохранен: %s", processed_filepath)
 
             return processed_filepath
 
     except Exception as e:
-        logger.error(f"Ошибка при обработке чертежа: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обработке чертежа: %s", e, exc_info=True)
         return None
 
 @app.get("/print_drawing/{order_id}/{drawing_id}")
@@ -759,114 +881,89 @@ def mm_to_pixels(mm, dpi):
     """Конвертирует миллиметры в пиксели."""
     return int(mm / 25.4 * dpi)
 
-# Увеличиваем лимит для больших файлов
-Image.MAX_IMAGE_PIXELS = None
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-
 async def standardize_image(image_path, target_dpi=300, max_size=(5000, 5000)):
     try:
-        # Определяем новый путь для стандартизированного изображения
+        # Декодирование и ресемплинг выполняются в потоке, файл заменяется атомарно
         standardized_path = image_path  # Перезаписываем оригинальный файл
-
-        async with aiofiles.open(image_path, "rb") as f:
-            img = Image.open(io.BytesIO(await f.read()))
-
-            dpi = img.info.get('dpi', (96, 96))
-            dpi = max(dpi[0], 96)
-
-            original_size = img.size
-
-            scale_factor = target_dpi / dpi
-            new_width = int(img.width * scale_factor)
-            new_height = int(img.height * scale_factor)
-
-            if new_width > max_size[0] or new_height > max_size[1]:
-                scale = min(max_size[0] / new_width, max_size[1] / new_height)
-                new_width = int(new_width * scale)
-                new_height = int(new_height * scale)
-
-            new_size = (new_width, new_height)
-
-            img_resized = img.resize(new_size, Image.LANCZOS)
-            img_resized.info['dpi'] = (target_dpi, target_dpi)
-
-            buffer = io.BytesIO()
-            img_resized.save(buffer, format="PNG", dpi=(target_dpi, target_dpi))
-            buffer.seek(0)
-
-            async with aiofiles.open(standardized_path, "wb") as out_file:
-                await out_file.write(buffer.getvalue())
-
-        logger.info(f"Изображение успешно стандартизировано: {standardized_path}")
+        original_size, new_size = await asyncio.to_thread(
+            image_processing.standardize_file, image_path, target_dpi, max_size
+        )
+        logger.info("Изображение успешно стандартизировано: %s", standardized_path)
         return str(standardized_path), original_size, new_size
     except Exception as e:
-        logger.error(f"Ошибка при стандартизации изображения {image_path}: {str(e)}")
+        logger.error("Ошибка при стандартизации изображения %s: %s", image_path, e)
         raise
 
 def safe_get_mtime(file_path):
     try:
         return os.path.getmtime(file_path)
     except FileNotFoundError:
-        logger.warning(f"Файл не найден: {file_path}")
+        logger.warning("Файл не найден: %s", file_path)
         return None
 
-async def process_uploaded_file(file: UploadFile, db: Session):
+async def process_uploaded_file(file: UploadFile):
     try:
         content = await file.read()
-        file_hash = hashlib.sha256(content).hexdigest()
+        with metrics.stage("hash"):
+            file_hash = hashlib.sha256(content).hexdigest()
+
+        async def store_upload_with(session: Session):
+            # Проверяем, существует ли файл с таким хешем в базе данных
+            existing_drawing = session.query(models.Drawing).filter(models.Drawing.hash == file_hash).first()
+            if existing_drawing:
+                logger.info("Файл с хешем %s уже существует. Используем существующий файл.", file_hash)
+                # Обновляем last_used_at
+                existing_drawing.last_used_at = func.now()
+                session.commit()
+                return {
+                    "file_name": existing_drawing.file_name,
+                    "file_path": existing_drawing.file_path,
+                    "hash": existing_drawing.hash,
+                    "file_size": existing_drawing.file_size,
+                    "mime_type": existing_drawing.mime_type
+                }
+
+            # Путь определяется только хешем, расширение хранится в file_name/mime_type
+            final_path = get_file_path(file_hash)
+
+            # Сохраняем файл атомарно
+            with tracing.span("file.write", bytes=len(content)):
+                await drawing_store.write_atomic_async(final_path, content)
+
+            # Стандартизация выполняется фоновой задачей (см. app/drawing_jobs.py),
+            # до ее завершения processed_at остается пустым
+            file_size = len(content)
+            mime_type = mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+
+            # Размеры, DPI, режим и ориентация читаются из заголовка без декодирования
+            metadata = drawing_metadata.extract_metadata(content)
+
+            # Создаем новую запись в базе данных (INSERT ... ON CONFLICT DO NOTHING)
+            new_drawing = repository.get_or_create_drawing(
+                session, file_hash, final_path, file.filename, file_size, mime_type, **metadata
+            )
 
-        # Проверяем, существует ли файл с таким хешем в базе данных
-        existing_drawing = db.query(models.Drawing).filter(models.Drawing.hash == file_hash).first()
-        if existing_drawing:
-            logger.info(f"Файл с хешем {file_hash} уже существует. Используем существующий файл.")
-            # Обновляем last_used_at
-            existing_drawing.last_used_at = func.now()
-            db.commit()
             return {
-                "file_name": existing_drawing.file_name,
-                "file_path": existing_drawing.file_path,
-                "hash": existing_drawing.hash,
-                "file_size": existing_drawing.file_size,
-                "mime_type": existing_drawing.mime_type
+                "file_name": new_drawing.file_name,
+                "file_path": new_drawing.file_path,
+                "hash": new_drawing.hash,
+                "file_size": new_drawing.file_size,
+                "mime_type": new_drawing.mime_type
             }
 
-        file_extension = os.path.splitext(file.filename)[1]
-        final_path = get_file_path(file_hash, file_extension)
-
-        # Создаем директории, если они не существуют
-        os.makedirs(os.path.dirname(final_path), exist_ok=True)
-
-        # Сохраняем файл
-        with open(final_path, "wb") as buffer:
-            buffer.write(content)
-
-        # Стандартизируем изображение
-        standardized_path, original_size, new_size = await standardize_image(final_path)
-
-        file_size = os.path.getsize(standardized_path)
-        mime_type = mimetypes.guess_type(standardized_path)[0] or 'application/octet-stream'
-
-        # Создаем новую запись в базе данных
-        new_drawing = models.Drawing(
-            file_name=file.filename,
-            file_path=standardized_path,
-            hash=file_hash,
-            file_size=file_size,
-            mime_type=mime_type
-        )
-        db.add(new_drawing)
-        db.commit()
-        db.refresh(new_drawing)
-
-        return {
-            "file_name": new_drawing.file_name,
-            "file_path": new_drawing.file_path,
-            "hash": new_drawing.hash,
-            "file_size": new_drawing.file_size,
-            "mime_type": new_drawing.mime_type
-        }
+        async def store_upload():
+            # Работа может пережить запрос, который ее начал (см. SingleFlight),
+            # поэтому у нее своя сессия, а не сессия запроса
+            session = SessionLocal()
+            try:
+                return await store_upload_with(session)
+            finally:
+                session.close()
+
+        # Одновременные загрузки одного и того же файла сохраняются один раз
+        return dict(await singleflight.uploads.do(file_hash, store_upload))
     except Exception as e:
-        logger.error(f"Ошибка при обработке файла {file.filename}: {str(e)}")
+        logger.error("Ошибка при обработке файла %s: %s", file.filename, e)
         raise HTTPException(status_code=500, detail=f"Ошибка при обработке файла: {str(e)}")
 
 
@@ -880,10 +977,10 @@ def archive_old_drawing(drawing_path):
         archived_filename = f"archived_{os.path.basename(drawing_path)}"
         archived_path = os.path.join(archive_dir, archived_filename)
         shutil.move(full_path, archived_path)
-        logger.info(f"Чертеж архивирован: {archived_path}")
+        logger.info("Чертеж архивирован: %s", archived_path)
         return f"archived_drawings/{archived_filename}"
     else:
-        logger.warning(f"Чертеж не найден для архивации: {full_path}")
+        logger.warning("Чертеж не найден для архивации: %s", full_path)
         return None
 
 
@@ -903,7 +1000,12 @@ async def view_drawing(request: Request, order_id: int, db: Session = Depends(ge
         {
             "id": od.drawing.id,
             "path": od.drawing.file_path.replace('static/', ''),
+            "url": drawing_delivery.drawing_url(od.drawing.hash),
+            "thumb_url": renditions.rendition_url(od.drawing.hash, "preview"),
             "name": od.drawing.file_name,
+            "width": od.drawing.width,
+            "height": od.drawing.height,
+            "orientation": od.drawing.orientation,
         }
         for od in order.drawings if not od.drawing.archived_at
     ]
@@ -931,6 +1033,8 @@ async def edit_production_order(request: Request, order_id: int, db: Session = D
                 "id": drawing.id,
                 "file_name": drawing.file_name,
                 "file_path": file_path,
+                "url": drawing_delivery.drawing_url(drawing.hash),
+                "thumb_url": renditions.rendition_url(drawing.hash),
             })
 
     return templates.TemplateResponse("production_order_form.html", {
@@ -961,6 +1065,8 @@ async def drawing_history(request: Request, order_id: int, db: Session = Depends
             {
                 "id": drawing.id,
                 "path": drawing.file_path[7:] if drawing.file_path.startswith("static/") else drawing.file_path,
+                "url": drawing_delivery.drawing_url(drawing.hash),
+                "thumb_url": renditions.rendition_url(drawing.hash),
                 "name": drawing.file_name,
             }
             for drawing in drawings
@@ -976,7 +1082,9 @@ async def drawing_history(request: Request, order_id: int, db: Session = Depends
 
 @app.get("/api/orders")
 async def get_orders(db: Session = Depends(get_db)):
-    orders = db.query(models.ProductionOrder).all()
+    orders = db.query(models.ProductionOrder).options(
+        selectinload(models.ProductionOrder.drawings).joinedload(models.OrderDrawing.drawing)
+    ).all()
     return [order.to_dict() for order in orders]
 
 
@@ -1015,10 +1123,261 @@ async def upload_drawing(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def upload_error_response(e: resumable_upload.UploadError) -> JSONResponse:
+    headers = {"Cache-Control": "no-store"}
+    if e.offset is not None:
+        # Клиент продолжает загрузку с этого смещения
+        headers["Upload-Offset"] = str(e.offset)
+    return JSONResponse(content={"detail": e.detail}, status_code=e.status_code, headers=headers)
+
+async def register_uploaded_drawing(db: Session, file_hash: str, file_path: str, file_name: str, order_id: Optional[int]) -> dict:
+    """
+    Регистрирует чертеж из завершенной загрузки, привязывает его к заказу
+    и ставит задачу обработки. Если чертеж уже привязан к заказу, новая
+    привязка и задача не создаются.
+    """
+    drawing = repository.get_drawing_by_hash(db, file_hash)
+    if drawing:
+        repository.update_drawing_last_used(db, drawing.id)
+    else:
+        metadata = drawing_metadata.extract_metadata(file_path)
+        mime_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        drawing = repository.get_or_create_drawing(
+            db, file_hash, file_path, file_name, os.path.getsize(file_path), mime_type, **metadata
+        )
+    payload = {"drawing_id": drawing.id}
+    job = None
+    if order_id is not None:
+        # Чертеж мог быть архивным и уже упакованным в pack-файл
+        await asyncio.to_thread(archive_pack.unarchive_drawing, db, drawing)
+        existing_order_drawing = db.query(models.OrderDrawing).filter(
+            models.OrderDrawing.order_id == order_id,
+            models.OrderDrawing.drawing_id == drawing.id
+        ).first()
+        if existing_order_drawing:
+            db.commit()
+        else:
+            repository.create_order_drawing(db, order_id, drawing.id)
+            payload["order_id"] = order_id
+            job = job_queue.enqueue(db, "process_drawing", payload)
+    else:
+        job = job_queue.enqueue(db, "process_drawing", payload)
+    return {
+        "complete": True,
+        "drawing_id": drawing.id,
+        "hash": drawing.hash,
+        "url": drawing_delivery.drawing_url(drawing.hash),
+        "job_id": job.id if job else None,
+    }
+
+async def read_chunk_body(request: Request, limit: int) -> bytes:
+    chunks = []
+    size = 0
+    async for block in request.stream():
+        size += len(block)
+        if size > limit:
+            raise resumable_upload.UploadError(413, f"Часть больше {limit} байт")
+        chunks.append(block)
+    return b"".join(chunks)
+
+@app.post("/uploads")
+async def create_upload_session(upload: schemas.UploadSessionCreate, db: Session = Depends(get_db)):
+    if not file_utils.is_allowed_file(upload.file_name):
+        raise HTTPException(status_code=400, detail=f"Invalid file type: {upload.file_name}")
+    if upload.order_id is not None and not db.query(models.ProductionOrder).filter(models.ProductionOrder.id == upload.order_id).first():
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+
+    # Такой файл уже есть в хранилище — загружать байты повторно не нужно
+    existing_drawing = repository.get_drawing_by_hash(db, upload.sha256.lower())
+    if existing_drawing and (
+        os.path.exists(drawing_delivery.resolve_static_path(existing_drawing.file_path))
+        or archive_pack.get_blob(db, existing_drawing.hash)
+    ):
+        logger.info("Загрузка %s не нужна: чертеж %s уже существует", upload.file_name, existing_drawing.id)
+        return await register_uploaded_drawing(db, existing_drawing.hash, existing_drawing.file_path, upload.file_name, upload.order_id)
+
+    try:
+        meta = await asyncio.to_thread(
+            resumable_upload.create_session, upload.file_name, upload.length, upload.sha256, upload.order_id
+        )
+    except resumable_upload.UploadError as e:
+        return upload_error_response(e)
+
+    location = f"/uploads/{meta['upload_id']}"
+    return JSONResponse(
+        content={"complete": False, "upload_id": meta["upload_id"], "offset": 0,
+                 "max_chunk_size": resumable_upload.MAX_CHUNK_BYTES, "location": location},
+        status_code=201,
+        headers={"Location": location, "Upload-Offset": "0", "Upload-Length": str(meta["length"])},
+    )
+
+@app.head("/uploads/{upload_id}")
+@app.get("/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str):
+    try:
+        meta = await asyncio.to_thread(resumable_upload.load_session, upload_id)
+    except resumable_upload.UploadError as e:
+        return upload_error_response(e)
+    return JSONResponse(
+        content={"upload_id": upload_id, "offset": meta["offset"], "length": meta["length"]},
+        headers={"Upload-Offset": str(meta["offset"]), "Upload-Length": str(meta["length"]), "Cache-Control": "no-store"},
+    )
+
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, db: Session = Depends(get_db)):
+    try:
+        try:
+            offset = int(request.headers["upload-offset"])
+        except (KeyError, ValueError):
+            raise resumable_upload.UploadError(400, "Не указан заголовок Upload-Offset")
+        checksum = resumable_upload.parse_checksum(request.headers.get("upload-checksum"))
+        data = await read_chunk_body(request, resumable_upload.MAX_CHUNK_BYTES)
+        meta = await asyncio.to_thread(resumable_upload.append_chunk, upload_id, offset, data, checksum)
+
+        if meta["offset"] < meta["length"]:
+            return Response(status_code=204, headers={"Upload-Offset": str(meta["offset"])})
+
+        # Последняя часть: сверяем хеш всего файла и переносим его в хранилище
+        meta, file_path = await asyncio.to_thread(resumable_upload.assemble, upload_id)
+    except resumable_upload.UploadError as e:
+        logger.warning("Загрузка %s: %s", upload_id, e.detail)
+        return upload_error_response(e)
+
+    logger.info("Загрузка %s завершена: %s (%s байт)", upload_id, meta['file_name'], meta['length'])
+    result = await register_uploaded_drawing(db, meta["sha256"], file_path, meta["file_name"], meta["order_id"])
+    return JSONResponse(content=result, headers={"Upload-Offset": str(meta["offset"])})
+
+@app.delete("/uploads/{upload_id}")
+async def cancel_upload(upload_id: str):
+    try:
+        await asyncio.to_thread(resumable_upload.remove_session, upload_id)
+    except resumable_upload.UploadError as e:
+        return upload_error_response(e)
+    return Response(status_code=204)
+
+@app.post("/import_orders")
+async def import_orders(
+    file: UploadFile = File(...),
+    skip_invalid: bool = Form(False),
+    dry_run: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    content = await file.read()
+    try:
+        rows = await asyncio.to_thread(order_import.read_table, content, file.filename)
+        report = order_import.import_orders(db, rows, skip_invalid=skip_invalid, dry_run=dry_run)
+    except order_import.ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if report["imported"]:
+        # COPY минует ORM-события, сбрасываем кеш календаря явно
+        planning.invalidate()
+        await manager.broadcast(json.dumps({"action": "orders_imported", "count": report["imported"]}))
+    # Отчет по строкам возвращается и при ошибках: 422, если ничего не вставлено
+    status_code = 422 if report["errors"] and not report["imported"] and not dry_run else 200
+    return JSONResponse(content=report, status_code=status_code)
+
+@app.get("/export/{kind}")
+async def export_table(kind: str, format: str = "csv"):
+    if kind not in export.EXPORTS:
+        raise HTTPException(status_code=404, detail="Неизвестная выгрузка")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="Поддерживаются форматы csv и xlsx")
+    # Синхронный генератор Starlette выполняет в пуле потоков порциями
+    return StreamingResponse(
+        export.stream_export(kind, format),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{export.export_filename(kind, format)}"'},
+    )
+
 @app.get("/order_drawings/{order_id}")
 def get_order_drawings(order_id: int, db: Session = Depends(get_db)):
     drawings = repository.get_drawings_by_order(db, order_id)
-    return {"drawings": [{"id": d.id, "file_name": d.file_name, "file_path": d.file_path} for d in drawings]}
+    return {"drawings": [{
+        "id": d.id,
+        "file_name": d.file_name,
+        "file_path": d.file_path,
+        "url": drawing_delivery.drawing_url(d.hash),
+        "width": d.width,
+        "height": d.height,
+        "dpi": d.dpi,
+        "color_mode": d.color_mode,
+        "page_count": d.page_count,
+        "orientation": d.orientation,
+    } for d in drawings]}
+
+@app.get("/drawing_files/{file_hash}")
+async def get_drawing_file(request: Request, file_hash: str, db: Session = Depends(get_db)):
+    # URL строится по хешу содержимого, поэтому ответ можно кешировать навсегда
+    if not drawing_delivery.is_valid_hash(file_hash):
+        raise HTTPException(status_code=404, detail="Чертеж не найден")
+
+    if drawing_delivery.etag_matches(request.headers.get("if-none-match"), drawing_delivery.drawing_etag(file_hash)):
+        return drawing_delivery.not_modified_response(file_hash)
+
+    drawing = repository.get_drawing_by_hash(db, file_hash)
+    if not drawing:
+        raise HTTPException(status_code=404, detail="Чертеж не найден")
+
+    path = drawing_delivery.resolve_static_path(drawing.file_path)
+    if not os.path.exists(path):
+        # Архивный чертеж мог быть перенесен в pack-файл холодного хранилища
+        blob = archive_pack.get_blob(db, file_hash)
+        if blob:
+            return drawing_delivery.packed_blob_response(
+                blob, file_hash, drawing.mime_type, drawing.file_name,
+                request.headers.get("range"), request.headers.get("if-range")
+            )
+        logger.error("Файл чертежа не найден: %s", path)
+        raise HTTPException(status_code=404, detail="Файл чертежа не найден")
+
+    if drawing.processed_at is None:
+        # Файл еще будет заменен стандартизированной версией — не кешируем навсегда
+        return FileResponse(path, media_type=drawing.mime_type, headers={"Cache-Control": "no-cache"})
+
+    return drawing_delivery.immutable_file_response(path, file_hash, drawing.mime_type, drawing.file_name)
+
+@app.get("/drawing_files/{file_hash}/{rendition}")
+async def get_drawing_rendition(request: Request, file_hash: str, rendition: str, db: Session = Depends(get_db)):
+    if not drawing_delivery.is_valid_hash(file_hash) or rendition not in renditions.RENDITIONS:
+        raise HTTPException(status_code=404, detail="Чертеж не найден")
+
+    path = renditions.rendition_path(file_hash, rendition)
+    if os.path.exists(path):
+        # Готовые варианты неизменяемы так же, как оригинал
+        etag = drawing_delivery.drawing_etag(f"{file_hash}-{rendition}")
+        if drawing_delivery.etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"Cache-Control": drawing_delivery.IMMUTABLE_CACHE_CONTROL, "ETag": etag})
+        return FileResponse(path, media_type=renditions.RENDITION_MEDIA_TYPE, headers={
+            "Cache-Control": drawing_delivery.IMMUTABLE_CACHE_CONTROL,
+            "ETag": etag,
+        })
+
+    drawing = repository.get_drawing_by_hash(db, file_hash)
+    if not drawing:
+        raise HTTPException(status_code=404, detail="Чертеж не найден")
+    content = await asyncio.to_thread(archive_pack.read_drawing_bytes, db, drawing)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Файл чертежа не найден")
+
+    if drawing.processed_at is None:
+        # Оригинал еще будет стандартизирован: отдаем вариант без сохранения
+        rendered = await asyncio.to_thread(renditions.render_renditions, io.BytesIO(content))
+        return Response(rendered[rendition], media_type=renditions.RENDITION_MEDIA_TYPE, headers={"Cache-Control": "no-cache"})
+
+    # Старые чертежи: создаем варианты при первом обращении
+    await asyncio.to_thread(renditions.generate_renditions, io.BytesIO(content), file_hash)
+    return FileResponse(path, media_type=renditions.RENDITION_MEDIA_TYPE, headers={
+        "Cache-Control": drawing_delivery.IMMUTABLE_CACHE_CONTROL,
+        "ETag": drawing_delivery.drawing_etag(f"{file_hash}-{rendition}"),
+    })
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: int, db: Session = Depends(get_db)):
+    job = job_queue.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job.to_dict()
 
 if __name__ == "__main__":
     uvicorn.run(
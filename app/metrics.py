@@ -0,0 +1,419 @@
+"""
+Метрики в текстовом формате Prometheus (/metrics).
+
+Реестр простой и без внешних зависимостей: счетчики, gauge и гистограммы
+с метками, потокобезопасные (этапы обработки изображений выполняются в
+потоках через asyncio.to_thread). Часть значений (пул соединений БД,
+WebSocket-клиенты, занятое место в static/) снимается в момент сбора
+через функции, зарегистрированные в on_collect.
+
+Метрики относятся к процессу: при нескольких воркерах uvicorn Prometheus
+опрашивает каждый из них, а воркеры очереди задач (app/job_worker.py)
+считают свои этапы отдельно и здесь не видны.
+
+Параметры:
+    METRICS_DISK_USAGE_TTL — как часто пересчитывать размер static/, секунды
+"""
+import math
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+from app import tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Запросы к БД в основном короче миллисекунды
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+DISK_USAGE_TTL = float(os.getenv("METRICS_DISK_USAGE_TTL", "300"))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Ключ меток -> [счетчики по корзинам, сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """
+        Функция, обновляющая gauge перед каждым сбором. Ошибка в ней не
+        должна ломать весь /metrics, поэтому исключения глушатся.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception:
+                collect_errors.inc(collector=fn.__name__)
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+collect_errors = REGISTRY.counter(
+    "metrics_collect_errors_total", "Ошибки функций сбора метрик", ["collector"]
+)
+
+# HTTP
+http_requests = REGISTRY.counter(
+    "http_requests_total", "Обработанные HTTP-запросы", ["method", "route", "status"]
+)
+http_request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "Время обработки запроса до отправки всего ответа", ["method", "route"]
+)
+http_in_flight = REGISTRY.gauge(
+    "http_requests_in_flight", "Запросы в обработке", ["method"]
+)
+
+# Этапы обработки изображений: hash, decode, resize, composite, encode
+image_stage_duration = REGISTRY.histogram(
+    "image_stage_duration_seconds", "Время этапов обработки изображений", ["stage"]
+)
+
+# База данных
+db_query_duration = REGISTRY.histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запросов", ["statement"], buckets=DB_BUCKETS
+)
+db_pool_connections = REGISTRY.gauge(
+    "db_pool_connections", "Соединения пула SQLAlchemy", ["state"]
+)
+
+# WebSocket
+websocket_connections = REGISTRY.gauge(
+    "websocket_connections", "Открытые WebSocket-соединения"
+)
+websocket_broadcast_duration = REGISTRY.histogram(
+    "websocket_broadcast_duration_seconds", "Время рассылки сообщения всем клиентам"
+)
+websocket_broadcast_failures = REGISTRY.counter(
+    "websocket_broadcast_failures_total", "Клиенты, отключенные из-за ошибки отправки"
+)
+
+# Допуск запросов (app/admission.py)
+admission_requests = REGISTRY.gauge(
+    "admission_requests", "Запросы класса в обработке и в очереди", ["route_class", "state"]
+)
+admission_rejections = REGISTRY.counter(
+    "admission_rejections_total", "Запросы, отклоненные с 503", ["route_class"]
+)
+
+# Диск
+static_disk_usage = REGISTRY.gauge(
+    "static_disk_usage_bytes", "Размер файлов в подкаталогах static/", ["directory"]
+)
+static_disk_free = REGISTRY.gauge(
+    "static_disk_free_bytes", "Свободное место на разделе со static/"
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    with metrics.stage("decode"): ... — время этапа обработки изображения
+    (и спан image.<этап>, если запрос трассируется).
+    """
+    with tracing.span(f"image.{name}"), image_stage_duration.time(stage=name):
+        yield
+
+
+def statement_kind(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "OTHER"
+
+
+def instrument_engine(engine) -> None:
+    """
+    Время каждого запроса по типу (SELECT, INSERT, ...) и состояние пула.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if started:
+            db_query_duration.observe(time.perf_counter() - started.pop(), statement=statement_kind(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        # Запрос с ошибкой не доходит до after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("metrics_started"):
+            connection.info["metrics_started"].pop()
+
+    pool = engine.pool
+
+    @REGISTRY.on_collect
+    def collect_pool():
+        # У SingletonThreadPool/NullPool (SQLite) части методов нет
+        for state, method in (("checked_out", "checkedout"), ("checked_in", "checkedin"),
+                              ("overflow", "overflow"), ("size", "size")):
+            if hasattr(pool, method):
+                db_pool_connections.set(getattr(pool, method)(), state=state)
+
+
+def instrument_websockets(manager) -> None:
+    @REGISTRY.on_collect
+    def collect_websockets():
+        websocket_connections.set(len(manager.active_connections))
+
+
+def instrument_admission(controller) -> None:
+    @REGISTRY.on_collect
+    def collect_admission():
+        for name, stats in controller.stats()["classes"].items():
+            admission_requests.set(stats["active"], route_class=name, state="active")
+            admission_requests.set(stats["queued"], route_class=name, state="queued")
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    return total
+
+
+def instrument_disk(static_dir: str) -> None:
+    """
+    Обход хранилища чертежей дорогой, поэтому размер подкаталогов
+    пересчитывается не чаще раза в DISK_USAGE_TTL секунд.
+    """
+    state = {"checked_at": None}
+
+    @REGISTRY.on_collect
+    def collect_disk():
+        static_disk_free.set(shutil.disk_usage(static_dir).free)
+        now = time.monotonic()
+        if state["checked_at"] is not None and now - state["checked_at"] < DISK_USAGE_TTL:
+            return
+        state["checked_at"] = now
+        loose = 0
+        with os.scandir(static_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    static_disk_usage.set(_directory_size(entry.path), directory=entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    loose += entry.stat(follow_symlinks=False).st_size
+        static_disk_usage.set(loose, directory=".")
+
+
+def route_label(scope) -> str:
+    """
+    Шаблон маршрута (/view_drawing/{order_id}), а не фактический путь,
+    чтобы число рядов не росло с числом заказов.
+    """
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # Смонтированное приложение (StaticFiles) дописывает свой префикс в root_path
+    root_path = scope.get("root_path", "")
+    if root_path and root_path != scope.get("metrics_root_path", ""):
+        return root_path[len(scope.get("metrics_root_path", "")):]
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: время до полной отправки ответа (включая потоковые
+    выгрузки), статус и число запросов в обработке.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        scope["metrics_root_path"] = scope.get("root_path", "")
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        http_in_flight.inc(method=method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_label(scope)
+            http_in_flight.dec(method=method)
+            http_request_duration.observe(time.perf_counter() - started, method=method, route=route)
+            http_requests.inc(method=method, route=route, status=str(status["code"]))
@@ -0,0 +1,156 @@
+"""
+Офлайн-перенос чертежей из старой раскладки static/drawings/ГГГГ/ММ/ДД/
+в хранилище, шардированное по хешу (см. app/utils/drawing_store.py).
+
+Запуск (приложение лучше остановить):
+    python -m app.migrate_drawing_store --dry-run
+    python -m app.migrate_drawing_store --batch-size 1000
+
+Повторный запуск безопасен: уже перенесенные файлы пропускаются, а если
+процесс прервался между переносом и коммитом, путь в БД будет исправлен.
+"""
+import argparse
+import logging
+import os
+import re
+
+from sqlalchemy import select, update
+
+from app import models
+from app.database import SessionLocal
+from app.drawing_delivery import resolve_static_path
+from app.utils import drawing_store
+
+logger = logging.getLogger(__name__)
+
+_HASH_STEM_RE = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+_DATE_DIR_RE = re.compile(r"^\d{4}$")
+
+
+def relocate(source_path: str, destination_path: str, dry_run: bool) -> bool:
+    """
+    Переносит файл в хранилище. Возвращает True, если путь в БД можно обновить.
+    """
+    if source_path == destination_path:
+        return False
+
+    source_exists = os.path.exists(source_path)
+    destination_exists = os.path.exists(destination_path)
+
+    if destination_exists:
+        # Файл уже в хранилище (повторный запуск или дубликат старой раскладки)
+        if source_exists and not dry_run:
+            os.remove(source_path)
+        return True
+
+    if not source_exists:
+        logger.warning("Файл не найден, пропускаем: %s", source_path)
+        return False
+
+    if not dry_run:
+        drawing_store.move_into_store(source_path, destination_path)
+    return True
+
+
+def migrate_drawings(db, batch_size: int, dry_run: bool) -> int:
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(models.Drawing.id, models.Drawing.hash, models.Drawing.file_path)
+            .where(models.Drawing.id > last_id)
+            .order_by(models.Drawing.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            destination = drawing_store.object_path(row.hash)
+            if relocate(resolve_static_path(row.file_path), destination, dry_run):
+                updates.append({"id": row.id, "file_path": destination})
+
+        if updates and not dry_run:
+            # Массовый UPDATE по первичному ключу одним executemany
+            db.execute(update(models.Drawing), updates)
+            db.commit()
+        moved += len(updates)
+        logger.info("Чертежи: обработано до id=%s, перенесено %s", last_id, moved)
+    return moved
+
+
+def migrate_qr_codes(db, batch_size: int, dry_run: bool) -> int:
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(models.ProductionOrder.id, models.ProductionOrder.qr_code_path)
+            .where(models.ProductionOrder.id > last_id, models.ProductionOrder.qr_code_path != None)
+            .order_by(models.ProductionOrder.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            match = _HASH_STEM_RE.match(os.path.basename(row.qr_code_path))
+            if not match:
+                continue
+            destination = drawing_store.object_path(match.group(1), match.group(2) or "")
+            if relocate(resolve_static_path(row.qr_code_path), destination, dry_run):
+                # qr_code_path хранится относительно static/
+                updates.append({"id": row.id, "qr_code_path": os.path.relpath(destination, 'static')})
+
+        if updates and not dry_run:
+            db.execute(update(models.ProductionOrder), updates)
+            db.commit()
+        moved += len(updates)
+        logger.info("QR-коды: обработано до id=%s, перенесено %s", last_id, moved)
+    return moved
+
+
+def remove_empty_date_dirs(dry_run: bool) -> None:
+    """
+    Удаляет опустевшие каталоги старой раскладки ГГГГ/ММ/ДД.
+    """
+    if not os.path.isdir(drawing_store.DRAWINGS_ROOT):
+        return
+    for entry in os.scandir(drawing_store.DRAWINGS_ROOT):
+        if not entry.is_dir() or not _DATE_DIR_RE.match(entry.name):
+            continue
+        # Обход снизу вверх: rmdir сам откажет, если каталог еще не пуст
+        for root, dirs, files in os.walk(entry.path, topdown=False):
+            if files:
+                continue
+            if dry_run:
+                logger.info("Будет удален пустой каталог: %s", root)
+                continue
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос чертежей в хранилище, шардированное по хешу")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Только показать, что будет сделано")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        drawings = migrate_drawings(db, args.batch_size, args.dry_run)
+        qr_codes = migrate_qr_codes(db, args.batch_size, args.dry_run)
+    finally:
+        db.close()
+    remove_empty_date_dirs(args.dry_run)
+    logger.info("Готово: чертежей %s, QR-кодов %s%s", drawings, qr_codes, ' (dry run)' if args.dry_run else '')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, BigInteger, ForeignKey, TIMESTAMP, Date
+from sqlalchemy import Column, Integer, String, BigInteger, ForeignKey, TIMESTAMP, Date, Text, JSON, Index
 from sqlalchemy.types import TypeDecorator
 from app.database import Base
 from datetime import date, datetime
@@ -23,6 +23,86 @@ class Drawing(Base):
     last_used_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
     version = Column(Integer, nullable=False, server_default='1')
     archived_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # Заполняется фоновой задачей после стандартизации; до этого файл — исходная загрузка
+    processed_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # Метаданные изображения, извлекаются при загрузке (см. app/drawing_metadata.py)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    dpi = Column(Integer, nullable=True)
+    color_mode = Column(String(10), nullable=True)
+    page_count = Column(Integer, nullable=True)
+    orientation = Column(String(10), nullable=True)
+
+class ArchivedBlob(Base):
+    """Положение архивного чертежа внутри pack-файла холодного хранилища."""
+    __tablename__ = "archived_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    hash = Column(String(64), unique=True, nullable=False, index=True)
+    pack_name = Column(String(64), nullable=False)
+    offset = Column(BigInteger, nullable=False)
+    length = Column(BigInteger, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+class Job(Base):
+    """Задача фоновой обработки (очередь в БД, см. app/job_queue.py)."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, server_default='queued', index=True)
+    attempts = Column(Integer, nullable=False, server_default='0')
+    max_attempts = Column(Integer, nullable=False, server_default='3')
+    run_after = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+    locked_by = Column(String(100), nullable=True)
+    locked_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True, index=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "payload": self.payload,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "last_error": self.last_error,
+            "result": self.result,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class SchedulerJob(Base):
+    """Последний запуск периодической задачи лидером (см. app/scheduler_leader.py)."""
+    __tablename__ = "scheduler_jobs"
+
+    job_id = Column(String(100), primary_key=True)
+    leader = Column(String(100), nullable=True)
+    status = Column(String(20), nullable=True)
+    last_started_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    last_finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    last_duration_ms = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    # Обновляется, пока задача выполняется: устаревший heartbeat при статусе running — упавший лидер
+    heartbeat_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    next_run_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "leader": self.leader,
+            "status": self.status,
+            "last_started_at": self.last_started_at.isoformat() if self.last_started_at else None,
+            "last_finished_at": self.last_finished_at.isoformat() if self.last_finished_at else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+            "heartbeat_at": self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            "next_run_at": self.next_run_at.isoformat() if self.next_run_at else None,
+        }
 
 class OrderDrawing(Base):
     __tablename__ = "order_drawings"
@@ -43,6 +123,25 @@ class Inventory(Base):
     quantity = Column(Integer)
 
 
+class InventoryPartBalance(Base):
+    """Остаток по детали по всем партиям, обновляется при каждой вставке в inventory."""
+    __tablename__ = "inventory_part_balances"
+
+    part_number = Column(String, primary_key=True)
+    quantity = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+
+class InventoryBatchBalance(Base):
+    """Остаток по детали в партии."""
+    __tablename__ = "inventory_batch_balances"
+
+    part_number = Column(String, primary_key=True)
+    batch_number = Column(String, primary_key=True)
+    quantity = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -102,6 +201,11 @@ class ProductionOrder(Base):
     drawings = relationship("OrderDrawing", back_populates="order")
     qr_code_path = Column(String(255), nullable=True)
 
+    __table_args__ = (
+        # Поиск заказов, окно изготовления которых пересекается с периодом планирования
+        Index("ix_production_orders_date_window", "desired_production_date_start", "desired_production_date_end"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -115,7 +219,9 @@ class ProductionOrder(Base):
             "required_material": self.required_material,
             "metal_delivery_date": self.metal_delivery_date,
             "notes": self.notes,
-            "qr_code_path": self.qr_code_path  # Добавлено в словарь
+            "qr_code_path": self.qr_code_path,  # Добавлено в словарь
+            # Хеши активных чертежей: по ним строятся URL миниатюр
+            "drawing_hashes": [od.drawing.hash for od in self.drawings if od.drawing and not od.drawing.archived_at]
         }
 
 # Добавим обратную связь в модель OrderDrawing
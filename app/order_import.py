@@ -0,0 +1,329 @@
+"""
+Массовый импорт заказ-нарядов из таблицы (CSV или XLSX).
+
+Строки проверяются схемой ProductionOrderCreate, номера заказов выделяются
+пачкой, а вставка идет одной транзакцией (COPY на PostgreSQL, многострочный
+INSERT иначе). QR-коды и привязка чертежей выполняются фоновой задачей
+prepare_imported_order для каждого заказа.
+
+По умолчанию импорт "все или ничего": при ошибке хотя бы в одной строке
+ничего не вставляется и возвращается отчет по строкам. С --skip-invalid
+вставляются только корректные строки.
+
+Заголовки столбцов — как в выгрузке /export/orders или имена полей:
+
+    python -m app.order_import orders.xlsx [--skip-invalid] [--dry-run]
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import re
+import zipfile
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+from xml.etree import ElementTree
+
+from pydantic import ValidationError
+
+from app import job_queue, models, repository, schemas
+from app.database import SessionLocal
+from app.drawing_delivery import is_valid_hash
+
+logger = logging.getLogger(__name__)
+
+MAX_IMPORT_ROWS = int(os.getenv("ORDER_IMPORT_MAX_ROWS", "5000"))
+
+# Поле -> допустимые заголовки (в нижнем регистре)
+FIELD_ALIASES = {
+    "order_number": ("order_number", "номер заказа"),
+    "publication_date": ("publication_date", "дата публикации"),
+    "drawing_designation": ("drawing_designation", "обозначение чертежа"),
+    "quantity": ("quantity", "количество"),
+    "desired_production_date_start": ("desired_production_date_start", "желательная дата изготовления (с)"),
+    "desired_production_date_end": ("desired_production_date_end", "желательная дата изготовления (по)"),
+    "required_material": ("required_material", "необходимый материал"),
+    "metal_delivery_date": ("metal_delivery_date", "срок поставки металла"),
+    "notes": ("notes", "примечания"),
+    "drawing_hashes": ("drawing_hashes", "чертежи"),
+}
+_HEADER_TO_FIELD = {alias: field for field, aliases in FIELD_ALIASES.items() for alias in aliases}
+DATE_FIELDS = ("publication_date", "desired_production_date_start", "desired_production_date_end")
+DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d", "%d.%m.%y")
+# Нулевой день дат Excel (с учетом ошибки 1900 года)
+EXCEL_EPOCH = date(1899, 12, 30)
+
+_XLSX_NS = {"m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+class ImportFormatError(ValueError):
+    """Файл не удалось прочитать как таблицу заказов."""
+
+
+def read_csv_rows(content: bytes) -> List[List]:
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # Excel с русской локалью сохраняет CSV в cp1251
+        text = content.decode("cp1251")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    return [row for row in csv.reader(io.StringIO(text), dialect)]
+
+
+def _column_index(ref: str) -> int:
+    index = 0
+    for char in re.match(r"[A-Z]+", ref).group():
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def read_xlsx_rows(content: bytes) -> List[List]:
+    """
+    Читает первый лист XLSX: общие строки, inlineStr и числа.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(content))
+    except zipfile.BadZipFile:
+        raise ImportFormatError("Файл не является XLSX")
+    with archive:
+        shared = []
+        if "xl/sharedStrings.xml" in archive.namelist():
+            root = ElementTree.fromstring(archive.read("xl/sharedStrings.xml"))
+            for item in root.findall("m:si", _XLSX_NS):
+                shared.append("".join(t.text or "" for t in item.iter(f"{{{_XLSX_NS['m']}}}t")))
+
+        sheets = sorted(n for n in archive.namelist() if re.match(r"xl/worksheets/sheet\d+\.xml$", n))
+        if not sheets:
+            raise ImportFormatError("В XLSX нет листов")
+        root = ElementTree.fromstring(archive.read(sheets[0]))
+
+    rows = []
+    for row in root.iter(f"{{{_XLSX_NS['m']}}}row"):
+        values = {}
+        for cell in row.findall("m:c", _XLSX_NS):
+            cell_type = cell.get("t")
+            if cell_type == "inlineStr":
+                value = "".join(t.text or "" for t in cell.iter(f"{{{_XLSX_NS['m']}}}t"))
+            else:
+                raw = cell.findtext("m:v", default=None, namespaces=_XLSX_NS)
+                if raw is None:
+                    continue
+                if cell_type == "s":
+                    value = shared[int(raw)]
+                elif cell_type in ("str", "e"):
+                    value = raw
+                elif cell_type == "b":
+                    value = raw == "1"
+                else:
+                    value = float(raw)
+                    if value.is_integer():
+                        value = int(value)
+            values[_column_index(cell.get("r"))] = value
+        if values:
+            rows.append([values.get(i) for i in range(max(values) + 1)])
+    return rows
+
+
+def read_table(content: bytes, filename: str) -> List[List]:
+    if filename.lower().endswith(".xlsx"):
+        return read_xlsx_rows(content)
+    return read_csv_rows(content)
+
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    if isinstance(value, (int, float)):
+        return EXCEL_EPOCH + timedelta(days=int(value))
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"некорректная дата: {text}")
+
+
+def _clean(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def iter_records(rows: List[List]) -> Iterator[tuple]:
+    """
+    Сопоставляет столбцы с полями по заголовку. Возвращает (номер строки, dict).
+    """
+    if not rows:
+        raise ImportFormatError("Таблица пуста")
+    header = [str(h).strip().lower() if h is not None else "" for h in rows[0]]
+    columns = {index: _HEADER_TO_FIELD[name] for index, name in enumerate(header) if name in _HEADER_TO_FIELD}
+    missing = {"drawing_designation", "quantity", "desired_production_date_start",
+               "desired_production_date_end", "required_material"} - set(columns.values())
+    if missing:
+        raise ImportFormatError(f"Не найдены столбцы: {', '.join(sorted(missing))}")
+
+    for number, row in enumerate(rows[1:], start=2):
+        record = {field: _clean(row[index]) if index < len(row) else None for index, field in columns.items()}
+        if all(value is None for value in record.values()):
+            continue
+        yield number, record
+
+
+def validate_record(record: dict) -> tuple:
+    """
+    Возвращает (данные для вставки, хеши чертежей, список ошибок).
+    """
+    errors = []
+    values = dict(record)
+    hashes = [h.lower() for h in re.split(r"[\s,;]+", str(values.pop("drawing_hashes", None) or "")) if h]
+    for h in hashes:
+        if not is_valid_hash(h):
+            errors.append(f"drawing_hashes: некорректный хеш {h}")
+
+    for field in DATE_FIELDS:
+        if values.get(field) is not None:
+            try:
+                values[field] = _parse_date(values[field])
+            except ValueError as e:
+                errors.append(f"{field}: {e}")
+                values[field] = None
+    if values.get("publication_date") is None:
+        values["publication_date"] = date.today()
+    if isinstance(values.get("quantity"), float) and values["quantity"].is_integer():
+        values["quantity"] = int(values["quantity"])
+    for field in ("metal_delivery_date", "notes", "order_number"):
+        if values.get(field) is not None:
+            values[field] = str(values[field])
+
+    order_number = values.get("order_number")
+    try:
+        # Номер проверяется отдельно, здесь подставляется заглушка
+        validated = schemas.ProductionOrderCreate(**{**values, "order_number": order_number or ""})
+    except ValidationError as e:
+        for error in e.errors():
+            field = ".".join(str(part) for part in error["loc"])
+            errors.append(f"{field}: {error['msg']}")
+        return None, hashes, errors
+
+    data = validated.dict()
+    data["order_number"] = order_number
+    if data["desired_production_date_end"] < data["desired_production_date_start"]:
+        errors.append("desired_production_date_end: дата окончания раньше даты начала")
+    return data, hashes, errors
+
+
+def import_orders(db, rows: List[List], skip_invalid: bool = False, dry_run: bool = False) -> dict:
+    records = list(iter_records(rows))
+    if len(records) > MAX_IMPORT_ROWS:
+        raise ImportFormatError(f"Слишком много строк: {len(records)} (не более {MAX_IMPORT_ROWS})")
+
+    errors: Dict[int, List[str]] = {}
+    valid = []
+    for number, record in records:
+        data, hashes, row_errors = validate_record(record)
+        if row_errors:
+            errors[number] = row_errors
+        else:
+            valid.append((number, data, hashes))
+
+    # Явно заданные номера: дубликаты в файле и уже занятые в БД — одним запросом
+    explicit = [data["order_number"] for _, data, _ in valid if data["order_number"]]
+    taken = {
+        number for (number,) in db.query(models.ProductionOrder.order_number)
+        .filter(models.ProductionOrder.order_number.in_(explicit))
+    } if explicit else set()
+    seen = set()
+    # Чертежи по хешам тоже проверяются одним запросом
+    all_hashes = {h for _, _, hashes in valid for h in hashes}
+    known_hashes = {
+        h for (h,) in db.query(models.Drawing.hash).filter(models.Drawing.hash.in_(all_hashes))
+    } if all_hashes else set()
+
+    checked = []
+    for number, data, hashes in valid:
+        row_errors = []
+        order_number = data["order_number"]
+        if order_number:
+            if order_number in taken:
+                row_errors.append(f"order_number: номер {order_number} уже существует")
+            elif order_number in seen:
+                row_errors.append(f"order_number: номер {order_number} повторяется в файле")
+            seen.add(order_number)
+        unknown = [h for h in hashes if h not in known_hashes]
+        if unknown:
+            row_errors.append(f"drawing_hashes: чертежи не найдены: {', '.join(unknown)}")
+        if row_errors:
+            errors[number] = row_errors
+        else:
+            checked.append((number, data, hashes))
+
+    report = {
+        "total": len(records),
+        "valid": len(checked),
+        "imported": 0,
+        "dry_run": dry_run,
+        "errors": [{"row": number, "errors": errors[number]} for number in sorted(errors)],
+        "orders": [],
+    }
+    if dry_run or not checked or (errors and not skip_invalid):
+        return report
+
+    try:
+        # Номера для строк без номера — пачкой, с учетом явно заданных в файле
+        missing = [data for _, data, _ in checked if not data["order_number"]]
+        allocated = repository.allocate_order_numbers(db, [data["drawing_designation"] for data in missing])
+        reserved = seen
+        for data, order_number in zip(missing, allocated):
+            while order_number in reserved:
+                order_number = repository.allocate_order_numbers(db, [data["drawing_designation"]])[0]
+            data["order_number"] = order_number
+            reserved.add(order_number)
+
+        ids = repository.bulk_insert_production_orders(db, [data for _, data, _ in checked])
+        job_queue.enqueue_many(db, "prepare_imported_order", [
+            {"order_id": ids[data["order_number"]], "drawing_hashes": hashes}
+            for _, data, hashes in checked
+        ], commit=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    report["imported"] = len(checked)
+    report["orders"] = [
+        {"row": number, "order_id": ids[data["order_number"]], "order_number": data["order_number"]}
+        for number, data, _ in checked
+    ]
+    logger.info("Импортировано заказов: %s из %s, ошибок: %s", report['imported'], report['total'], len(errors))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт заказ-нарядов из CSV/XLSX")
+    parser.add_argument("path", help="Путь к файлу .csv или .xlsx")
+    parser.add_argument("--skip-invalid", action="store_true", help="Импортировать корректные строки, пропуская ошибочные")
+    parser.add_argument("--dry-run", action="store_true", help="Только проверить файл")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.path, "rb") as f:
+        rows = read_table(f.read(), args.path)
+    db = SessionLocal()
+    try:
+        report = import_orders(db, rows, skip_invalid=args.skip_invalid, dry_run=args.dry_run)
+    finally:
+        db.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Локальный кеш страниц портала для условных GET.
+
+Для каждого URL хранятся ETag, Last-Modified, хеш тела и уже разобранный
+результат. Повторный обход отправляет If-None-Match/If-Modified-Since:
+на 304 используется сохраненный результат, на 200 с тем же телом (портал
+не всегда отдает валидаторы) — тоже, и только измененные страницы
+разбираются заново.
+
+Кеш — файл SQLite (INTRANET_CACHE_PATH), вне static/, чтобы не раздаваться
+веб-сервером.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+DEFAULT_CACHE_PATH = os.getenv("INTRANET_CACHE_PATH", os.path.join("cache", "intranet_pages.sqlite3"))
+
+
+class CacheEntry(NamedTuple):
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_hash: Optional[str]
+    parsed: Any
+    fetched_at: float
+    checked_at: float
+
+
+class PageCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, parser_version: str = "1"):
+        """
+        parser_version входит в ключ: при изменении разбора старые результаты
+        не используются.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.parser_version = parser_version
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT NOT NULL,"
+            " parser_version TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " body_hash TEXT,"
+            " parsed TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " checked_at REAL NOT NULL,"
+            " PRIMARY KEY (url, parser_version))"
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, etag, last_modified, body_hash, parsed, fetched_at, checked_at"
+                " FROM pages WHERE url = ? AND parser_version = ?",
+                (url, self.parser_version),
+            ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5], row[6])
+
+    def store(self, url: str, etag: Optional[str], last_modified: Optional[str], body_hash: str, parsed: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pages (url, parser_version, etag, last_modified, body_hash, parsed, fetched_at, checked_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (url, parser_version) DO UPDATE SET"
+                " etag = excluded.etag, last_modified = excluded.last_modified, body_hash = excluded.body_hash,"
+                " parsed = excluded.parsed, fetched_at = excluded.fetched_at, checked_at = excluded.checked_at",
+                (url, self.parser_version, etag, last_modified, body_hash,
+                 json.dumps(parsed, ensure_ascii=False), now, now),
+            )
+
+    def touch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """
+        Страница не изменилась: обновляем время проверки (и валидаторы, если
+        сервер прислал новые).
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET checked_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)"
+                " WHERE url = ? AND parser_version = ?",
+                (time.time(), etag, last_modified, url, self.parser_version),
+            )
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CacheEntry]) -> dict:
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
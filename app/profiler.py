@@ -0,0 +1,261 @@
+"""
+Профилирование отдельного запроса по требованию.
+
+Если запрос пришел с заголовком X-Profile или параметром __profile, равным
+PROFILER_TOKEN, на время его обработки запускается выборочный профайлер:
+отдельный поток каждые PROFILER_INTERVAL_MS миллисекунд снимает стеки потока
+цикла событий и занятых потоков asyncio.to_thread (декодирование и отрисовка
+чертежей). Результат сохраняется в формате speedscope
+(https://www.speedscope.app) в PROFILER_DIR, имя файла возвращается в
+заголовке ответа X-Profile-Id. Каталог ограничен PROFILER_MAX_MB: старые
+профили удаляются.
+
+Цикл событий общий для всех запросов, поэтому в профиль попадают и стеки
+параллельных запросов; одновременно профилируется не больше одного запроса
+на процесс. Без PROFILER_TOKEN профилирование выключено.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000
+PROFILER_MAX_BYTES = int(os.getenv("PROFILER_MAX_MB", "200")) * 1024 * 1024
+# Потоковая выгрузка может идти минутами — дальше сэмплы не копим
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "120"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY = "__profile"
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.speedscope\.json$")
+
+EXECUTOR_THREAD_PREFIX = "asyncio_"
+MAX_STACK_DEPTH = 200
+
+
+def enabled() -> bool:
+    return bool(PROFILER_TOKEN)
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return enabled() and token is not None and hmac.compare_digest(token, PROFILER_TOKEN)
+
+
+class SamplingProfiler:
+    """
+    Снимает стеки потоков через sys._current_frames(). Накладные расходы
+    зависят только от интервала и глубины стеков, а не от числа вызовов.
+    """
+
+    def __init__(self, loop_thread_id: int, interval: float = PROFILER_INTERVAL):
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.frames: List[dict] = []
+        self._frame_index: Dict[Tuple[str, str, int], int] = {}
+        # Имя потока -> (стеки, веса)
+        self.samples: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _frame_id(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    @staticmethod
+    def _is_busy_executor(frame) -> bool:
+        # Свободный поток пула ждет в очереди; занятый выполняет _WorkItem.run
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name == "run" and code.co_filename.endswith(os.path.join("concurrent", "futures", "thread.py")):
+                return True
+            frame = frame.f_back
+        return False
+
+    def _stack(self, frame) -> List[int]:
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(self._frame_id(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            if now - self.started_at > PROFILER_MAX_SECONDS:
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                name = names.get(thread_id, str(thread_id))
+                if thread_id == self.loop_thread_id:
+                    name = "event-loop"
+                elif not (name.startswith(EXECUTOR_THREAD_PREFIX) and self._is_busy_executor(frame)):
+                    continue
+                stacks, weights = self.samples.setdefault(name, ([], []))
+                stacks.append(self._stack(frame))
+                weights.append(weight)
+
+    def to_speedscope(self, name: str) -> dict:
+        profiles = []
+        for thread_name, (stacks, weights) in sorted(self.samples.items()):
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": stacks,
+                "weights": [round(w, 6) for w in weights],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "cnc-app request profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": self.frames},
+            "profiles": profiles,
+        }
+
+
+def profile_filename(method: str, path: str) -> str:
+    slug = re.sub(r"[^\w-]+", "_", path.strip("/"))[:60] or "root"
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{method}_{slug}.speedscope.json"
+
+
+def enforce_size_cap(directory: str = PROFILER_DIR, max_bytes: int = PROFILER_MAX_BYTES) -> None:
+    """
+    Удаляет самые старые профили, пока каталог не станет меньше лимита.
+    """
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and PROFILE_NAME_RE.match(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError as e:
+            logger.warning("Не удалось удалить профиль %s: %s", path, e)
+
+
+def save_profile(profiler: SamplingProfiler, filename: str, title: str) -> str:
+    os.makedirs(PROFILER_DIR, exist_ok=True)
+    path = os.path.join(PROFILER_DIR, filename)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiler.to_speedscope(title), f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    enforce_size_cap()
+    return path
+
+
+def list_profiles() -> List[dict]:
+    if not os.path.isdir(PROFILER_DIR):
+        return []
+    profiles = []
+    with os.scandir(PROFILER_DIR) as it:
+        for entry in it:
+            if entry.is_file() and PROFILE_NAME_RE.match(entry.name):
+                stat = entry.stat()
+                profiles.append({
+                    "name": entry.name,
+                    "size": stat.st_size,
+                    "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+                })
+    return sorted(profiles, key=lambda p: p["name"], reverse=True)
+
+
+def profile_path(name: str) -> Optional[str]:
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(PROFILER_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def request_token(scope) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == PROFILE_HEADER:
+            return value.decode("latin-1")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    values = query.get(PROFILE_QUERY)
+    return values[0] if values else None
+
+
+class ProfilerMiddleware:
+    """
+    ASGI-middleware: профилирует запрос до полной отправки ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled() or not is_authorized(request_token(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._busy.acquire(blocking=False):
+            logger.info("Профайлер занят, запрос %s %s выполняется без профилирования", scope['method'], scope['path'])
+            await self.app(scope, receive, send)
+            return
+
+        filename = profile_filename(scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", filename.encode())]
+            await send(message)
+
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            self._busy.release()
+            title = f"{scope['method']} {scope['path']} ({profiler.duration * 1000:.0f} мс)"
+            try:
+                path = await asyncio.to_thread(save_profile, profiler, filename, title)
+                logger.info("Профиль запроса сохранен: %s", path)
+            except OSError as e:
+                logger.error("Не удалось сохранить профиль запроса: %s", e)
@@ -0,0 +1,63 @@
+"""
+QR-коды заказов.
+
+Используются и веб-приложением, и фоновыми задачами (импорт заказов),
+поэтому не зависят от FastAPI.
+"""
+import hashlib
+import io
+import os
+from pathlib import Path
+
+import qrcode
+from PIL import ImageDraw, ImageFont
+
+from app.utils import drawing_store
+
+BASE_DIR = Path(__file__).resolve().parent
+FONT_PATH = BASE_DIR / "static" / "fonts" / "CommitMonoNerdFont-Bold.otf"
+VIEW_DRAWING_URL = "https://192.168.0.96:8343/view_drawing/{order_id}"
+
+
+def generate_qr_code_with_text(data, text):
+    qr = qrcode.QRCode(version=1, box_size=10, border=3, error_correction=qrcode.constants.ERROR_CORRECT_H)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.truetype(str(FONT_PATH), 100)  # Выберите шрифт и размер
+    text_width, text_height = draw.textbbox((0, 0), text, font=font)[2:]  # Используем textbbox
+    text_x = (img.width - text_width) // 2
+    text_y = (img.height - text_height) // 2 - 10  # Сдвигаем текст вверх
+    draw.text((text_x + 1, text_y + 1), text, font=font, fill="black")  # Черная тень
+    draw.text((text_x, text_y), text, font=font, fill="white")  # Белый текст
+
+    return img
+
+
+def order_qr_path(order_id: int) -> str:
+    """
+    Путь к QR-коду заказа в хранилище (хеш от имени файла).
+    """
+    qr_filename = f"qr_code_order_{order_id}.png"
+    return drawing_store.object_path(hashlib.sha256(qr_filename.encode()).hexdigest(), ".png")
+
+
+def render_order_qr(order_id: int, order_number: str) -> bytes:
+    """
+    QR-код со ссылкой на просмотр чертежей заказа, PNG.
+    """
+    qr_image = generate_qr_code_with_text(VIEW_DRAWING_URL.format(order_id=order_id), order_number)
+    buffer = io.BytesIO()
+    qr_image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def save_order_qr(order_id: int, order_number: str) -> str:
+    """
+    Создает QR-код заказа и возвращает путь относительно static/.
+    """
+    qr_path = order_qr_path(order_id)
+    drawing_store.write_atomic(qr_path, render_order_qr(order_id, order_number))
+    return os.path.relpath(qr_path, 'static')
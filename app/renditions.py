@@ -0,0 +1,65 @@
+"""
+Уменьшенные копии чертежей для списков и предпросмотра.
+
+Для каждого хеша один раз создаются миниатюра и превью в формате WebP,
+они хранятся рядом с оригиналом: static/drawings/ab/cd/<хеш>.thumb.webp.
+Сборщик мусора считает их частью исходного объекта.
+"""
+import io
+import os
+
+from PIL import Image
+
+from app import image_processing  # noqa: F401  (настройки PIL для больших файлов)
+from app.drawing_delivery import DRAWING_FILES_PREFIX
+from app.utils import drawing_store
+
+# Имя варианта -> максимальный размер (ширина, высота)
+RENDITIONS = {
+    "preview": (1280, 1280),
+    "thumb": (320, 320),
+}
+RENDITION_FORMAT = "WEBP"
+RENDITION_MEDIA_TYPE = "image/webp"
+RENDITION_QUALITY = 80
+
+
+def rendition_path(file_hash: str, name: str) -> str:
+    return drawing_store.object_path(file_hash, f".{name}.webp")
+
+
+def rendition_url(file_hash: str, name: str = "thumb") -> str:
+    return f"{DRAWING_FILES_PREFIX}/{file_hash}/{name}"
+
+
+def render_renditions(source) -> dict:
+    """
+    Декодирует оригинал один раз и уменьшает его последовательно от большего
+    варианта к меньшему. Возвращает {имя: bytes}.
+    """
+    largest = max(RENDITIONS.values())
+    with Image.open(source) as img:
+        # Для JPEG draft() позволяет декодировать сразу в уменьшенном масштабе
+        img.draft("RGB", largest)
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        current = img.convert("RGBA" if has_alpha else "RGB")
+
+    result = {}
+    for name, size in sorted(RENDITIONS.items(), key=lambda item: item[1], reverse=True):
+        current.thumbnail(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        current.save(buffer, format=RENDITION_FORMAT, quality=RENDITION_QUALITY, method=4)
+        result[name] = buffer.getvalue()
+    return result
+
+
+def generate_renditions(source, file_hash: str, force: bool = False) -> dict:
+    """
+    Создает недостающие варианты чертежа. Возвращает {имя: путь}.
+    """
+    paths = {name: rendition_path(file_hash, name) for name in RENDITIONS}
+    if not force and all(os.path.exists(path) for path in paths.values()):
+        return paths
+    for name, content in render_renditions(source).items():
+        drawing_store.write_atomic(paths[name], content)
+    return paths
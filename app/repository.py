@@ -1,3 +1,10 @@
+import csv
+import io
+import re
+from collections import defaultdict
+from sqlalchemy import insert as sa_insert
+from sqlalchemy.sql import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app import models, schemas
 import random
@@ -29,10 +36,72 @@ def create_order(db: Session, order_number: str, customer_name: str, product_nam
 def create_inventory(db: Session, batch_number: str, part_number: str, quantity: int):
     db_inventory = models.Inventory(batch_number=batch_number, part_number=part_number, quantity=quantity)
     db.add(db_inventory)
+    apply_inventory_deltas(db, [{"batch_number": batch_number, "part_number": part_number, "quantity": quantity}])
     db.commit()
     db.refresh(db_inventory)
     return db_inventory
 
+def create_inventory_batch(db: Session, rows: List[dict]) -> List[int]:
+    """
+    Вставляет строки склада одним многострочным INSERT и одним commit.
+    Возвращает id в порядке rows.
+    """
+    if not rows:
+        return []
+    ids = db.scalars(
+        sa_insert(models.Inventory).returning(models.Inventory.id, sort_by_parameter_order=True),
+        rows,
+    ).all()
+    apply_inventory_deltas(db, rows)
+    db.commit()
+    return ids
+
+def _upsert_balances(db: Session, model, key_columns: List[str], deltas: dict) -> None:
+    if not deltas:
+        return
+    # Ключи в одном порядке во всех транзакциях, чтобы не ловить взаимоблокировки
+    values = [dict(zip(key_columns, key), quantity=delta) for key, delta in sorted(deltas.items())]
+    insert = dialect_insert(db)
+    if insert is not None:
+        stmt = insert(model).values(values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={"quantity": model.quantity + stmt.excluded.quantity, "updated_at": func.now()},
+        ))
+        return
+    for value in values:
+        balance = db.get(model, tuple(value[c] for c in key_columns), with_for_update=True)
+        if balance is None:
+            db.add(model(**value))
+        else:
+            balance.quantity += value["quantity"]
+            balance.updated_at = func.now()
+    db.flush()
+
+def apply_inventory_deltas(db: Session, rows: List[dict]) -> None:
+    """
+    Прибавляет количества к остаткам по детали и по партии в текущей
+    транзакции (без commit), чтобы запрос остатка не суммировал всю историю.
+    """
+    part_deltas = defaultdict(int)
+    batch_deltas = defaultdict(int)
+    for row in rows:
+        part_number = row.get("part_number") or ""
+        batch_number = row.get("batch_number") or ""
+        quantity = row.get("quantity") or 0
+        part_deltas[(part_number,)] += quantity
+        batch_deltas[(part_number, batch_number)] += quantity
+    _upsert_balances(db, models.InventoryPartBalance, ["part_number"], part_deltas)
+    _upsert_balances(db, models.InventoryBatchBalance, ["part_number", "batch_number"], batch_deltas)
+
+def get_part_balance(db: Session, part_number: str):
+    return db.get(models.InventoryPartBalance, part_number)
+
+def get_batch_balances(db: Session, part_number: str) -> List[models.InventoryBatchBalance]:
+    return db.query(models.InventoryBatchBalance).filter(
+        models.InventoryBatchBalance.part_number == part_number
+    ).order_by(models.InventoryBatchBalance.batch_number).all()
+
 def get_inventory(db: Session, skip: int = 0, limit: int = 20):
     return db.query(models.Inventory).offset(skip).limit(limit).all()
 
@@ -84,20 +153,45 @@ def create_order_drawing(db: Session, order_id: int, drawing_id: int):
 def get_order_drawings(db: Session, order_id: int):
     return db.query(models.OrderDrawing).filter(models.OrderDrawing.order_id == order_id).all()
 
-def get_or_create_drawing(db: Session, file_hash: str, file_path: str, file_name: str, file_size: int, mime_type: str):
+def dialect_insert(db: Session):
+    """
+    INSERT с поддержкой ON CONFLICT для текущего диалекта или None, если его нет.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+def get_or_create_drawing(db: Session, file_hash: str, file_path: str, file_name: str, file_size: int, mime_type: str, **metadata):
     drawing = db.query(models.Drawing).filter(models.Drawing.hash == file_hash).first()
-    if not drawing:
-        drawing = models.Drawing(
-            hash=file_hash,
-            file_path=file_path,
-            file_name=file_name,
-            file_size=file_size,
-            mime_type=mime_type
-        )
-        db.add(drawing)
+    if drawing:
+        return drawing
+
+    values = dict(
+        hash=file_hash,
+        file_path=file_path,
+        file_name=file_name,
+        file_size=file_size,
+        mime_type=mime_type,
+        **metadata
+    )
+    insert = dialect_insert(db)
+    if insert is not None:
+        # Параллельная загрузка того же файла другим процессом не приводит к ошибке
+        # уникальности: проигравший INSERT ничего не делает, и мы читаем строку победителя
+        db.execute(insert(models.Drawing).values(**values).on_conflict_do_nothing(index_elements=["hash"]))
         db.commit()
-        db.refresh(drawing)
-    return drawing
+    else:
+        try:
+            db.add(models.Drawing(**values))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+    return db.query(models.Drawing).filter(models.Drawing.hash == file_hash).one()
 
 def get_drawings_by_order(db: Session, order_id: int) -> List[models.Drawing]:
     return db.query(models.Drawing).join(models.OrderDrawing).filter(models.OrderDrawing.order_id == order_id).all()
@@ -105,3 +199,80 @@ def get_drawings_by_order(db: Session, order_id: int) -> List[models.Drawing]:
 def delete_order_drawings(db: Session, order_id: int) -> None:
     db.query(models.OrderDrawing).filter(models.OrderDrawing.order_id == order_id).delete()
     db.commit()
+
+def order_number_prefix(drawing_designation: str) -> str:
+    # Первые две цифры обозначения чертежа, иначе '00'
+    match = re.search(r'\d{2}', drawing_designation or '')
+    return match.group() if match else '00'
+
+def allocate_order_numbers(db: Session, drawing_designations: List[str]) -> List[str]:
+    """
+    Номера заказов (префикс + 4 символа) для списка обозначений. Кандидаты
+    проверяются на занятость одним запросом на раунд, а не по одному.
+    """
+    chars = string.ascii_uppercase + string.digits
+    result: List[str] = [None] * len(drawing_designations)
+    pending = list(range(len(drawing_designations)))
+    taken = set()
+    while pending:
+        candidates = {}
+        for index in pending:
+            number = order_number_prefix(drawing_designations[index]) + ''.join(random.choices(chars, k=4))
+            if number not in taken and number not in candidates:
+                candidates[number] = index
+        existing = {
+            number for (number,) in db.query(models.ProductionOrder.order_number)
+            .filter(models.ProductionOrder.order_number.in_(list(candidates)))
+        }
+        for number, index in candidates.items():
+            if number not in existing:
+                result[index] = number
+                taken.add(number)
+        taken |= existing
+        pending = [index for index in pending if result[index] is None]
+    return result
+
+PRODUCTION_ORDER_COPY_COLUMNS = [
+    "order_number", "publication_date", "drawing_designation", "quantity",
+    "desired_production_date_start", "desired_production_date_end",
+    "required_material", "metal_delivery_date", "notes",
+]
+
+def bulk_insert_production_orders(db: Session, rows: List[dict]) -> dict:
+    """
+    Вставляет заказы без commit (в транзакции вызывающего). На PostgreSQL с
+    psycopg2 — через COPY, иначе одним многострочным INSERT.
+    Возвращает {order_number: id}.
+    """
+    if not rows:
+        return {}
+    bind = db.get_bind()
+    if bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                "" if row.get(column) is None else (
+                    row[column].isoformat() if hasattr(row[column], "isoformat") else row[column]
+                )
+                for column in PRODUCTION_ORDER_COPY_COLUMNS
+            ])
+        buffer.seek(0)
+        columns = ", ".join(PRODUCTION_ORDER_COPY_COLUMNS)
+        # Соединение сессии: COPY идет в той же транзакции, что и остальные запросы
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY production_orders ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+    else:
+        db.execute(sa_insert(models.ProductionOrder), [
+            {column: row.get(column) for column in PRODUCTION_ORDER_COPY_COLUMNS} for row in rows
+        ])
+
+    numbers = [row["order_number"] for row in rows]
+    return dict(
+        db.query(models.ProductionOrder.order_number, models.ProductionOrder.id)
+        .filter(models.ProductionOrder.order_number.in_(numbers))
+        .all()
+    )
@@ -0,0 +1,246 @@
+"""
+Возобновляемая загрузка больших чертежей по частям.
+
+Протокол (по мотивам tus):
+    POST  /uploads               — создать сессию: имя файла, длина и SHA-256 всего файла
+    HEAD  /uploads/{id}          — текущее смещение в заголовке Upload-Offset
+    PATCH /uploads/{id}          — часть файла с заголовками Upload-Offset и
+                                   Upload-Checksum: sha256 <base64>
+
+Сессия — каталог в RESUMABLE_UPLOADS_PATH (meta.json + data.part). Каталог
+лежит вне static/, чтобы недогруженные файлы не раздавались в обход
+проверки хеша, и не участвует в очистке temp с ее квотой: незавершенную
+загрузку можно продолжить, пока она не старше RESUMABLE_TTL_HOURS, брошенные
+сессии удаляет reap_sessions. Часть применяется, только если совпали
+смещение и контрольная сумма; после последней части хеш всего файла
+сверяется с заявленным, и файл переносится в хранилище чертежей.
+
+Функции синхронные: обработчики вызывают их через asyncio.to_thread.
+"""
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from app import metrics
+from app.utils import drawing_store
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.getenv("RESUMABLE_UPLOADS_PATH", os.path.join("uploads", "resumable"))
+SESSION_TTL_SECONDS = float(os.getenv("RESUMABLE_TTL_HOURS", "24")) * 3600
+MAX_UPLOAD_BYTES = int(float(os.getenv("RESUMABLE_MAX_MB", "1024")) * 1024 * 1024)
+MAX_CHUNK_BYTES = int(float(os.getenv("RESUMABLE_CHUNK_MB", "8")) * 1024 * 1024)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Код ответа tus для несовпадения контрольной суммы части
+CHECKSUM_MISMATCH = 460
+
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str, offset: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.offset = offset
+
+
+def session_dir(upload_id: str) -> str:
+    if not _UPLOAD_ID_RE.match(upload_id):
+        raise UploadError(404, "Сессия загрузки не найдена")
+    return os.path.join(UPLOADS_DIR, upload_id)
+
+
+def _meta_path(upload_id: str) -> str:
+    return os.path.join(session_dir(upload_id), "meta.json")
+
+
+def _data_path(upload_id: str) -> str:
+    return os.path.join(session_dir(upload_id), "data.part")
+
+
+def _save_meta(meta: dict) -> None:
+    drawing_store.write_atomic(_meta_path(meta["upload_id"]), json.dumps(meta).encode())
+
+
+def create_session(file_name: str, length: int, sha256: str, order_id: Optional[int] = None) -> dict:
+    sha256 = sha256.lower()
+    if not _SHA256_RE.match(sha256):
+        raise UploadError(400, "Некорректный SHA-256 файла")
+    if length <= 0 or length > MAX_UPLOAD_BYTES:
+        raise UploadError(413, f"Размер файла должен быть от 1 до {MAX_UPLOAD_BYTES} байт")
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(session_dir(upload_id), exist_ok=True)
+    open(_data_path(upload_id), "wb").close()
+    meta = {
+        "upload_id": upload_id,
+        "file_name": os.path.basename(file_name),
+        "length": length,
+        "sha256": sha256,
+        "order_id": order_id,
+        "offset": 0,
+    }
+    _save_meta(meta)
+    return meta
+
+
+def load_session(upload_id: str) -> dict:
+    try:
+        with open(_meta_path(upload_id), "rb") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        raise UploadError(404, "Сессия загрузки не найдена или устарела")
+    if not os.path.exists(_data_path(upload_id)):
+        # Сессия удалена как брошенная
+        raise UploadError(404, "Сессия загрузки не найдена или устарела")
+    return meta
+
+
+@contextmanager
+def session_lock(upload_id: str) -> Iterator[None]:
+    """
+    Одна часть за раз: параллельный PATCH той же сессии получает 409.
+    """
+    try:
+        lock_file = open(os.path.join(session_dir(upload_id), ".lock"), "a+b")
+    except FileNotFoundError:
+        raise UploadError(404, "Сессия загрузки не найдена или устарела")
+    try:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError(409, "Сессия загрузки занята другим запросом")
+        yield
+    finally:
+        lock_file.close()
+
+
+def parse_checksum(header: Optional[str]) -> bytes:
+    """
+    Разбирает "sha256 <base64>" и возвращает ожидаемый дайджест.
+    """
+    if not header:
+        raise UploadError(400, "Не указан заголовок Upload-Checksum")
+    algorithm, _, encoded = header.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise UploadError(400, "Поддерживается только контрольная сумма sha256")
+    try:
+        return base64.b64decode(encoded.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise UploadError(400, "Некорректное значение Upload-Checksum")
+
+
+def append_chunk(upload_id: str, offset: int, data: bytes, checksum: bytes) -> dict:
+    """
+    Записывает часть по смещению offset. Смещение сессии сдвигается только
+    после проверки контрольной суммы и fsync, так что обрыв посреди части
+    не портит уже принятые данные.
+    """
+    with session_lock(upload_id):
+        meta = load_session(upload_id)
+        if offset != meta["offset"]:
+            raise UploadError(409, "Смещение не совпадает с текущим", offset=meta["offset"])
+        if offset + len(data) > meta["length"]:
+            raise UploadError(413, "Часть выходит за объявленный размер файла", offset=meta["offset"])
+        if hashlib.sha256(data).digest() != checksum:
+            raise UploadError(CHECKSUM_MISMATCH, "Контрольная сумма части не совпадает", offset=meta["offset"])
+
+        with open(_data_path(upload_id), "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+            # Отбрасываем хвост от прерванной ранее записи
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+        meta["offset"] = offset + len(data)
+        _save_meta(meta)
+        return meta
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with metrics.stage("hash"), open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def assemble(upload_id: str) -> Tuple[dict, str]:
+    """
+    Проверяет хеш собранного файла и переносит его в хранилище.
+    Возвращает (meta, путь в хранилище); сессия удаляется.
+    """
+    with session_lock(upload_id):
+        meta = load_session(upload_id)
+        if meta["offset"] != meta["length"]:
+            raise UploadError(409, "Загрузка еще не завершена", offset=meta["offset"])
+
+        data_path = _data_path(upload_id)
+        actual = _file_sha256(data_path)
+        if actual != meta["sha256"]:
+            remove_session(upload_id)
+            raise UploadError(422, "SHA-256 собранного файла не совпадает с заявленным")
+
+        destination = drawing_store.object_path(actual)
+        if not os.path.exists(destination):
+            drawing_store.move_into_store(data_path, destination)
+        # Если объект уже есть, его не перезаписываем: он мог быть стандартизирован
+    remove_session(upload_id)
+    return meta, destination
+
+
+def remove_session(upload_id: str) -> None:
+    shutil.rmtree(session_dir(upload_id), ignore_errors=True)
+
+
+def _last_activity(directory: str) -> float:
+    mtimes = []
+    for name in ("meta.json", "data.part"):
+        try:
+            mtimes.append(os.stat(os.path.join(directory, name)).st_mtime)
+        except FileNotFoundError:
+            continue
+    return max(mtimes) if mtimes else os.stat(directory).st_mtime
+
+
+def reap_sessions(root: str = UPLOADS_DIR, ttl_seconds: float = SESSION_TTL_SECONDS) -> int:
+    """
+    Удаляет сессии без активности дольше ttl_seconds. Сессию, занятую
+    запросом (взята .lock), не трогает. Блокирующая: вызывать через
+    asyncio.to_thread.
+    """
+    if not os.path.isdir(root):
+        return 0
+    now = time.time()
+    removed = 0
+    with os.scandir(root) as it:
+        entries = [entry for entry in it if entry.is_dir(follow_symlinks=False) and _UPLOAD_ID_RE.match(entry.name)]
+    for entry in entries:
+        try:
+            if _last_activity(entry.path) >= now - ttl_seconds:
+                continue
+            with session_lock(entry.name):
+                remove_session(entry.name)
+            removed += 1
+        except UploadError:
+            # Занята запросом или уже удалена
+            continue
+        except OSError as e:
+            logger.error("Не удалось удалить сессию загрузки %s: %s", entry.name, e)
+    if removed:
+        logger.info("Удалено брошенных сессий загрузки: %s", removed)
+    return removed
@@ -0,0 +1,308 @@
+"""
+Периодические задачи выполняет только один процесс — лидер.
+
+Каждый воркер uvicorn импортирует app.main и создает свой планировщик;
+без координации ночная очистка запускалась бы в N процессах одновременно.
+Теперь планировщик стартует на паузе, а задача выбора лидера раз в
+SCHEDULER_LEADER_CHECK_INTERVAL секунд пытается взять блокировку:
+
+  * PostgreSQL — pg_try_advisory_lock на отдельном соединении. Блокировка
+    сессионная: если процесс упал или соединение оборвалось, PostgreSQL
+    снимает ее сам, и лидером становится другой процесс;
+  * SQLite (локальный запуск) — flock на файле во временном каталоге,
+    что работает между процессами одной машины.
+
+Лидер снимает планировщик с паузы, потерявший блокировку снова ставит его
+на паузу. Перед каждым запуском задача еще раз проверяет блокировку, а ход
+выполнения записывается в scheduler_jobs: кто и когда запускал, статус,
+длительность, ошибка, heartbeat во время работы и время следующего запуска.
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import text
+
+from app import models
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_LOCK_NAME = os.getenv("SCHEDULER_LOCK_NAME", "cnc-scheduler")
+LEADER_CHECK_INTERVAL = float(os.getenv("SCHEDULER_LEADER_CHECK_INTERVAL", "15"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("SCHEDULER_JOB_HEARTBEAT_INTERVAL", "30"))
+SCHEDULER_LOCK_FILE = os.getenv(
+    "SCHEDULER_LOCK_FILE", os.path.join(tempfile.gettempdir(), f"{SCHEDULER_LOCK_NAME}.lock")
+)
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def lock_key(name: str) -> int:
+    # pg_advisory_lock принимает bigint
+    return int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], "big", signed=True)
+
+
+class AdvisoryLock:
+    def __init__(self, engine, key: int):
+        self.engine = engine
+        self.key = key
+        self._conn = None
+
+    def try_acquire(self) -> bool:
+        conn = self.engine.connect()
+        try:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            conn.commit()
+        except Exception:
+            conn.invalidate()
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        # Соединение с блокировкой не возвращается в пул, пока лидерство не снято
+        self._conn = conn
+        return True
+
+    def is_held(self) -> bool:
+        if self._conn is None:
+            return False
+        try:
+            self._conn.execute(text("SELECT 1")).scalar()
+            self._conn.commit()
+            return True
+        except Exception as e:
+            logger.warning("Соединение с блокировкой планировщика потеряно: %s", e)
+            self._conn.invalidate()
+            self._conn.close()
+            self._conn = None
+            return False
+
+    def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self._conn.commit()
+        finally:
+            self._conn.close()
+            self._conn = None
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def is_held(self) -> bool:
+        return self._fd is not None
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+def record_start(job_id: str, leader: str) -> None:
+    db = SessionLocal()
+    try:
+        row = db.get(models.SchedulerJob, job_id)
+        if row is None:
+            row = models.SchedulerJob(job_id=job_id)
+            db.add(row)
+        now = _now()
+        row.leader = leader
+        row.status = RUNNING
+        row.last_started_at = now
+        row.heartbeat_at = now
+        db.commit()
+    finally:
+        db.close()
+
+
+def record_heartbeat(job_id: str) -> None:
+    db = SessionLocal()
+    try:
+        row = db.get(models.SchedulerJob, job_id)
+        if row is not None:
+            row.heartbeat_at = _now()
+            db.commit()
+    finally:
+        db.close()
+
+
+def record_finish(job_id: str, status: str, duration_ms: int, error: Optional[str], next_run_at) -> None:
+    db = SessionLocal()
+    try:
+        row = db.get(models.SchedulerJob, job_id)
+        if row is None:
+            row = models.SchedulerJob(job_id=job_id)
+            db.add(row)
+        row.status = status
+        row.last_finished_at = _now()
+        row.heartbeat_at = row.last_finished_at
+        row.last_duration_ms = duration_ms
+        row.last_error = error
+        row.next_run_at = next_run_at
+        db.commit()
+    finally:
+        db.close()
+
+
+def list_jobs() -> List[dict]:
+    db = SessionLocal()
+    try:
+        return [row.to_dict() for row in db.query(models.SchedulerJob).order_by(models.SchedulerJob.job_id)]
+    finally:
+        db.close()
+
+
+class SchedulerCoordinator:
+    def __init__(self, scheduler, engine, name: str = SCHEDULER_LOCK_NAME):
+        self.scheduler = scheduler
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}"
+        if engine.dialect.name == "postgresql":
+            self.lock = AdvisoryLock(engine, lock_key(name))
+        else:
+            self.lock = FileLock(SCHEDULER_LOCK_FILE)
+        self.is_leader = False
+        # Проверки идут из разных потоков, а соединение с блокировкой одно
+        self._lock_guard = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def check(self) -> bool:
+        """
+        Подтверждает лидерство или пытается его получить. Синхронная:
+        вызывается через asyncio.to_thread.
+        """
+        with self._lock_guard:
+            if self.is_leader and not self.lock.is_held():
+                logger.warning("Процесс %s потерял лидерство планировщика", self.holder_id)
+                self.is_leader = False
+            if not self.is_leader:
+                try:
+                    self.is_leader = self.lock.try_acquire()
+                except Exception as e:
+                    logger.error("Не удалось проверить блокировку планировщика: %s", e)
+                    self.is_leader = False
+                if self.is_leader:
+                    logger.info("Процесс %s стал лидером планировщика", self.holder_id)
+            return self.is_leader
+
+    async def _apply(self) -> None:
+        leader = await asyncio.to_thread(self.check)
+        # pause/resume идемпотентны, состояние планировщика следует за блокировкой
+        if leader:
+            self.scheduler.resume()
+        else:
+            self.scheduler.pause()
+
+    async def _election_loop(self) -> None:
+        while True:
+            try:
+                await self._apply()
+            except Exception as e:
+                logger.error("Ошибка выбора лидера планировщика: %s", e)
+            await asyncio.sleep(LEADER_CHECK_INTERVAL)
+
+    def start(self) -> None:
+        """
+        Запускает планировщик на паузе и цикл выбора лидера. Вызывается из
+        startup, когда цикл событий уже работает.
+        """
+        self.scheduler.start(paused=True)
+        self._task = asyncio.create_task(self._election_loop())
+
+    def release(self) -> None:
+        with self._lock_guard:
+            if self.is_leader:
+                self.lock.release()
+                self.is_leader = False
+                logger.info("Процесс %s снял лидерство планировщика", self.holder_id)
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        await asyncio.to_thread(self.release)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                await asyncio.to_thread(record_heartbeat, job_id)
+            except Exception as e:
+                logger.warning("Не удалось обновить heartbeat задачи %s: %s", job_id, e)
+
+    def job(self, job_id: str):
+        """
+        Оборачивает периодическую задачу: запуск только у подтвержденного
+        лидера и учет в scheduler_jobs. Ошибки задачи записываются в
+        last_error и не прерывают планировщик.
+        """
+        def decorator(func: Callable[[], Awaitable[None]]):
+            @wraps(func)
+            async def wrapper():
+                # Блокировка могла смениться после последней проверки
+                if not await asyncio.to_thread(self.check):
+                    logger.info("Задача %s пропущена: процесс %s не лидер", job_id, self.holder_id)
+                    return
+                await asyncio.to_thread(record_start, job_id, self.holder_id)
+                heartbeat = asyncio.create_task(self._heartbeat(job_id))
+                started = time.monotonic()
+                status, error = DONE, None
+                try:
+                    await func()
+                except Exception as e:
+                    status, error = FAILED, traceback.format_exc()
+                    logger.error("Ошибка периодической задачи %s: %s", job_id, e)
+                finally:
+                    heartbeat.cancel()
+                    scheduled = self.scheduler.get_job(job_id)
+                    next_run_at = scheduled.next_run_time if scheduled else None
+                    duration_ms = int((time.monotonic() - started) * 1000)
+                    try:
+                        await asyncio.to_thread(record_finish, job_id, status, duration_ms, error, next_run_at)
+                    except Exception as e:
+                        logger.warning("Не удалось записать результат задачи %s: %s", job_id, e)
+            return wrapper
+        return decorator
+
+    async def status(self) -> dict:
+        return {
+            "holder": self.holder_id,
+            "leader": self.is_leader,
+            "jobs": await asyncio.to_thread(list_jobs),
+        }
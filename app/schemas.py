@@ -35,3 +35,29 @@ class ProductionOrderUpdate(BaseModel):
         if isinstance(value, str):
             return datetime.strptime(value, "%d.%m.%Y").date()
         return value
+
+class UploadSessionCreate(BaseModel):
+    file_name: str
+    length: int
+    sha256: str
+    order_id: Optional[int] = None
+
+class InventoryScan(BaseModel):
+    batch_number: str
+    part_number: str
+    quantity: int
+    # Идентификатор скана на терминале: повтор того же скана в пачке отбрасывается
+    scan_id: Optional[str] = None
+
+    @validator('batch_number', 'part_number')
+    def not_blank(cls, value):
+        value = value.strip()
+        if not value:
+            raise ValueError("не может быть пустым")
+        return value
+
+    @validator('quantity')
+    def positive_quantity(cls, value):
+        if value <= 0:
+            raise ValueError("должно быть больше нуля")
+        return value
@@ -0,0 +1,46 @@
+"""
+Объединение одинаковых параллельных операций внутри процесса.
+
+Если несколько запросов одновременно просят один и тот же результат
+(например, чертеж с QR-кодом после сканирования наклейки несколькими
+операторами), работа выполняется один раз, а остальные ждут ее результат.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет fn(), если для key еще ничего не выполняется, иначе ждет
+        результат уже идущего вызова. Исключение получают все ожидающие.
+
+        Работа идет в отдельной задаче, и все вызывающие, включая первого,
+        ждут ее через shield: отключение любого клиента отменяет только его
+        ожидание, а не работу для остальных.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+
+# Отрисовка чертежей с QR-кодом: ключ (order_id, drawing_id, дата)
+composites = SingleFlight()
+# Загрузка файлов: ключ — SHA-256 содержимого
+uploads = SingleFlight()
@@ -0,0 +1,319 @@
+"""
+Журнал медленных SQL-запросов с планами выполнения.
+
+Запросы дольше SLOW_QUERY_MS группируются по отпечатку: текст с заменой
+литералов и параметров на ?, так что один и тот же запрос с разными id
+попадает в одну запись. Для записи хранятся число срабатываний, суммарное
+и максимальное время, форма (или значения) параметров последнего вызова и план.
+
+План снимается в фоновом потоке отдельным соединением и только для SELECT:
+EXPLAIN ANALYZE выполняет запрос, для INSERT/UPDATE это изменило бы данные.
+На PostgreSQL используется EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) внутри
+транзакции с откатом и statement_timeout, на SQLite — EXPLAIN QUERY PLAN.
+План одного отпечатка обновляется не чаще раза в SLOW_QUERY_EXPLAIN_INTERVAL
+секунд, всего — не больше SLOW_QUERY_EXPLAIN_PER_MINUTE в минуту.
+
+По плану ищутся последовательные сканирования с фильтром по столбцам, с
+которых не начинается ни один индекс таблицы, — это подсказки о
+недостающих индексах для запросов, которые приложение выполняет на деле.
+
+Параметры:
+    SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_SAMPLE (доля, 1.0),
+    SLOW_QUERY_EXPLAIN_INTERVAL, SLOW_QUERY_EXPLAIN_PER_MINUTE, SLOW_QUERY_EXPLAIN_TIMEOUT_MS,
+    SLOW_QUERY_SEQSCAN_ROWS (минимум строк для подсказки), SLOW_QUERY_MAX_ENTRIES,
+    SLOW_QUERY_CAPTURE_PARAMS (1 — хранить значения параметров, по умолчанию
+    только их типы и длины: в параметрах бывают данные заказов и клиентов),
+    SLOW_QUERY_TOKEN (доступ к /api/debug/slow_queries; без него закрыт)
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, inspect
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "1.0"))
+EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+EXPLAIN_PER_MINUTE = int(os.getenv("SLOW_QUERY_EXPLAIN_PER_MINUTE", "10"))
+EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "30000"))
+SEQSCAN_ROWS = int(os.getenv("SLOW_QUERY_SEQSCAN_ROWS", "1000"))
+MAX_ENTRIES = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "500"))
+CAPTURE_PARAMS = os.getenv("SLOW_QUERY_CAPTURE_PARAMS", "0") == "1"
+SLOW_QUERY_TOKEN = os.getenv("SLOW_QUERY_TOKEN", "")
+TOKEN_HEADER = "x-debug-token"
+
+MAX_PARAMS_LENGTH = 500
+MAX_STATEMENT_LENGTH = 4000
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|\?|(?<![:\w]):\w+|\$\d+")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+# Столбец в условии фильтра плана: (status)::text = 'done', (order_id = 5)
+_FILTER_COLUMN_RE = re.compile(r"\(?\b([a-z_][a-z0-9_]*)\)?(?:::\w+)?\s*(?:=|<>|<=|>=|<|>|~~\*?|IS\b| IN\b)", re.I)
+
+
+def fingerprint(statement: str) -> str:
+    normalized = _STRING_RE.sub("?", statement)
+    normalized = _PARAM_RE.sub("?", normalized)
+    normalized = _NUMBER_RE.sub("?", normalized)
+    normalized = _IN_LIST_RE.sub("(...)", normalized)
+    return _SPACE_RE.sub(" ", normalized).strip()
+
+
+def fingerprint_id(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def is_select(statement: str) -> bool:
+    head = statement.lstrip().split(None, 1)
+    return bool(head) and head[0].upper() in ("SELECT", "WITH") and \
+        not re.search(r"\b(INSERT|UPDATE|DELETE)\b|\bFOR\s+UPDATE\b", statement, re.I)
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return bool(SLOW_QUERY_TOKEN) and token is not None and hmac.compare_digest(token, SLOW_QUERY_TOKEN)
+
+
+def _truncate(value, limit: int) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _describe_value(value) -> str:
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def describe_params(parameters):
+    """
+    Форма параметров без значений: типы, для строк — длина.
+    """
+    if isinstance(parameters, dict):
+        return {key: _describe_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [describe_params(p) if isinstance(p, (dict, list, tuple)) else _describe_value(p) for p in parameters]
+    return _describe_value(parameters)
+
+
+class SlowQueryLog:
+    def __init__(self, engine, threshold_ms: float = SLOW_QUERY_MS):
+        self.engine = engine
+        self.threshold = threshold_ms / 1000
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._explain_times: deque = deque()
+        self._explain_pending: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self._indexed_columns: Dict[str, Set[str]] = {}
+        # Запросы самого журнала (EXPLAIN, чтение индексов) не учитываются
+        self._local = threading.local()
+
+    def install(self) -> None:
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        event.listen(self.engine, "after_cursor_execute", self._after)
+
+    @staticmethod
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("slow_query_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        if elapsed < self.threshold or getattr(self._local, "explaining", False):
+            return
+        self.record(statement, parameters, elapsed, executemany)
+
+    def record(self, statement: str, parameters, elapsed: float, executemany: bool = False) -> None:
+        normalized = fingerprint(statement)
+        key = fingerprint_id(normalized)
+        params = _truncate(parameters if CAPTURE_PARAMS else describe_params(parameters), MAX_PARAMS_LENGTH)
+        elapsed_ms = elapsed * 1000
+        logger.warning("Медленный запрос %.1f мс [%s]: %s; параметры: %s",
+                       elapsed_ms, key, normalized[:MAX_STATEMENT_LENGTH], params)
+
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = {
+                    "fingerprint": key,
+                    "statement": normalized[:MAX_STATEMENT_LENGTH],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "plan": None,
+                    "plan_at": None,
+                    "index_hints": [],
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["last_ms"] = elapsed_ms
+            entry["last_params"] = params
+            entry["last_seen"] = datetime.now().isoformat(timespec="seconds")
+            self.entries[key] = entry
+            while len(self.entries) > MAX_ENTRIES:
+                self.entries.popitem(last=False)
+            should_explain = not executemany and self._should_explain(key, entry, statement)
+            if should_explain:
+                self._explain_pending.add(key)
+
+        if should_explain:
+            self._executor.submit(self._explain, key, statement, parameters)
+
+    def _should_explain(self, key: str, entry: dict, statement: str) -> bool:
+        if key in self._explain_pending or not is_select(statement):
+            return False
+        if entry["plan_at"] is not None and time.time() - entry["plan_at"] < EXPLAIN_INTERVAL:
+            return False
+        if random.random() >= EXPLAIN_SAMPLE:
+            return False
+        now = time.monotonic()
+        while self._explain_times and now - self._explain_times[0] > 60:
+            self._explain_times.popleft()
+        if len(self._explain_times) >= EXPLAIN_PER_MINUTE:
+            return False
+        self._explain_times.append(now)
+        return True
+
+    def _explain(self, key: str, statement: str, parameters) -> None:
+        self._local.explaining = True
+        try:
+            dialect = self.engine.dialect.name
+            with self.engine.connect() as conn:
+                if dialect == "postgresql":
+                    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                    rows = conn.exec_driver_sql(
+                        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+                    ).fetchall()
+                    plan = rows[0][0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    hints = self._postgres_hints(plan)
+                elif dialect == "sqlite":
+                    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+                    plan = [row[-1] for row in rows]
+                    hints = self._sqlite_hints(plan)
+                else:
+                    return
+                # EXPLAIN ANALYZE выполнил запрос — ничего не фиксируем
+                conn.rollback()
+        except Exception as e:
+            logger.warning("Не удалось получить план запроса [%s]: %s", key, e)
+            plan, hints = None, []
+        finally:
+            self._local.explaining = False
+            with self._lock:
+                self._explain_pending.discard(key)
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["plan"] = plan
+                entry["plan_at"] = time.time()
+                entry["index_hints"] = hints
+        for hint in hints:
+            logger.warning("Возможно, не хватает индекса [%s]: %s", key, hint)
+
+    def _indexed(self, table: str) -> Set[str]:
+        """
+        Столбцы, с которых начинается какой-либо индекс (или первичный ключ).
+        """
+        columns = self._indexed_columns.get(table)
+        if columns is None:
+            inspector = inspect(self.engine)
+            columns = set()
+            try:
+                for index in inspector.get_indexes(table):
+                    if index["column_names"] and index["column_names"][0]:
+                        columns.add(index["column_names"][0])
+                primary_key = inspector.get_pk_constraint(table).get("constrained_columns") or []
+                if primary_key:
+                    columns.add(primary_key[0])
+                for constraint in inspector.get_unique_constraints(table):
+                    if constraint["column_names"]:
+                        columns.add(constraint["column_names"][0])
+            except Exception as e:
+                logger.warning("Не удалось прочитать индексы таблицы %s: %s", table, e)
+            self._indexed_columns[table] = columns
+        return columns
+
+    def _missing_index_hint(self, table: str, condition: str) -> Optional[str]:
+        filter_columns = {m.group(1).lower() for m in _FILTER_COLUMN_RE.finditer(condition)}
+        missing = sorted(filter_columns - self._indexed(table) - {"and", "or", "not"})
+        if not missing:
+            return None
+        return f"последовательное чтение {table} с условием {condition}: нет индекса по {', '.join(missing)}"
+
+    def _postgres_hints(self, plan) -> List[str]:
+        hints = []
+        stack = [node["Plan"] for node in plan] if isinstance(plan, list) else [plan.get("Plan", {})]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.get("Plans", []))
+            if node.get("Node Type") != "Seq Scan" or "Filter" not in node:
+                continue
+            rows = node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)
+            if rows < SEQSCAN_ROWS:
+                continue
+            hint = self._missing_index_hint(node["Relation Name"], node["Filter"])
+            if hint:
+                hints.append(f"{hint} (просмотрено строк: {rows})")
+        return hints
+
+    def _sqlite_hints(self, plan: List[str]) -> List[str]:
+        # SQLite не сообщает условие, только факт полного сканирования
+        hints = []
+        for detail in plan:
+            match = re.match(r"SCAN (?:TABLE )?(\w+)$", detail)
+            if match:
+                hints.append(f"полное сканирование {match.group(1)}")
+        return hints
+
+    def report(self) -> List[dict]:
+        with self._lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        for entry in entries:
+            entry["mean_ms"] = round(entry["total_ms"] / entry["count"], 1)
+            entry["total_ms"] = round(entry["total_ms"], 1)
+            entry["max_ms"] = round(entry["max_ms"], 1)
+            entry["last_ms"] = round(entry["last_ms"], 1)
+            if entry["plan_at"] is not None:
+                entry["plan_at"] = datetime.fromtimestamp(entry["plan_at"]).isoformat(timespec="seconds")
+        return sorted(entries, key=lambda e: e["total_ms"], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.entries.clear()
+        self._indexed_columns.clear()
+
+
+_log: Optional[SlowQueryLog] = None
+
+
+def install(engine, threshold_ms: float = SLOW_QUERY_MS) -> SlowQueryLog:
+    global _log
+    if _log is None:
+        _log = SlowQueryLog(engine, threshold_ms)
+        _log.install()
+    return _log
+
+
+def get_log() -> Optional[SlowQueryLog]:
+    return _log
@@ -0,0 +1,116 @@
+"""
+Инкрементальная очистка временной папки.
+
+Вместо ночного shutil.rmtree периодически удаляются файлы старше TTL,
+порциями с паузами, а если папка все равно превышает квоту — самые старые
+файлы вытесняются первыми. Недавно измененные файлы не трогаются никогда:
+их, скорее всего, еще пишет активный запрос.
+"""
+import logging
+import os
+import time
+from typing import List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+TEMP_DIR = os.path.join("static", "temp")
+DEFAULT_TTL_SECONDS = float(os.getenv("TEMP_TTL_HOURS", "24")) * 3600
+DEFAULT_QUOTA_BYTES = int(float(os.getenv("TEMP_QUOTA_MB", "2048")) * 1024 * 1024)
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_BATCH_PAUSE = 0.05
+# Файлы, менявшиеся за последние IN_USE_GRACE секунд, считаются занятыми
+IN_USE_GRACE_SECONDS = 300
+
+
+class TempEntry(NamedTuple):
+    mtime: float
+    size: int
+    path: str
+
+
+def scan_entries(root: str) -> List[TempEntry]:
+    entries = []
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            stat = entry.stat(follow_symlinks=False)
+                            entries.append(TempEntry(stat.st_mtime, stat.st_size, entry.path))
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            continue
+    return entries
+
+
+def _remove_in_batches(entries: List[TempEntry], batch_size: int, batch_pause: float) -> int:
+    freed = 0
+    for index, entry in enumerate(entries, start=1):
+        try:
+            os.remove(entry.path)
+            freed += entry.size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Не удалось удалить временный файл %s: %s", entry.path, e)
+        if index % batch_size == 0:
+            time.sleep(batch_pause)
+    return freed
+
+
+def _remove_empty_dirs(root: str, older_than: float) -> None:
+    for directory, _, _ in os.walk(root, topdown=False):
+        if directory == root:
+            continue
+        try:
+            if os.stat(directory).st_mtime < older_than:
+                os.rmdir(directory)
+        except OSError:
+            # Каталог не пуст или уже удален
+            pass
+
+
+def reap_temp_dir(
+    root: str = TEMP_DIR,
+    ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    quota_bytes: int = DEFAULT_QUOTA_BYTES,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_pause: float = DEFAULT_BATCH_PAUSE,
+) -> dict:
+    """
+    Один проход очистки. Блокирующая функция: вызывать через asyncio.to_thread.
+    """
+    os.makedirs(root, exist_ok=True)
+    now = time.time()
+    entries = scan_entries(root)
+
+    expired = [e for e in entries if e.mtime < now - ttl_seconds]
+    freed = _remove_in_batches(expired, batch_size, batch_pause)
+
+    expired_paths = {e.path for e in expired}
+    remaining = sorted((e for e in entries if e.path not in expired_paths), key=lambda e: e.mtime)
+    total = sum(e.size for e in remaining)
+
+    evicted = []
+    if total > quota_bytes:
+        for entry in remaining:
+            if total <= quota_bytes or entry.mtime > now - IN_USE_GRACE_SECONDS:
+                break
+            evicted.append(entry)
+            total -= entry.size
+        freed += _remove_in_batches(evicted, batch_size, batch_pause)
+        if total > quota_bytes:
+            logger.warning("Временная папка превышает квоту (%s > %s байт) за счет файлов в работе", total, quota_bytes)
+
+    _remove_empty_dirs(root, now - ttl_seconds)
+
+    stats = {"expired": len(expired), "evicted": len(evicted), "freed_bytes": freed, "remaining_bytes": total}
+    if expired or evicted:
+        logger.info("Очистка временной папки: %s", stats)
+    return stats
@@ -0,0 +1,432 @@
+"""
+Трассировка запросов, совместимая с OpenTelemetry.
+
+Спаны образуют дерево через contextvars: текущий спан наследуется корутинами
+и потоками asyncio.to_thread. Контекст передается между процессами
+заголовком W3C traceparent (00-<trace_id>-<span_id>-<flags>): его принимает
+TracingMiddleware, а job_queue кладет его в payload задачи, так что
+обработка чертежа воркером попадает в трассу запроса, который ее поставил.
+
+Готовые спаны копятся в очереди и выгружаются фоновым потоком в формате
+OTLP/JSON (ExportTraceServiceRequest):
+    TRACING_EXPORTER=file — строки JSON в TRACING_FILE (по умолчанию
+                            traces/spans.jsonl), как у file-экспортера
+                            OpenTelemetry Collector;
+    TRACING_EXPORTER=otlp — POST на TRACING_OTLP_ENDPOINT
+                            (http://localhost:4318/v1/traces).
+Без TRACING_EXPORTER трассировка выключена и span() ничего не делает.
+TRACING_SAMPLE_RATE — доля трасс, начинающихся в приложении; решение
+входящего traceparent соблюдается.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+TRACING_FILE = os.getenv("TRACING_FILE", os.path.join("traces", "spans.jsonl"))
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "cnc-orders")
+
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL = 2.0
+QUEUE_SIZE = 10000
+MAX_STATEMENT_LENGTH = 500
+
+TRACEPARENT_KEY = "traceparent"
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# Коды OTLP
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+def enabled() -> bool:
+    return TRACING_EXPORTER in ("file", "otlp")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "events")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], kind: str = "internal",
+                 attributes: Optional[dict] = None, start_ns: Optional[int] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.status = 0
+        self.status_message = ""
+        self.events: List[dict] = []
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(exc).__name__}: {exc}"
+        self.events.append({
+            "name": "exception",
+            "time_ns": time.time_ns(),
+            "attributes": {"exception.type": type(exc).__name__, "exception.message": str(exc)},
+        })
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            _export(self)
+
+
+class _NoopSpan:
+    """Заглушка для выключенной трассировки и невыбранных трасс."""
+    trace_id = None
+    span_id = None
+    start_ns = 0
+    traceparent = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar = ContextVar("current_span", default=None)
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    (trace_id, parent_span_id, sampled) или None для некорректного заголовка.
+    """
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def start_span(name: str, kind: str = "internal", traceparent: Optional[str] = None,
+               attributes: Optional[dict] = None, start_ns: Optional[int] = None):
+    """
+    Начинает спан (не делая его текущим). Родитель — traceparent, если
+    передан, иначе текущий спан; без родителя начинается новая трасса.
+    """
+    if not enabled():
+        return NOOP_SPAN
+    remote = parse_traceparent(traceparent)
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+        if not sampled:
+            return NOOP_SPAN
+    else:
+        parent = _current.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        elif random.random() < TRACING_SAMPLE_RATE:
+            trace_id, parent_id = os.urandom(16).hex(), None
+        else:
+            return NOOP_SPAN
+    return Span(name, trace_id, parent_id, kind, attributes, start_ns)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", traceparent: Optional[str] = None, **attributes) -> Iterator:
+    """
+    with tracing.span("qr.generate", order_id=1): ... — дочерний спан
+    текущего. Исключение отмечается в спане и пробрасывается дальше.
+    """
+    if not enabled():
+        yield NOOP_SPAN
+        return
+    if traceparent is None and _current.get() is None and kind not in ("server", "consumer"):
+        # Вне трассы (задачи планировщика, CLI) внутренние спаны новую трассу не начинают
+        yield NOOP_SPAN
+        return
+    current = start_span(name, kind, traceparent, attributes)
+    if current is NOOP_SPAN:
+        yield current
+        return
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def record_span(name: str, start_ns: int, end_ns: Optional[int] = None, **attributes) -> None:
+    """
+    Задним числом добавляет дочерний спан текущего — для этапов, которые
+    прошли до входа в обработчик (разбор multipart формы FastAPI).
+    """
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(name, parent.trace_id, parent.span_id, "internal", attributes, start_ns)
+    child.end(end_ns)
+
+
+def inject(payload: dict) -> dict:
+    """
+    Копия payload с traceparent текущего спана (для фоновых задач).
+    """
+    parent = _current.get()
+    if parent is None:
+        return payload
+    return {**payload, TRACEPARENT_KEY: parent.traceparent}
+
+
+def extract(payload) -> Optional[str]:
+    return payload.get(TRACEPARENT_KEY) if isinstance(payload, dict) else None
+
+
+# Экспорт
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: dict) -> List[dict]:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def span_to_otlp(s: Span) -> dict:
+    data = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": SPAN_KINDS.get(s.kind, 1),
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": _attributes(s.attributes),
+        "events": [
+            {"name": e["name"], "timeUnixNano": str(e["time_ns"]), "attributes": _attributes(e["attributes"])}
+            for e in s.events
+        ],
+        "status": {"code": s.status, "message": s.status_message} if s.status else {},
+    }
+    if s.parent_span_id:
+        data["parentSpanId"] = s.parent_span_id
+    return data
+
+
+def otlp_request(spans: List[Span]) -> dict:
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({
+                "service.name": TRACING_SERVICE_NAME,
+                "process.pid": os.getpid(),
+            })},
+            "scopeSpans": [{
+                "scope": {"name": "app.tracing"},
+                "spans": [span_to_otlp(s) for s in spans],
+            }],
+        }]
+    }
+
+
+class BatchExporter:
+    """
+    Фоновый поток: выгружает спаны пачками раз в EXPORT_INTERVAL секунд.
+    При переполнении очереди спаны отбрасываются, запрос не ждет.
+    """
+
+    def __init__(self, exporter: str):
+        self.exporter = exporter
+        self.queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def add(self, s: Span) -> None:
+        try:
+            self.queue.put_nowait(s)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> List[Span]:
+        spans = []
+        while len(spans) < EXPORT_BATCH_SIZE:
+            try:
+                spans.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def _run(self) -> None:
+        while not self._stop.wait(EXPORT_INTERVAL):
+            self.flush()
+        self.flush()
+
+    def flush(self) -> None:
+        while True:
+            spans = self._drain()
+            if not spans:
+                return
+            try:
+                self._write(otlp_request(spans))
+            except Exception as e:
+                logger.warning("Не удалось выгрузить %s спанов: %s", len(spans), e)
+
+    def _write(self, request: dict) -> None:
+        body = json.dumps(request, ensure_ascii=False, separators=(",", ":"))
+        if self.exporter == "file":
+            directory = os.path.dirname(TRACING_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(TRACING_FILE, "a", encoding="utf-8") as f:
+                f.write(body + "\n")
+        else:
+            http_request = urllib.request.Request(
+                TRACING_OTLP_ENDPOINT, data=body.encode(), headers={"Content-Type": "application/json"}
+            )
+            with urllib.request.urlopen(http_request, timeout=5):
+                pass
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=10)
+
+
+_exporter: Optional[BatchExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def _export(s: Span) -> None:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = BatchExporter(TRACING_EXPORTER)
+                atexit.register(_exporter.shutdown)
+    _exporter.add(s)
+
+
+# Интеграции
+
+def instrument_engine(engine) -> None:
+    """
+    Спан на каждый SQL-запрос внутри трассы.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        child = None
+        if parent is not None:
+            child = Span("db.query", parent.trace_id, parent.span_id, "client", {
+                "db.system": engine.dialect.name,
+                "db.statement": statement[:MAX_STATEMENT_LENGTH],
+                "db.executemany": executemany,
+            })
+        conn.info.setdefault("tracing_spans", []).append(child)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("tracing_spans")
+        child = spans.pop() if spans else None
+        if child is not None:
+            child.set_attribute("db.rows", cursor.rowcount)
+            child.end()
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        connection = exception_context.connection
+        spans = connection.info.get("tracing_spans") if connection is not None else None
+        child = spans.pop() if spans else None
+        if child is not None:
+            child.record_exception(exception_context.original_exception)
+            child.end()
+
+
+class TracingMiddleware:
+    """
+    ASGI-middleware: серверный спан на каждый HTTP-запрос. Имя спана —
+    метод и шаблон маршрута; X-Trace-Id в ответе помогает найти трассу.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled():
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        root = start_span(f"{scope['method']} {scope['path']}", "server", traceparent, {
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+        })
+        if root is NOOP_SPAN:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    root.status = STATUS_ERROR
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", root.trace_id.encode())]
+            await send(message)
+
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+                root.set_attribute("http.route", route)
+            root.end()
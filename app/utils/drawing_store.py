@@ -0,0 +1,106 @@
+import asyncio
+import errno
+import os
+import shutil
+import uuid
+
+# Хранилище чертежей, адресуемое по содержимому:
+# static/drawings/ab/cd/abcd...ef — путь вычисляется только из хеша.
+# Два уровня по два hex-символа дают 65536 каталогов, так что даже
+# десятки миллионов файлов дают лишь сотни записей на каталог.
+DRAWINGS_ROOT = os.path.join('static', 'drawings')
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+# Каталоги, уже созданные этим процессом: makedirs вызывается один раз на шард
+_known_dirs = set()
+
+
+def shard_dir(file_hash: str) -> str:
+    """
+    Возвращает каталог шарда для хеша.
+    """
+    parts = [file_hash[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return os.path.join(DRAWINGS_ROOT, *parts)
+
+
+def object_path(file_hash: str, suffix: str = "") -> str:
+    """
+    Путь к объекту в хранилище. Для чертежей suffix пустой, для производных
+    файлов (QR-коды, превью) задается расширение или метка варианта.
+    """
+    return os.path.join(shard_dir(file_hash), f"{file_hash}{suffix}")
+
+
+def ensure_dir(directory: str) -> None:
+    if directory in _known_dirs:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _known_dirs.add(directory)
+
+
+def write_atomic(path: str, content: bytes) -> str:
+    """
+    Записывает файл через временный файл в том же каталоге и os.replace,
+    поэтому читатели видят либо старое, либо полностью новое содержимое.
+    """
+    directory = os.path.dirname(path)
+    ensure_dir(directory)
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+async def write_atomic_async(path: str, content: bytes) -> str:
+    """
+    То же, что write_atomic, но без блокировки цикла событий.
+    """
+    return await asyncio.to_thread(write_atomic, path, content)
+
+
+def move_into_store(source_path: str, destination_path: str) -> str:
+    """
+    Переносит уже существующий файл в хранилище. Обычно это rename; если
+    источник на другой файловой системе, файл копируется рядом с целью и
+    подменяет ее атомарно.
+    """
+    directory = os.path.dirname(destination_path)
+    ensure_dir(directory)
+    try:
+        os.replace(source_path, destination_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = os.path.join(directory, f".{os.path.basename(destination_path)}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, destination_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        os.remove(source_path)
+    return destination_path
+
+
+async def store_bytes(content: bytes, file_hash: str, suffix: str = "") -> str:
+    """
+    Сохраняет содержимое под его хешем. Повторная запись того же хеша не нужна.
+    """
+    path = object_path(file_hash, suffix)
+    if os.path.exists(path):
+        return path
+    return await write_atomic_async(path, content)
@@ -2,7 +2,8 @@ import hashlib
 import os
 import aiofiles
 from fastapi import UploadFile
-from datetime import datetime
+from app import metrics
+from app.utils import drawing_store
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'}
@@ -11,16 +12,15 @@ def calculate_file_hash(file_content: bytes) -> str:
     """
     Асинхронно вычисляет SHA-256 хеш для загруженного файла.
     """
-    return hashlib.sha256(file_content).hexdigest()
+    with metrics.stage("hash"):
+        return hashlib.sha256(file_content).hexdigest()
 
-def get_file_path(file_hash: str, file_extension: str) -> str:
+def get_file_path(file_hash: str, file_extension: str = "") -> str:
     """
     Генерирует путь для сохранения файла на основе его хеша.
+    Каталоги не создаются: это делает код, который пишет файл.
     """
-    today = datetime.now()
-    directory = os.path.join('static', 'drawings', str(today.year), f"{today.month:02d}", f"{today.day:02d}")
-    os.makedirs(directory, exist_ok=True)
-    return os.path.join(directory, f"{file_hash}{file_extension}")
+    return drawing_store.object_path(file_hash, file_extension)
 
 async def save_file(file_content: bytes, file_path: str) -> None:
     """
@@ -1,8 +1,11 @@
 import asyncio
 import logging
+import time
 from fastapi import WebSocket
 from typing import List
 
+from app import metrics, tracing
+
 logger = logging.getLogger(__name__)
 
 class ConnectionManager:
@@ -13,26 +16,32 @@ class ConnectionManager:
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
-        logger.info(f"Новое WebSocket соединение: {websocket.client}")
+        logger.info("Новое WebSocket соединение: %s", websocket.client)
         if self.ping_task is None:
             self.ping_task = asyncio.create_task(self.ping_clients())
 
     def disconnect(self, websocket: WebSocket):
         self.active_connections.remove(websocket)
-        logger.info(f"WebSocket соединение закрыто: {websocket.client}")
+        logger.info("WebSocket соединение закрыто: %s", websocket.client)
 
     async def broadcast(self, message: str):
-        logger.info(f"Рассылка сообщения всем клиентам: {message}")
+        # Сообщение содержит заказ целиком — в журнал пишется только размер
+        logger.debug("Рассылка сообщения %s клиентам, %s байт", len(self.active_connections), len(message))
+        started = time.perf_counter()
         dead_connections = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке сообщения: {e}")
-                dead_connections.append(connection)
+        with tracing.span("ws.broadcast", clients=len(self.active_connections), bytes=len(message)):
+            for connection in self.active_connections:
+                try:
+                    await connection.send_text(message)
+                except Exception as e:
+                    logger.error("Ошибка при отправке сообщения: %s", e)
+                    dead_connections.append(connection)
 
         for dead_connection in dead_connections:
             self.active_connections.remove(dead_connection)
+        metrics.websocket_broadcast_duration.observe(time.perf_counter() - started)
+        if dead_connections:
+            metrics.websocket_broadcast_failures.inc(len(dead_connections))
 
     async def ping_clients(self):
         while True:
@@ -42,7 +51,7 @@ class ConnectionManager:
                 try:
                     await connection.send_text('ping')
                 except Exception as e:
-                    logger.error(f"Ошибка при отправке пинга: {e}")
+                    logger.error("Ошибка при отправке пинга: %s", e)
                     dead_connections.append(connection)
 
             for dead_connection in dead_connections:
@@ -0,0 +1,52 @@
+"""
+Изолированное окружение для бенчмарков.
+
+Приложение читает URL базы из модуля config (он лежит только на серверах)
+и пишет файлы по относительным путям static/..., поэтому перед импортом
+app.main бенчмарк:
+  * подставляет модуль config с URL из BENCH_DATABASE_URL (по умолчанию —
+    SQLite-файл в рабочем каталоге), чтобы никогда не задеть рабочую базу;
+  * переходит во временный рабочий каталог с пустым static/ и ссылками на
+    templates/ и шрифты репозитория.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BenchEnvironment:
+    def __init__(self, database_url: str = None, workdir: str = None, keep: bool = False):
+        self.workdir = workdir or tempfile.mkdtemp(prefix="cnc_bench_")
+        self.database_url = database_url or os.getenv("BENCH_DATABASE_URL") or \
+            f"sqlite:///{os.path.join(self.workdir, 'bench.sqlite3')}"
+        self.keep = keep or bool(workdir)
+        self._previous_cwd = None
+
+    def _link(self, source: str, target: str) -> None:
+        if os.path.exists(source) and not os.path.exists(target):
+            os.symlink(source, target)
+
+    def __enter__(self):
+        os.makedirs(os.path.join(self.workdir, "static"), exist_ok=True)
+        self._link(os.path.join(REPO_ROOT, "templates"), os.path.join(self.workdir, "templates"))
+        fonts = os.getenv("BENCH_FONTS_DIR", os.path.join(REPO_ROOT, "static", "fonts"))
+        self._link(fonts, os.path.join(self.workdir, "static", "fonts"))
+
+        config_module = types.ModuleType("config")
+        config_module.config = types.SimpleNamespace(SQLALCHEMY_DATABASE_URL=self.database_url)
+        sys.modules["config"] = config_module
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+
+        self._previous_cwd = os.getcwd()
+        os.chdir(self.workdir)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.chdir(self._previous_cwd)
+        if not self.keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
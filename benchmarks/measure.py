@@ -0,0 +1,119 @@
+"""
+Сбор и сравнение результатов: задержки, пропускная способность, пиковый RSS.
+"""
+import asyncio
+import json
+import math
+import resource
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * q
+    low, high = math.floor(rank), math.ceil(rank)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+async def run_scenario(
+    name: str,
+    operation: Callable[[int], Awaitable[None]],
+    iterations: int,
+    concurrency: int = 1,
+    warmup: int = 1,
+) -> dict:
+    """
+    Выполняет operation(i) iterations раз с заданной параллельностью.
+    Ошибки считаются отдельно и не входят в задержки.
+    """
+    for i in range(warmup):
+        await operation(-1 - i)
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    counter = iter(range(iterations))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                await operation(i)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def format_table(results: List[dict]) -> str:
+    columns = ["name", "ok", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"]
+    rows = [columns] + [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def save_baseline(path: str, results: List[dict], meta: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": {r["name"]: r for r in results}}, f, ensure_ascii=False, indent=2)
+
+
+def compare_to_baseline(results: List[dict], baseline_path: str, threshold: float,
+                        rss_threshold: Optional[float] = None) -> List[str]:
+    """
+    Регрессия: p95 выросла или пропускная способность упала больше чем на
+    threshold (доля), либо пиковый RSS вырос больше чем на rss_threshold.
+    Сценарий, который в базовом прогоне выполнялся, а теперь не дал ни
+    одного успешного вызова, тоже считается регрессией.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline: Dict[str, dict] = json.load(f)["results"]
+
+    regressions = []
+    for result in results:
+        base = baseline.get(result["name"])
+        if not base or not base.get("ok"):
+            continue
+        if not result["ok"]:
+            regressions.append(f"{result['name']}: нет успешных вызовов (в базовом прогоне {base['ok']})")
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{result['name']}: p95 {base['p95_ms']} -> {result['p95_ms']} мс")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{result['name']}: пропускная способность {base['throughput_rps']} -> {result['throughput_rps']} rps"
+            )
+        if rss_threshold is not None and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_threshold):
+            regressions.append(f"{result['name']}: пиковый RSS {base['peak_rss_mb']} -> {result['peak_rss_mb']} МБ")
+    return regressions
@@ -0,0 +1,247 @@
+"""
+Бенчмарк горячих путей: создание заказа, загрузка и стандартизация
+чертежей, отрисовка чертежа с QR-кодом, просмотр чертежей и /api/orders.
+
+Запросы идут через httpx.ASGITransport прямо в приложение (без сети и
+uvicorn), база — SQLite во временном каталоге или BENCH_DATABASE_URL
+(например, отдельная база PostgreSQL). Рабочую базу бенчмарк не трогает.
+
+    python -m benchmarks.run --profile quick
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --threshold 0.15
+
+При регрессии относительно базовой линии код возврата 1.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import sys
+from datetime import date, datetime, timedelta
+
+from benchmarks import measure, synthetic
+from benchmarks.environment import BenchEnvironment
+
+SCENARIOS = [
+    "create_order",
+    "process_uploaded_file",
+    "standardize_image",
+    "combine_drawing_with_qr_cold",
+    "combine_drawing_with_qr_warm",
+    "view_drawing",
+    "api_orders",
+]
+
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".tiff": "image/tiff"}
+
+
+def unique_content(content: bytes, index: int) -> bytes:
+    # Хвост после конца изображения PIL игнорирует, а хеш файла меняется,
+    # так что каждая итерация проходит полный путь без дедупликации
+    return content + f"\nbench-{index}".encode()
+
+
+def order_form(index: int) -> dict:
+    start = date.today() + timedelta(days=index % 30)
+    return {
+        "drawing_designation": f"КИ {100 + index % 900}.01.02",
+        "quantity": str(1 + index % 50),
+        "desired_production_date_start": start.strftime("%d.%m.%Y"),
+        "desired_production_date_end": (start + timedelta(days=14)).strftime("%d.%m.%Y"),
+        "required_material": ("Ст3", "09Г2С", "AISI 304", "Д16Т")[index % 4],
+        "notes": "benchmark",
+    }
+
+
+def seed_orders(main, count: int) -> None:
+    """
+    Много заказов без файлов для /api/orders: одной вставкой.
+    """
+    from app import repository
+
+    db = main.SessionLocal()
+    try:
+        designations = [f"КИ {100 + i % 900}.05.01" for i in range(count)]
+        numbers = repository.allocate_order_numbers(db, designations)
+        rows = []
+        for i, (designation, number) in enumerate(zip(designations, numbers)):
+            form = order_form(i)
+            rows.append({
+                "order_number": number,
+                "publication_date": date.today(),
+                "drawing_designation": designation,
+                "quantity": int(form["quantity"]),
+                "desired_production_date_start": datetime.strptime(form["desired_production_date_start"], "%d.%m.%Y").date(),
+                "desired_production_date_end": datetime.strptime(form["desired_production_date_end"], "%d.%m.%Y").date(),
+                "required_material": form["required_material"],
+                "metal_delivery_date": None,
+                "notes": "seed",
+            })
+        repository.bulk_insert_production_orders(db, rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run_benchmarks(args) -> list:
+    import httpx
+    from starlette.datastructures import UploadFile
+
+    from app import main, models, image_processing
+
+    # Журнал запросов искажает замеры
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"Генерация синтетических чертежей (профиль {args.profile})...", file=sys.stderr)
+    drawings = synthetic.generate(args.profile)
+
+    transport = httpx.ASGITransport(app=main.app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+
+    async def request(method: str, url: str, **kwargs) -> httpx.Response:
+        response = await client.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url}: HTTP {response.status_code} {response.text[:200]}")
+        return response
+
+    # Подготовка: по заказу на каждый вид чертежа
+    targets = []
+    for i, (filename, content) in enumerate(drawings):
+        ext = os.path.splitext(filename)[1]
+        response = await request("POST", "/create_order", data=order_form(i),
+                                 files=[("drawing_files", (filename, content, MIME_TYPES[ext]))])
+        order_id = response.json()["order_id"]
+        db = main.SessionLocal()
+        try:
+            link = db.query(models.OrderDrawing).filter(models.OrderDrawing.order_id == order_id).first()
+            targets.append((order_id, link.drawing_id))
+        finally:
+            db.close()
+    seed_orders(main, args.orders)
+
+    async def create_order(i):
+        filename, content = drawings[i % len(drawings)]
+        ext = os.path.splitext(filename)[1]
+        await request("POST", "/create_order", data=order_form(i),
+                      files=[("drawing_files", (filename, unique_content(content, i), MIME_TYPES[ext]))])
+
+    async def process_uploaded_file(i):
+        filename, content = drawings[i % len(drawings)]
+        upload = UploadFile(file=io.BytesIO(unique_content(content, 1_000_000 + i)), filename=filename)
+        await main.process_uploaded_file(upload)
+
+    standardize_dir = os.path.join("static", "temp", "bench_standardize")
+    os.makedirs(standardize_dir, exist_ok=True)
+
+    async def standardize_image(i):
+        filename, content = drawings[i % len(drawings)]
+        path = os.path.join(standardize_dir, f"{i}_{filename}")
+        with open(path, "wb") as f:
+            f.write(content)
+        await main.standardize_image(path)
+        os.remove(path)
+
+    async def combine_cold(i):
+        order_id, drawing_id = targets[i % len(targets)]
+        cache_path = image_processing.composite_cache_path(order_id, drawing_id, date.today())
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        await request("GET", f"/combine_drawing_with_qr/{order_id}/{drawing_id}")
+
+    async def combine_warm(i):
+        order_id, drawing_id = targets[i % len(targets)]
+        await request("GET", f"/combine_drawing_with_qr/{order_id}/{drawing_id}")
+
+    async def view_drawing(i):
+        order_id, _ = targets[i % len(targets)]
+        await request("GET", f"/view_drawing/{order_id}")
+
+    async def api_orders(i):
+        await request("GET", "/api/orders")
+
+    operations = {
+        "create_order": (create_order, args.iterations),
+        "process_uploaded_file": (process_uploaded_file, args.iterations),
+        "standardize_image": (standardize_image, args.iterations),
+        "combine_drawing_with_qr_cold": (combine_cold, args.iterations),
+        "combine_drawing_with_qr_warm": (combine_warm, args.iterations * 5),
+        "view_drawing": (view_drawing, args.iterations * 5),
+        "api_orders": (api_orders, args.iterations),
+    }
+
+    results = []
+    try:
+        for name in args.scenarios:
+            operation, iterations = operations[name]
+            print(f"Сценарий {name}: {iterations} итераций, параллельность {args.concurrency}", file=sys.stderr)
+            results.append(await measure.run_scenario(name, operation, iterations, args.concurrency, args.warmup))
+    finally:
+        await client.aclose()
+        if main.scheduler.running:
+            main.scheduler.shutdown(wait=False)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих путей приложения")
+    parser.add_argument("--profile", choices=sorted(synthetic.PROFILES), default="standard")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--orders", type=int, default=500, help="Сколько заказов добавить для /api/orders")
+    parser.add_argument("--database-url", help="По умолчанию BENCH_DATABASE_URL или временный SQLite")
+    parser.add_argument("--workdir", help="Рабочий каталог (сохраняется после прогона)")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--save-baseline", help="Сохранить результаты как базовую линию")
+    parser.add_argument("--baseline", help="Сравнить с базовой линией")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Допустимое ухудшение p95 и rps (доля)")
+    parser.add_argument("--rss-threshold", type=float, default=None, help="Допустимый рост пикового RSS (доля)")
+    args = parser.parse_args()
+
+    # Пути к файлам базовой линии задаются относительно каталога запуска
+    for attr in ("output", "save_baseline", "baseline"):
+        if getattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+
+    with BenchEnvironment(database_url=args.database_url, workdir=args.workdir) as env:
+        print(f"Рабочий каталог: {env.workdir}, база: {env.database_url}", file=sys.stderr)
+        results = asyncio.run(run_benchmarks(args))
+        database_url = env.database_url
+
+    meta = {
+        "profile": args.profile,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "database": database_url.split(":", 1)[0],
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+    }
+    print(measure.format_table(results))
+    for result in results:
+        if result["errors"]:
+            print(f"{result['name']}: {result['errors']} ошибок, первая: {result['first_error']}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        measure.save_baseline(args.save_baseline, results, meta)
+        print(f"Базовая линия сохранена: {args.save_baseline}", file=sys.stderr)
+    if args.baseline:
+        regressions = measure.compare_to_baseline(results, args.baseline, args.threshold, args.rss_threshold)
+        if regressions:
+            print("Регрессии производительности:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("Регрессий относительно базовой линии нет", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
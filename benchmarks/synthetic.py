@@ -0,0 +1,106 @@
+"""
+Синтетические чертежи для бенчмарков.
+
+Изображения детерминированы (seed), похожи на сканы чертежей: белый лист,
+рамка, сетка линий, надписи и немного шума, чтобы сжатие вело себя как на
+настоящих файлах, а не как на однотонной заливке.
+"""
+import io
+import random
+from typing import List, NamedTuple, Tuple
+
+from PIL import Image, ImageDraw
+
+
+class DrawingSpec(NamedTuple):
+    name: str
+    size: Tuple[int, int]
+    mode: str
+    dpi: int
+    format: str
+
+
+# Форматы листов в пикселях при 150 dpi: A4 1240x1754, A3 1754x2480, A1 3508x4961
+PROFILES = {
+    "quick": [
+        DrawingSpec("a4_gray_150", (1240, 1754), "L", 150, "PNG"),
+        DrawingSpec("a4_rgb_jpeg", (1754, 1240), "RGB", 150, "JPEG"),
+    ],
+    "standard": [
+        DrawingSpec("a4_bw_300", (2480, 3508), "1", 300, "PNG"),
+        DrawingSpec("a4_gray_150", (1240, 1754), "L", 150, "PNG"),
+        DrawingSpec("a3_rgb_jpeg", (2480, 1754), "RGB", 150, "JPEG"),
+        DrawingSpec("a3_rgba_png", (1754, 2480), "RGBA", 96, "PNG"),
+        DrawingSpec("a4_tiff_200", (1654, 2339), "L", 200, "TIFF"),
+    ],
+    "full": [
+        DrawingSpec("a4_bw_300", (2480, 3508), "1", 300, "PNG"),
+        DrawingSpec("a4_gray_150", (1240, 1754), "L", 150, "PNG"),
+        DrawingSpec("a3_rgb_jpeg", (2480, 1754), "RGB", 150, "JPEG"),
+        DrawingSpec("a3_rgba_png", (1754, 2480), "RGBA", 96, "PNG"),
+        DrawingSpec("a4_tiff_200", (1654, 2339), "L", 200, "TIFF"),
+        DrawingSpec("a1_gray_300", (7016, 9933), "L", 300, "PNG"),
+        DrawingSpec("a1_rgb_tiff", (9933, 7016), "RGB", 150, "TIFF"),
+    ],
+}
+
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "TIFF": ".tiff"}
+
+
+def render_drawing(spec: DrawingSpec, seed: int = 0) -> bytes:
+    rng = random.Random(f"{spec.name}:{seed}")
+    width, height = spec.size
+    img = Image.new("L", spec.size, 255)
+    draw = ImageDraw.Draw(img)
+
+    margin = max(10, width // 40)
+    draw.rectangle([margin, margin, width - margin, height - margin], outline=0, width=max(2, width // 500))
+    # Основная надпись в правом нижнем углу
+    stamp_w, stamp_h = width // 3, height // 10
+    draw.rectangle([width - margin - stamp_w, height - margin - stamp_h, width - margin, height - margin], outline=0, width=2)
+
+    for _ in range(rng.randint(40, 120)):
+        x1, y1 = rng.randint(margin, width - margin), rng.randint(margin, height - margin)
+        if rng.random() < 0.5:
+            x2, y2 = rng.randint(margin, width - margin), y1
+        else:
+            x2, y2 = x1, rng.randint(margin, height - margin)
+        draw.line([x1, y1, x2, y2], fill=0, width=rng.choice((1, 1, 2, 3)))
+    for _ in range(rng.randint(5, 20)):
+        x, y = rng.randint(margin, width - margin), rng.randint(margin, height - margin)
+        r = rng.randint(10, max(11, width // 15))
+        draw.ellipse([x - r, y - r, x + r, y + r], outline=0, width=2)
+    for _ in range(rng.randint(20, 60)):
+        x, y = rng.randint(margin, width - margin * 4), rng.randint(margin, height - margin * 2)
+        draw.text((x, y), f"{rng.randint(1, 999)}.{rng.randint(0, 99):02d}", fill=0)
+
+    # Шум сканера: редкие серые точки
+    pixels = img.load()
+    for _ in range(width * height // 2000):
+        pixels[rng.randrange(width), rng.randrange(height)] = rng.randint(150, 230)
+
+    img = img.convert(spec.mode)
+    buffer = io.BytesIO()
+    save_kwargs = {"dpi": (spec.dpi, spec.dpi)}
+    if spec.format == "JPEG":
+        save_kwargs["quality"] = 85
+    if spec.format == "TIFF":
+        save_kwargs["compression"] = "tiff_lzw" if spec.mode != "1" else "group4"
+    img.save(buffer, format=spec.format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def drawing_filename(spec: DrawingSpec, seed: int = 0) -> str:
+    return f"{spec.name}_{seed}{EXTENSIONS[spec.format]}"
+
+
+def generate(profile: str = "standard", variants: int = 1) -> List[Tuple[str, bytes]]:
+    """
+    Список (имя файла, содержимое). variants > 1 дает разные файлы (разные
+    хеши) одного формата — нужно, чтобы загрузки не схлопывались дедупликацией.
+    """
+    return [
+        (drawing_filename(spec, seed), render_drawing(spec, seed))
+        for seed in range(variants)
+        for spec in PROFILES[profile]
+    ]
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+
+export ENV=production
+
+cd /media/D/cnc_base_prod
+source venv_prod/bin/activate
+python -m app.job_worker --processes 2
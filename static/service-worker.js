@@ -1,4 +1,6 @@
-const CACHE_NAME = 'qr-inventory-v1';
+const CACHE_NAME = 'qr-inventory-v2';
+// Чертежи по хешу неизменяемы, их можно брать из кеша без сети
+const DRAWINGS_CACHE_NAME = 'qr-inventory-drawings-v1';
 const urlsToCache = [
     '/',
     '/static/styles.css',
@@ -13,9 +15,56 @@ self.addEventListener('install', (event) => {
     );
 });
 
+self.addEventListener('activate', (event) => {
+    const keep = [CACHE_NAME, DRAWINGS_CACHE_NAME];
+    event.waitUntil(
+        caches.keys().then((names) => Promise.all(
+            names.filter((name) => !keep.includes(name)).map((name) => caches.delete(name))
+        ))
+    );
+});
+
+function isImmutableDrawing(request) {
+    const url = new URL(request.url);
+    return url.origin === self.location.origin && url.pathname.startsWith('/drawing_files/');
+}
+
 self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+
+    if (isImmutableDrawing(request)) {
+        // Range-запросы отдаем браузеру напрямую: кеш хранит только полные ответы
+        if (request.headers.has('range')) {
+            return;
+        }
+        event.respondWith(
+            caches.open(DRAWINGS_CACHE_NAME).then((cache) =>
+                cache.match(request).then((cached) => cached || fetch(request).then((response) => {
+                    // Необработанный чертеж отдается с no-cache: его кешировать нельзя
+                    const cacheControl = response.headers.get('Cache-Control') || '';
+                    if (response.status === 200 && cacheControl.includes('immutable')) {
+                        cache.put(request, response.clone());
+                    }
+                    return response;
+                }))
+            )
+        );
+        return;
+    }
+
+    // Остальное — сначала сеть, кеш только как запасной вариант без связи
     event.respondWith(
-        caches.match(event.request)
-            .then((response) => response || fetch(event.request))
+        fetch(request)
+            .then((response) => {
+                if (response.ok && urlsToCache.includes(new URL(request.url).pathname)) {
+                    const copy = response.clone();
+                    caches.open(CACHE_NAME).then((cache) => cache.put(request, copy));
+                }
+                return response;
+            })
+            .catch(() => caches.match(request))
     );
 });